@@ -0,0 +1,401 @@
+"""
+Stand-in for the local Telegram Bot API server, for benchmarks.
+
+Implements the methods the bot uses with canned responses. `getFile` writes a
+synthetic file of the registered size into a fake BOT_API_DIR, like the local
+server does, with injectable latency, bandwidth and failures. In remote mode the
+file is served from the file URL instead, with Range support and the bandwidth
+applied to each connection. Updates pushed with
+`push_update` are delivered through `getUpdates`, or POSTed to the webhook once
+one is set.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from urllib.parse import parse_qsl, unquote, urlparse
+
+logger = logging.getLogger(__name__)
+
+WRITE_CHUNK_SIZE = 4 * 1024 * 1024
+SEND_CHUNK_SIZE = 256 * 1024
+
+
+@dataclass
+class FakeBotApiConfig:
+    api_dir: str
+    token: str
+    latency: float = 0.0  # Seconds added to every request
+    bandwidth: float | None = None  # Bytes/s of each getFile transfer
+    server_bandwidth: float | None = None  # Bytes/s shared by all getFile transfers
+    failure_rate: float = 0.0  # Probability that a getFile request fails with a 502
+    local: bool = True  # Whether getFile writes the file, or it's served over HTTP
+
+
+@dataclass
+class RequestRecord:
+    method: str
+    params: dict
+    received_at: float
+
+
+@dataclass
+class FakeBotApiServer:
+    config: FakeBotApiConfig
+    host: str = "127.0.0.1"
+    port: int = 0
+    files: dict[str, int] = field(default_factory=dict)  # file_id -> size
+    requests: list[RequestRecord] = field(default_factory=list)
+
+    def __post_init__(self):
+        self._message_ids = itertools.count(1_000_000)
+        self._file_numbers = itertools.count()
+        self._served_files: dict[str, int] = {}  # file_path -> size, in remote mode
+        self._server_link: asyncio.Lock | None = None
+        self._content = os.urandom(WRITE_CHUNK_SIZE)
+        self._listeners: list = []
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._server: asyncio.Server | None = None
+        self._updates: list[dict] = []
+        self._updates_changed: asyncio.Condition | None = None
+        self._webhook: dict | None = None
+        self._webhook_queue: asyncio.Queue | None = None
+        self._webhook_workers: list[asyncio.Task] = []
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def add_listener(self, listener) -> None:
+        """Call `listener(record)` from the server thread for every request."""
+        self._listeners.append(listener)
+
+    def start(self) -> None:
+        """Run the server on its own event loop thread, so it doesn't skew the bot's."""
+        started = threading.Event()
+
+        def run() -> None:
+            self._loop = asyncio.new_event_loop()
+            self._updates_changed = asyncio.Condition()
+            self._server_link = asyncio.Lock()
+            self._webhook_queue = asyncio.Queue()
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port)
+            )
+            self.port = self._server.sockets[0].getsockname()[1]
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="fake-bot-api", daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def push_update(self, update: dict) -> None:
+        """Queue an update for the bot, from any thread."""
+        asyncio.run_coroutine_threadsafe(self._push_update(update), self._loop)
+
+    async def _push_update(self, update: dict) -> None:
+        if self._webhook:
+            self._webhook_queue.put_nowait(update)
+            return
+        async with self._updates_changed:
+            self._updates.append(update)
+            self._updates_changed.notify_all()
+
+    def stop(self) -> None:
+        if self._loop:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(5)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(5)
+            self._loop.close()
+
+    async def _shutdown(self) -> None:
+        self._server.close()
+        # Keep-alive connections are still waiting for their next request
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while (line := await reader.readline()).strip():
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                path = request_line.decode("latin-1").split()[1]
+                if path.startswith("/file/"):
+                    await self._serve_file(unquote(path), headers, writer)
+                    continue
+                status, payload = await self._dispatch(path, body)
+
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode()
+                    + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Cancelled by stop() while waiting on a keep-alive connection
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, path: str, body: bytes) -> tuple[str, dict]:
+        method = path.rsplit("/", 1)[-1]
+        params = {}
+        for key, value in parse_qsl(body.decode()):
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+
+        record = RequestRecord(method, params, time.monotonic())
+        self.requests.append(record)
+        for listener in self._listeners:
+            listener(record)
+
+        if self.config.latency:
+            await asyncio.sleep(self.config.latency)
+
+        handler = getattr(self, f"_method_{method}", None)
+        if handler is None:
+            return "200 OK", {"ok": True, "result": True}
+        return await handler(params)
+
+    async def _method_getMe(self, params: dict) -> tuple[str, dict]:
+        return "200 OK", {
+            "ok": True,
+            "result": {
+                "id": int(self.config.token.split(":")[0]),
+                "is_bot": True,
+                "first_name": "Benchmark",
+                "username": "benchmark_bot",
+            },
+        }
+
+    async def _method_getFile(self, params: dict) -> tuple[str, dict]:
+        if random.random() < self.config.failure_rate:
+            return "502 Bad Gateway", {"ok": False, "description": "Bad Gateway"}
+
+        file_id = str(params["file_id"])
+        size = self.files[file_id]
+        if not self.config.local:
+            file_path = f"documents/file_{next(self._file_numbers)}.mp4"
+            self._served_files[file_path] = size
+            return "200 OK", {
+                "ok": True,
+                "result": {
+                    "file_id": file_id,
+                    "file_unique_id": f"unique-{file_id}",
+                    "file_size": size,
+                    "file_path": file_path,
+                },
+            }
+
+        # Like telegram-bot-api, write to the temp directory and move the file to the
+        # documents directory once it is complete
+        bot_dir = os.path.join(self.config.api_dir, self.config.token)
+        documents_dir = os.path.join(bot_dir, "documents")
+        temp_dir = os.path.join(bot_dir, "temp")
+        path = os.path.join(documents_dir, f"file_{next(self._file_numbers)}.mp4")
+        temp_path = os.path.join(temp_dir, f"{random.getrandbits(64):016x}")
+
+        os.makedirs(documents_dir, exist_ok=True)
+        os.makedirs(temp_dir, exist_ok=True)
+        await self._write_file(temp_path, size)
+        await asyncio.to_thread(os.replace, temp_path, path)
+
+        return "200 OK", {
+            "ok": True,
+            "result": {
+                "file_id": file_id,
+                "file_unique_id": f"unique-{file_id}",
+                "file_size": size,
+                "file_path": path,
+            },
+        }
+
+    async def _serve_file(
+        self, path: str, headers: dict, writer: asyncio.StreamWriter
+    ) -> None:
+        prefix = f"/file/bot{self.config.token}/"
+        size = self._served_files.get(path.removeprefix(prefix))
+        if size is None:
+            writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+            await writer.drain()
+            return
+
+        start, end, status = 0, size, "200 OK"
+        if headers.get("range", "").startswith("bytes="):
+            first, _, last = headers["range"][6:].partition("-")
+            start, end = int(first), min(int(last) + 1 if last else size, size)
+            status = "206 Partial Content"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: application/octet-stream\r\n"
+            f"Content-Range: bytes {start}-{end - 1}/{size}\r\n"
+            f"Content-Length: {end - start}\r\n\r\n".encode()
+        )
+
+        # The file's bytes repeat the random content block
+        position = start
+        while position < end:
+            index = position % len(self._content)
+            data = self._content[index : index + min(end - position, SEND_CHUNK_SIZE)]
+            writer.write(data)
+            await writer.drain()
+            position += len(data)
+            if self.config.bandwidth:
+                await asyncio.sleep(len(data) / self.config.bandwidth)
+
+    def content(self, start: int, end: int) -> bytes:
+        """Bytes of a file served in remote mode, to check a download against."""
+        block = self._content * ((end - start) // len(self._content) + 2)
+        offset = start % len(self._content)
+        return block[offset : offset + end - start]
+
+    async def _write_file(self, path: str, size: int) -> None:
+        chunk = os.urandom(min(size, WRITE_CHUNK_SIZE))
+        written = 0
+        # Opened and closed in a thread too, like the writes
+        file = await asyncio.to_thread(open, path, "wb")
+        try:
+            while written < size:
+                data = chunk[: size - written]
+                await asyncio.to_thread(file.write, data)
+                written += len(data)
+                if self.config.bandwidth:
+                    await asyncio.sleep(len(data) / self.config.bandwidth)
+                if self.config.server_bandwidth:
+                    # Transfers take turns on the server's link
+                    async with self._server_link:
+                        await asyncio.sleep(len(data) / self.config.server_bandwidth)
+        finally:
+            await asyncio.to_thread(file.close)
+
+    def _message(self, params: dict, message_id: int | None = None) -> dict:
+        message = {
+            "message_id": message_id or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(params["chat_id"]), "type": "private"},
+            "text": params.get("text", ""),
+        }
+        if isinstance(params.get("reply_markup"), dict):
+            message["reply_markup"] = params["reply_markup"]
+        return message
+
+    async def _method_sendMessage(self, params: dict) -> tuple[str, dict]:
+        return "200 OK", {"ok": True, "result": self._message(params)}
+
+    async def _method_editMessageText(self, params: dict) -> tuple[str, dict]:
+        message = self._message(params, int(params["message_id"]))
+        return "200 OK", {"ok": True, "result": message}
+
+    async def _method_editMessageReplyMarkup(self, params: dict) -> tuple[str, dict]:
+        message = self._message(params, int(params["message_id"]))
+        return "200 OK", {"ok": True, "result": message}
+
+    async def _method_getUpdates(self, params: dict) -> tuple[str, dict]:
+        if self._webhook:
+            return "409 Conflict", {
+                "ok": False,
+                "error_code": 409,
+                "description": "Conflict: can't use getUpdates while webhook is active",
+            }
+
+        offset = int(params.get("offset", 0))
+        async with self._updates_changed:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            if not self._updates:
+                try:
+                    await asyncio.wait_for(
+                        self._updates_changed.wait(),
+                        float(params.get("timeout", 0)),
+                    )
+                except TimeoutError:
+                    pass
+            updates = self._updates[: int(params.get("limit", 100))]
+        return "200 OK", {"ok": True, "result": updates}
+
+    async def _method_setWebhook(self, params: dict) -> tuple[str, dict]:
+        await self._method_deleteWebhook({})
+        self._webhook = params
+        self._webhook_workers = [
+            asyncio.create_task(self._deliver_updates())
+            for _ in range(int(params.get("max_connections", 40)))
+        ]
+        # Like the Bot API server, deliver what was pending through the webhook
+        for update in self._updates:
+            self._webhook_queue.put_nowait(update)
+        self._updates.clear()
+        return "200 OK", {"ok": True, "result": True}
+
+    async def _method_deleteWebhook(self, params: dict) -> tuple[str, dict]:
+        self._webhook = None
+        for task in self._webhook_workers:
+            task.cancel()
+        self._webhook_workers.clear()
+        return "200 OK", {"ok": True, "result": True}
+
+    async def _deliver_updates(self) -> None:
+        """POST queued updates to the webhook over one keep-alive connection."""
+        url = urlparse(self._webhook["url"])
+        headers = f"Host: {url.netloc}\r\nContent-Type: application/json\r\n"
+        if self._webhook.get("secret_token"):
+            headers += (
+                f"X-Telegram-Bot-Api-Secret-Token: {self._webhook['secret_token']}\r\n"
+            )
+
+        reader = writer = None
+        try:
+            while True:
+                update = await self._webhook_queue.get()
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(
+                        url.hostname, url.port or 80
+                    )
+
+                data = json.dumps(update).encode()
+                writer.write(
+                    f"POST {url.path or '/'} HTTP/1.1\r\n{headers}"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode()
+                    + data
+                )
+                await writer.drain()
+
+                response_headers = {}
+                status = await reader.readline()
+                while (line := await reader.readline()).strip():
+                    key, _, value = line.decode("latin-1").partition(":")
+                    response_headers[key.strip().lower()] = value.strip()
+                await reader.readexactly(int(response_headers.get("content-length", 0)))
+
+                if b" 200 " not in status:
+                    logger.warning(f"Webhook responded with {status.decode().strip()}")
+                if response_headers.get("connection", "").lower() == "close":
+                    writer.close()
+                    writer = None
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            logger.warning(f"Webhook delivery failed: {e}")
+        finally:
+            if writer:
+                writer.close()
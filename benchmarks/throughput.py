@@ -0,0 +1,330 @@
+"""
+End-to-end throughput benchmark of the download and move path.
+
+Starts a fake Bot API server, drives `download()` and `button()` with synthetic
+updates for N files and reports files/s, MB/s, end-to-end latency percentiles
+and event-loop lag.
+
+Usage:
+    python -m benchmarks.throughput --files 20 --size-mb 50 --workers 4
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass, field
+
+from .fake_bot_api import FakeBotApiConfig, FakeBotApiServer
+
+TOKEN = "123456:BENCHMARK"
+USER_ID = 1
+
+
+@dataclass
+class Results:
+    files: int
+    total_bytes: int
+    elapsed: float
+    latencies: list[float]
+    failures: int
+    loop_lags: list[float] = field(default_factory=list)
+
+    @staticmethod
+    def percentile(values: list[float], percent: float) -> float:
+        if not values:
+            return 0.0
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+    def as_dict(self) -> dict:
+        return {
+            "files": self.files,
+            "failures": self.failures,
+            "elapsed_s": round(self.elapsed, 3),
+            "files_per_s": round(self.files / self.elapsed, 3),
+            "mb_per_s": round(self.total_bytes / 1024 / 1024 / self.elapsed, 3),
+            "latency_p50_s": round(self.percentile(self.latencies, 50), 3),
+            "latency_p95_s": round(self.percentile(self.latencies, 95), 3),
+            "loop_lag_p95_ms": round(self.percentile(self.loop_lags, 95) * 1000, 3),
+            "loop_lag_max_ms": round(max(self.loop_lags, default=0) * 1000, 3),
+        }
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--files", type=int, default=10, help="Number of files")
+    parser.add_argument("--size-mb", type=float, default=10, help="Size of each file")
+    parser.add_argument("--workers", type=int, default=2, help="Concurrent downloads")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Added latency")
+    parser.add_argument(
+        "--bandwidth-mb", type=float, default=None, help="Per-file transfer MB/s"
+    )
+    parser.add_argument(
+        "--server-bandwidth-mb",
+        type=float,
+        default=None,
+        help="MB/s shared by all transfers of a server",
+    )
+    parser.add_argument(
+        "--instances", type=int, default=1, help="Bot API server instances"
+    )
+    parser.add_argument(
+        "--failure-rate", type=float, default=0, help="Probability getFile fails"
+    )
+    parser.add_argument(
+        "--download-dir",
+        default=None,
+        help="Destination directory, e.g. on another mount to test cross-device moves",
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="Copy files across filesystems while they are still downloading",
+    )
+    parser.add_argument(
+        "--remote",
+        action="store_true",
+        help="Fetch files over HTTP as from a remote Bot API server",
+    )
+    parser.add_argument(
+        "--ranged-connections", type=int, default=4, help="Connections per file"
+    )
+    parser.add_argument("--chunk-mb", type=int, default=8, help="Range request size")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds to wait")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    return parser.parse_args(argv)
+
+
+def configure_environment(
+    args: argparse.Namespace,
+    work_dir: str,
+    url: str,
+    extra_servers: list[dict] | None = None,
+) -> None:
+    """Point the bot's settings at the fake servers. Must run before importing src."""
+    download_dir = args.download_dir or os.path.join(work_dir, "downloads")
+    os.environ.update(
+        {
+            "BOT_API_SERVERS": json.dumps(extra_servers or []),
+            "BOT_TOKEN": TOKEN,
+            "LOCAL_BOT_API_URL": url,
+            "BOT_API_DIR": os.path.join(work_dir, "bot-api") + os.sep,
+            "DOWNLOAD_TO_DIR": os.path.join(download_dir, ""),
+            "USER_ID": str(USER_ID),
+            "CHAT_ID": str(USER_ID),
+            "MAX_CONCURRENT_DOWNLOADS": str(args.workers),
+            "JOURNAL_PATH": os.path.join(work_dir, "journal.sqlite3"),
+            "BATCH_WINDOW": "0.2",
+            "RETRY_BASE_DELAY": "0.1",
+            "RETRY_MAX_DELAY": "1",
+            "BREAKER_RESET_TIMEOUT": "1",
+            # Don't let the chat rate limit hide the download path's own speed
+            "MESSAGES_PER_SECOND_PER_CHAT": "1000",
+            "MESSAGES_PER_SECOND": "1000",
+            "PIPELINED_MOVE": str(args.pipelined).lower(),
+            "LOCAL_MODE": str(not args.remote).lower(),
+            "RANGED_CONNECTIONS": str(args.ranged_connections),
+            "RANGED_CHUNK_SIZE_MB": str(args.chunk_mb),
+        }
+    )
+
+
+def message_update(update_id: int, message: dict) -> dict:
+    return {"update_id": update_id, "message": message}
+
+
+def document_message(message_id: int, file_id: str, size: int) -> dict:
+    return {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": USER_ID, "type": "private"},
+        "from": {"id": USER_ID, "is_bot": False, "first_name": "Benchmark"},
+        "document": {
+            "file_id": file_id,
+            "file_unique_id": f"unique-{file_id}",
+            "file_name": f"{file_id}.mp4",
+            "mime_type": "video/mp4",
+            "file_size": size,
+        },
+    }
+
+
+def callback_update(update_id: int, message: dict, data: str) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": USER_ID, "is_bot": False, "first_name": "Benchmark"},
+            "chat_instance": "benchmark",
+            "data": data,
+            "message": {
+                "message_id": message["message_id"],
+                "date": int(time.time()),
+                "chat": {"id": USER_ID, "type": "private"},
+                "text": message.get("text", ""),
+            },
+        },
+    }
+
+
+async def sample_loop_lag(lags: list[float], interval: float = 0.01) -> None:
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.monotonic() - start - interval))
+
+
+async def run(args: argparse.Namespace) -> Results:
+    work_dir = tempfile.mkdtemp(prefix="downloader-bench-")
+    size = int(args.size_mb * 1024 * 1024)
+
+    servers = [
+        FakeBotApiServer(
+            FakeBotApiConfig(
+                api_dir=os.path.join(work_dir, f"bot-api-{i}" if i else "bot-api"),
+                token=TOKEN,
+                latency=args.latency_ms / 1000,
+                bandwidth=args.bandwidth_mb * 1024 * 1024
+                if args.bandwidth_mb
+                else None,
+                server_bandwidth=(
+                    args.server_bandwidth_mb * 1024 * 1024
+                    if args.server_bandwidth_mb
+                    else None
+                ),
+                failure_rate=args.failure_rate,
+                local=not args.remote,
+            )
+        )
+        for i in range(args.instances)
+    ]
+    for server in servers:
+        server.start()
+    server = servers[0]
+    extra_servers = [
+        {"url": extra.url, "dir": extra.config.api_dir + os.sep, "name": f"fake-{i}"}
+        for i, extra in enumerate(servers[1:], start=1)
+    ]
+    configure_environment(args, work_dir, server.url, extra_servers)
+
+    from telegram import Update
+
+    from src import bot as bot_module
+
+    loop = asyncio.get_running_loop()
+    confirmations: asyncio.Queue[dict] = asyncio.Queue()
+    finished: asyncio.Queue[tuple[int, bool]] = asyncio.Queue()
+
+    def on_request(record) -> None:
+        # Called from the fake server's thread
+        if record.method != "sendMessage":
+            return
+        text = record.params.get("text", "")
+        if "Yes" in json.dumps(record.params.get("reply_markup", "")):
+            loop.call_soon_threadsafe(confirmations.put_nowait, record.params)
+        elif text.startswith(("✅", "⛔")):
+            reply_to = record.params["reply_parameters"]["message_id"]
+            loop.call_soon_threadsafe(
+                finished.put_nowait, (reply_to, text.startswith("✅"))
+            )
+
+    server.add_listener(on_request)
+
+    application = bot_module.build_application()
+    await application.initialize()
+    await bot_module.post_init(application)
+    bot = application.bot
+
+    lags: list[float] = []
+    lag_task = asyncio.create_task(sample_loop_lag(lags))
+
+    update_ids = iter(range(1, 1_000_000))
+    sent_at: dict[int, float] = {}
+    start = time.monotonic()
+
+    try:
+        for i in range(args.files):
+            file_id = f"bench-{i}"
+            for instance in servers:
+                instance.files[file_id] = size
+            message = document_message(i + 1, file_id, size)
+            sent_at[i + 1] = time.monotonic()
+            await application.process_update(
+                Update.de_json(message_update(next(update_ids), message), bot)
+            )
+
+        # Confirm every batch the bot asks about
+        latencies, failures = [], 0
+        deadline = start + args.timeout
+        while len(latencies) + failures < args.files:
+            confirm = asyncio.create_task(confirmations.get())
+            done = asyncio.create_task(finished.get())
+            ready, pending = await asyncio.wait(
+                {confirm, done},
+                timeout=deadline - time.monotonic(),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in pending:
+                task.cancel()
+            if not ready:
+                raise TimeoutError("Benchmark timed out")
+
+            if confirm in ready:
+                params = confirm.result()
+                data = params["reply_markup"]["inline_keyboard"][0][0]["callback_data"]
+                await application.process_update(
+                    Update.de_json(
+                        callback_update(next(update_ids), {"message_id": 1}, data),
+                        bot,
+                    )
+                )
+            if done in ready:
+                reply_to, success = done.result()
+                if success:
+                    latencies.append(time.monotonic() - sent_at[reply_to])
+                else:
+                    failures += 1
+
+        elapsed = time.monotonic() - start
+    finally:
+        lag_task.cancel()
+        await bot_module.post_shutdown(application)
+        await application.shutdown()
+        for instance in servers:
+            instance.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if args.download_dir:
+            for i in range(args.files):
+                path = os.path.join(args.download_dir, f"bench-{i}.mp4")
+                if os.path.exists(path):
+                    os.remove(path)
+
+    return Results(
+        files=len(latencies),
+        total_bytes=len(latencies) * size,
+        elapsed=elapsed,
+        latencies=latencies,
+        failures=failures,
+        loop_lags=lags,
+    )
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    results = asyncio.run(run(args)).as_dict()
+    if args.json:
+        print(json.dumps(results))
+    else:
+        for key, value in results.items():
+            print(f"{key:>18}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Update-to-handler latency benchmark of polling and webhook modes.
+
+Starts a fake Bot API server and pushes text message updates to it at a fixed
+rate, delivered through long polling and then through the webhook server. Reports
+the latency percentiles from an update being queued on the server to the bot's
+handlers receiving it.
+
+Usage:
+    python -m benchmarks.update_latency --updates 500 --rate 100
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import secrets
+import shutil
+import tempfile
+import time
+
+from . import throughput
+from .fake_bot_api import FakeBotApiConfig, FakeBotApiServer
+from .throughput import TOKEN, USER_ID, configure_environment
+
+MODES = ("polling", "webhook")
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--updates", type=int, default=200, help="Updates per mode")
+    parser.add_argument("--rate", type=float, default=100, help="Updates per second")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Added latency")
+    parser.add_argument(
+        "--max-connections", type=int, default=40, help="Webhook connections"
+    )
+    parser.add_argument("--mode", choices=MODES, help="Only benchmark one mode")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    return parser.parse_args(argv)
+
+
+def text_update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": USER_ID, "type": "private"},
+            "from": {"id": USER_ID, "is_bot": False, "first_name": "Benchmark"},
+            "text": "ping",
+        },
+    }
+
+
+def summarize(latencies: list[float]) -> dict:
+    values = sorted(latencies)
+
+    def percentile(percent: float) -> float:
+        index = min(len(values) - 1, int(len(values) * percent / 100))
+        return round(values[index] * 1000, 3)
+
+    return {
+        "updates": len(values),
+        "latency_p50_ms": percentile(50),
+        "latency_p95_ms": percentile(95),
+        "latency_p99_ms": percentile(99),
+        "latency_max_ms": round(values[-1] * 1000, 3),
+    }
+
+
+async def measure(
+    args: argparse.Namespace, server: FakeBotApiServer, mode: str, first_id: int
+) -> list[float]:
+    from telegram import Update
+    from telegram.ext import TypeHandler
+
+    from src import bot as bot_module
+    from src.utils import WebhookServer
+
+    pushed_at: dict[int, float] = {}
+    received_at: dict[int, float] = {}
+    all_received = asyncio.Event()
+
+    async def record(update: Update, context) -> None:
+        received_at[update.update_id] = time.monotonic()
+        if len(received_at) == args.updates:
+            all_received.set()
+
+    # Same application and handlers as the bot, with a probe in front of them
+    application = bot_module.build_application()
+    application.add_handler(TypeHandler(Update, record), group=-1)
+    await application.initialize()
+    await application.start()
+
+    webhook_server = None
+    if mode == "webhook":
+        secret_token = secrets.token_urlsafe(32)
+        webhook_server = WebhookServer(
+            application, "127.0.0.1", 0, "/webhook", secret_token, args.max_connections
+        )
+        await webhook_server.start()
+        await application.bot.set_webhook(
+            f"http://127.0.0.1:{webhook_server.port}/webhook",
+            secret_token=secret_token,
+            max_connections=args.max_connections,
+        )
+    else:
+        await application.updater.start_polling(poll_interval=0, timeout=10)
+
+    try:
+        start = time.monotonic()
+        for i in range(args.updates):
+            # Pace the updates from a fixed schedule, not from the previous send
+            await asyncio.sleep(max(0.0, start + i / args.rate - time.monotonic()))
+            update_id = first_id + i
+            pushed_at[update_id] = time.monotonic()
+            server.push_update(text_update(update_id))
+
+        await asyncio.wait_for(all_received.wait(), args.timeout)
+    finally:
+        if webhook_server:
+            await webhook_server.stop()
+        if application.updater.running:
+            await application.updater.stop()
+        await application.stop()
+        await application.shutdown()
+
+    return [received_at[i] - pushed_at[i] for i in pushed_at]
+
+
+async def run(args: argparse.Namespace) -> dict[str, dict]:
+    work_dir = tempfile.mkdtemp(prefix="downloader-bench-")
+    server = FakeBotApiServer(
+        FakeBotApiConfig(api_dir=work_dir, token=TOKEN, latency=args.latency_ms / 1000)
+    )
+    server.start()
+    # The bot's settings don't matter here, use those of the throughput benchmark
+    configure_environment(throughput.parse_args([]), work_dir, server.url)
+
+    results = {}
+    try:
+        for number, mode in enumerate([args.mode] if args.mode else MODES):
+            latencies = await measure(args, server, mode, number * args.updates + 1)
+            results[mode] = summarize(latencies)
+    finally:
+        server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results))
+    else:
+        for mode, summary in results.items():
+            print(mode)
+            for key, value in summary.items():
+                print(f"{key:>18}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,143 @@
+import asyncio
 import logging
+import secrets
+import signal
+from urllib.parse import urlparse
 
-from telegram import Update
+from telegram import Bot, Update
 from telegram.ext import Application, CommandHandler, ContextTypes
 
-from .cogs import downloader_commands, error_handler, general_commands
-from .utils import env
+from .cogs import (
+    bot_api_caches,
+    content_verifier,
+    download_journal,
+    download_scheduler,
+    downloader_commands,
+    error_handler,
+    general_commands,
+    media_extractor,
+    process_download,
+    progress_sampler,
+    resume_downloads,
+    status_dashboards,
+)
+from .utils import (
+    WebhookServer,
+    bot_api_pool,
+    env,
+    file_index,
+    fs,
+    message_dispatcher,
+    tracer,
+)
+from .utils.metrics import InstrumentedRequest, LoopLagMonitor, MetricsServer
+from .utils.request import RoutedRequest
 
 logger = logging.getLogger(__name__)
 
+loop_lag_monitor = LoopLagMonitor(
+    threshold=env.LOOP_LAG_THRESHOLD, capture_stacks=env.LOOP_LAG_STACKS
+)
+metrics_server = (
+    MetricsServer(env.METRICS_HOST, env.METRICS_PORT) if env.METRICS_PORT else None
+)
+
 
 async def bad_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Raise an error to trigger the error handler."""
     await context.bot.wrong_method_name()  # type: ignore[attr-defined]
 
 
-def main() -> None:
+async def post_init(application: Application) -> None:
+    """Start background services once the application is initialized."""
+    loop_lag_monitor.start()
+    tracer.start()
+    if metrics_server:
+        await metrics_server.start()
+    await download_journal.start()
+    await asyncio.to_thread(
+        lambda: file_index.build(
+            download_journal.completed(),
+            [(name, digest) for name, _, digest, _ in download_journal.hashes()],
+        )
+    )
+    downloaded = await asyncio.to_thread(download_journal.downloaded)
+    for cache in bot_api_caches.values():
+        await asyncio.to_thread(cache.build, downloaded)
+    await asyncio.to_thread(download_journal.prune, file_index.names)
+    message_dispatcher.start(application.bot)
+    await bot_api_pool.start(application.bot)
+    download_scheduler.start(application.bot, process_download)
+    progress_sampler.start()
+    status_dashboards.start()
+    for cache in bot_api_caches.values():
+        cache.start()
+    if env.MEDIA_INFO:
+        media_extractor.start()
+    await resume_downloads(application.bot)
+
+
+async def post_shutdown(application: Application) -> None:
+    """Stop background services before the application exits."""
+    await content_verifier.stop()
+    for cache in bot_api_caches.values():
+        await cache.stop()
+    await status_dashboards.stop()
+    await progress_sampler.stop()
+    await download_scheduler.stop()
+    await bot_api_pool.stop()
+    await media_extractor.stop()
+    await message_dispatcher.stop()
+    await download_journal.close()
+    if metrics_server:
+        await metrics_server.stop()
+    await tracer.stop()
+    fs.shutdown()
+    await loop_lag_monitor.stop()
+
+
+def build_application() -> Application:
+    """Create the Application with all handlers registered."""
+    # Long getFile calls get their own connections, so replies don't wait for them
+    message_request = InstrumentedRequest(
+        "messages",
+        connection_pool_size=env.MESSAGE_POOL_SIZE,
+        read_timeout=env.MESSAGE_READ_TIMEOUT,
+    )
+    file_request = InstrumentedRequest(
+        "files",
+        connection_pool_size=env.FILE_POOL_SIZE or env.MAX_CONCURRENT_DOWNLOADS,
+        read_timeout=env.FILE_READ_TIMEOUT,
+        pool_timeout=None,
+    )
+
+    # The other Bot API instances are only used to fetch files
+    for instance in bot_api_pool.instances[1:]:
+        instance.bot = Bot(
+            env.BOT_TOKEN,
+            base_url=f"{instance.url}/bot",
+            base_file_url=f"{instance.url}/file/bot",
+            local_mode=env.LOCAL_MODE,
+            request=InstrumentedRequest(
+                f"files-{instance.name}",
+                connection_pool_size=env.FILE_POOL_SIZE or env.MAX_CONCURRENT_DOWNLOADS,
+                read_timeout=env.FILE_READ_TIMEOUT,
+                pool_timeout=None,
+            ),
+        )
+
     # Create the Application and pass it your bot's token.
     application = (
         Application.builder()
         .token(env.BOT_TOKEN)
         .concurrent_updates(True)
-        .local_mode(True)
+        .request(RoutedRequest(message_request, {"getFile": file_request}))
+        .get_updates_request(InstrumentedRequest("updates"))
+        .local_mode(env.LOCAL_MODE)
         .base_url(f"{env.LOCAL_BOT_API_URL}/bot")
         .base_file_url(f"{env.LOCAL_BOT_API_URL}/file/bot")
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
         .build()
     )
 
@@ -34,5 +149,59 @@ def main() -> None:
     # error handler
     application.add_error_handler(error_handler)
 
+    return application
+
+
+async def run_webhook(application: Application) -> None:
+    """Run the bot, receiving updates pushed by the Bot API server to a webhook."""
+    secret_token = env.WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32)
+    server = WebhookServer(
+        application,
+        env.WEBHOOK_LISTEN,
+        env.WEBHOOK_PORT,
+        urlparse(env.WEBHOOK_URL).path or "/",
+        secret_token,
+        env.WEBHOOK_MAX_CONNECTIONS,
+    )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows, Ctrl-C raises KeyboardInterrupt
+            pass
+
+    # Same lifecycle as run_polling, with the webhook server instead of the updater
+    await application.initialize()
+    try:
+        await application.post_init(application)
+        await application.start()
+        await server.start()
+        await application.bot.set_webhook(
+            env.WEBHOOK_URL,
+            secret_token=secret_token,
+            max_connections=env.WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await stop.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        await application.post_shutdown(application)
+
+
+def main() -> None:
+    application = build_application()
+
     # Run the bot until the user presses Ctrl-C
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if env.WEBHOOK_URL:
+        try:
+            asyncio.run(run_webhook(application))
+        except KeyboardInterrupt:
+            pass
+    else:
+        # Also removes the webhook, if one was set
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
@@ -1,17 +1,48 @@
-from .downloader import button, download, status
+from .downloader import (
+    bot_api_caches,
+    button,
+    cancel,
+    content_verifier,
+    download,
+    download_history,
+    download_journal,
+    download_scheduler,
+    expired_button,
+    media_extractor,
+    pause,
+    process_download,
+    progress_sampler,
+    resume,
+    resume_downloads,
+    status,
+    status_dashboards,
+    status_page,
+    throttle,
+    verify,
+)
 from .error_handler import error_handler
-from .general import help_command, info, start, storage
+from .general import help_command, info, profile, start, stats, storage
 
 # Specify the commands for the bot
 general_commands: list = [
     help_command,
     info,
+    profile,
     start,
+    stats,
     storage
 ]
 
 downloader_commands: list = [
     button,
+    cancel,
     download,
+    pause,
+    resume,
     status,
+    status_page,
+    throttle,
+    verify,
+    # Last, so it only gets the button clicks no other handler matched
+    expired_button,
 ]
@@ -1,70 +1,261 @@
 import asyncio
+import functools
 import logging
 import math
 import os
 import platform
-import shutil
+import time
 import traceback
 
 from telegram import (
+    Bot,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     Update,
 )
 from telegram.ext import ContextTypes, filters
 
-from ..middlewares.auth import auth_required
+from ..middlewares.auth import admin_required, auth_required
 from ..middlewares.handlers import (
     callback_query_handler,
     command_handler,
     message_handler,
 )
-from ..models import DownloadFile, downloading_files
-from ..utils import check_file_exists, env, get_file
+from ..models import (
+    DownloadBatch,
+    DownloadFile,
+    JobState,
+    downloading_files,
+    pending_batches,
+)
+from ..utils import (
+    Batcher,
+    BotApiCache,
+    ContentVerifier,
+    DashboardManager,
+    DedupMode,
+    DiskSpaceManager,
+    DownloadHistory,
+    DownloadJournal,
+    DownloadScheduler,
+    MediaInfoExtractor,
+    ProgressSampler,
+    QuotaExceeded,
+    TailCopier,
+    access_control,
+    bot_api_pool,
+    check_files_exist,
+    cross_device_move,
+    env,
+    file_index,
+    get_file,
+    io_limiter,
+    message_dispatcher,
+    metrics,
+    tracer,
+    trancute_message,
+    volume_router,
+)
+from ..utils.content_hash import VerifyReport, hash_file, link_duplicate, new_hasher
+from ..utils.dashboard import PAGE_CALLBACK_PREFIX
+from ..utils.fs import FilesystemTimeout, fs
+from ..utils.mover import MoveCancelled, TailCopyError
 
 logger = logging.getLogger(__name__)
 
 # Environment variables
-BOT_TOKEN = env.BOT_TOKEN
 BOT_API_DIR = env.BOT_API_DIR
 DOWNLOAD_TO_DIR = env.DOWNLOAD_TO_DIR
 
-# Replacing colons with a different character for Windows
-TOKEN_SUB_DIR = BOT_TOKEN.replace(":", "") if os.name == "nt" else BOT_TOKEN
+# Number of file names listed in a batch confirmation
+BATCH_LIST_LIMIT = 20
 
+# Number of downloads per /status page
+STATUS_PAGE_SIZE = 5
 
-@command_handler("status")
-async def status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Send downloading files status to the user."""
+
+# Background services of the download jobs, started in the application's post_init
+
+# Persistent record of the download jobs, replayed on startup
+download_journal = DownloadJournal(
+    env.JOURNAL_PATH or f"{BOT_API_DIR}downloader-journal.sqlite3",
+    flush_interval=env.JOURNAL_FLUSH_INTERVAL,
+    retention=env.JOURNAL_RETENTION_DAYS * 86400,
+    kept_files=lambda: file_index.names,
+)
+
+# Reserves space on the download filesystems before a job is started
+disk_space = DiskSpaceManager(
+    [instance.documents_dir for instance in bot_api_pool.instances],
+    volume_router,
+    margin=env.DISK_SPACE_MARGIN_MB * 1024 * 1024,
+    ttl=env.DISK_USAGE_TTL,
+)
+
+# Download queue
+download_scheduler = DownloadScheduler(
+    env.MAX_CONCURRENT_DOWNLOADS,
+    shortest_job_first=env.SHORTEST_JOB_FIRST,
+    disk_space=disk_space,
+    access=access_control,
+)
+
+# Samples the partial files written by the local Bot API servers
+progress_sampler = ProgressSampler(
+    [
+        directory
+        for instance in bot_api_pool.instances
+        for directory in (instance.temp_dir, instance.documents_dir)
+    ],
+    interval=env.PROGRESS_INTERVAL,
+)
+
+# Completed downloads kept in the Bot API directories, e.g. after a failed move,
+# by the directory of each instance
+bot_api_caches = {
+    instance.documents_dir: BotApiCache(
+        instance.documents_dir,
+        max_size=env.BOT_API_CACHE_MAX_MB * 1024 * 1024,
+        sweep_interval=env.BOT_API_CACHE_SWEEP_INTERVAL,
+        orphan_age=env.BOT_API_ORPHAN_AGE,
+    )
+    for instance in bot_api_pool.instances
+}
+
+# Reads the duration, resolution and codecs of the downloaded files
+media_extractor = MediaInfoExtractor(
+    env.MEDIA_INFO_WORKERS, queue_size=env.MEDIA_INFO_QUEUE_SIZE
+)
+
+# Finished jobs, for /stats
+download_history = DownloadHistory(env.HISTORY_MAX_RECORDS, env.STATS_WINDOWS)
+
+# Background integrity check of the download directory
+content_verifier = ContentVerifier(
+    file_index,
+    download_journal,
+    bytes_per_second=env.VERIFY_MAX_MB_PER_SECOND * 1024 * 1024,
+)
+
+
+# Gauges for the metrics endpoint, read when it is scraped
+metrics.Gauge(
+    "downloader_queue_depth",
+    "Download jobs waiting in the queue.",
+    lambda: download_scheduler.queued_count,
+)
+metrics.Gauge(
+    "downloader_in_flight",
+    "Download jobs being downloaded or moved.",
+    lambda: download_scheduler.running_count,
+)
+metrics.Gauge(
+    "downloader_disk_reserved_bytes",
+    "Disk space reserved by running download jobs.",
+    lambda: disk_space.reserved_bytes,
+)
+metrics.Gauge(
+    "downloader_bot_api_cache_bytes",
+    "Size of the completed downloads kept in the Bot API directories.",
+    lambda: sum(cache.size for cache in bot_api_caches.values()),
+)
+metrics.LabeledGauge(
+    "downloader_bot_api_instance_in_flight",
+    "Files being fetched from each Bot API instance.",
+    "instance",
+    lambda: {i.name: i.in_flight for i in bot_api_pool.instances},
+)
+metrics.LabeledGauge(
+    "downloader_bot_api_instance_healthy",
+    "Whether each Bot API instance passed its last health check.",
+    "instance",
+    lambda: {i.name: int(i.healthy) for i in bot_api_pool.instances},
+)
+metrics.LabeledGauge(
+    "downloader_io_limit_bytes_per_second",
+    "Current rate limit of moves and remote downloads, 0 when unlimited.",
+    "limit",
+    lambda: {
+        volume or "overall": io_limiter.limit(volume)[0] or 0
+        for volume in [None, *volume_router.volumes]
+    },
+)
+
+
+def render_status(page: int) -> tuple[str, int]:
+    """Render a page of the downloading files status."""
     if not downloading_files:
-        await update.message.reply_text("No files are being downloaded at the moment.")
-        return
+        return "No files are being downloaded at the moment\\.", 1
 
-    status_message = "*Downloading files status:*\nPage 1\n"
+    files = list(downloading_files.values())
+    page_count = math.ceil(len(files) / STATUS_PAGE_SIZE)
+    page = min(page, page_count - 1)
 
-    for i, file in enumerate(downloading_files.values(), start=1):
+    status_message = "*Downloading files status:*\n"
+    if download_scheduler.paused:
+        status_message += "⏸ _Queue paused_\n"
+    if not bot_api_pool.available:
+        status_message += "🔌 _Bot API server unavailable, downloads are waiting_\n"
+    if download_scheduler.held_count:
+        held = download_scheduler.held_count
+        status_message += f"💽 _{held} download\\(s\\) waiting for disk space_\n"
+    status_message += "\n"
+
+    start = page * STATUS_PAGE_SIZE
+    for i, file in enumerate(files[start : start + STATUS_PAGE_SIZE], start=start + 1):
         file_status = (
-            f"> 📄 *File name:*   `{file.file_name}`\n"
+            f"> *{i}\\.* 📄 *File name:*   `{file.file_name}`\n"
             f"> 💾 *File size:*   `{file.file_size_mb}`\n"
             f"> ⏰ *Start time:*   `{file.start_datetime}`\n"
             f"> ⏱ *Duration:*   `{file.current_download_duration}`\n"
             f"> 🔻 *Retries:*   `{file.download_retries}`\n"
-            f"> 🔄 *Status:*   `{file.status}`\n\n"
+            f"> 🔄 *Status:*   `{file.status}`\n"
         )
-        status_message += file_status
+        if file.user_id and len(access_control.users) > 1:
+            file_status += f"> 👤 *User:*   `{file.user_id}`\n"
+        if file.bot_api_instance and len(bot_api_pool.instances) > 1:
+            file_status += f"> 🖥 *Bot API:*   `{file.bot_api_instance}`\n"
+        if file.download_retries:
+            file_status += (
+                f"> ⏳ *Backoff:*   `{file.total_backoff:.1f} secs`\n"
+                f"> ⚠️ *Last error:*   `{file.last_error}`\n"
+            )
+        if file.status == "Downloading" and file.bytes_downloaded:
+            file_status += f"> 📶 *Progress:*   `{file.download_progress}`\n"
+        if file.status == "Downloading" and file.bytes_moved:
+            copied = DownloadFile.convert_size(file.bytes_moved)
+            file_status += f"> ⏩ *Copied ahead:*   `{copied}`\n"
+        if file.status == "Moving":
+            file_status += f"> 📦 *Moved:*   `{file.move_progress}`\n"
+        if file.media_info:
+            file_status += f"> 🎞 *Media:*   `{file.media_info.summary}`\n"
+        status_message += file_status + "\n"
 
-        if i % 2 == 0 or i == len(downloading_files):
-            # Add page number
-            if i > 2:
-                status_message = f"Page {math.ceil(i / 2)}\n" + status_message
+    return status_message, page_count
 
-            await context.bot.send_message(
-                chat_id=update.message.chat_id,
-                text=status_message,
-                parse_mode="MarkdownV2",
-            )
-            status_message = ""
-            await asyncio.sleep(0.3)
+
+# Self-updating /status messages
+status_dashboards = DashboardManager(
+    render_status, interval=env.STATUS_REFRESH_INTERVAL
+)
+
+
+@command_handler("status")
+async def status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Send a status dashboard of the downloading files, updated in place."""
+    await status_dashboards.open(update.effective_chat.id)
+
+
+@callback_query_handler(pattern=f"^{PAGE_CALLBACK_PREFIX}\\d+$")
+async def status_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Switch the status dashboard to another page."""
+    query = update.callback_query
+    await query.answer()
+
+    page = int(query.data.removeprefix(PAGE_CALLBACK_PREFIX))
+    status_dashboards.show_page(
+        update.effective_chat.id, update.effective_message.message_id, page
+    )
 
 
 @message_handler(filters.Document.VIDEO)
@@ -73,95 +264,381 @@ async def download(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Download the file sent by the user."""
     logger.info("Download command received")
 
-    try:
-        check_file_exists(
-            update.message.document.file_id, update.message.document.file_name
-        )
-    except Exception as e:
-        logger.error(f"Error checking file exists: {e}")
-        await update.message.reply_text(
-            f"⛔ File already exists\!\nError:```\n{e}```",
+    # Group albums and files forwarded together into one confirmation
+    message = update.message
+    document = message.document
+    download_file = DownloadFile(
+        document.file_id,
+        document.file_name,
+        document.file_size,
+        file_unique_id=document.file_unique_id,
+        chat_id=message.chat_id,
+        user_id=message.from_user.id if message.from_user else None,
+        message_id=message.message_id,
+        mime_type=document.mime_type,
+    )
+    with tracer.span(
+        "receive",
+        download_file.trace_id,
+        size=download_file.file_size,
+        mime_type=download_file.mime_type,
+        user_id=download_file.user_id,
+    ):
+        download_batcher.add((message.chat_id, message.media_group_id), download_file)
+
+
+async def confirm_batch(files: list[DownloadFile]) -> None:
+    """Ask the user to confirm the download of a batch of files."""
+    batch = DownloadBatch(files[0].chat_id, files)
+    batch.duplicates = await check_files_exist(files)
+
+    if len(files) == 1 and batch.duplicates:
+        message_dispatcher.send_message(
+            batch.chat_id,
+            f"⛔ File already exists\\!\nError:```\n{batch.duplicates[files[0].file_id]}```",
+            reply_to_message_id=files[0].message_id,
             parse_mode="MarkdownV2",
         )
         return
 
-    # File details
-    file_name = update.message.document.file_name
-    file_size = DownloadFile.convert_size(update.message.document.file_size)
+    if len(files) == 1:
+        response_message = (
+            f"Are you sure you want to download the file?\n\n"
+            f"> 📄 *File name:*   `{files[0].file_name}`\n"
+            f"> 💾 *File size:*   `{files[0].file_size_mb}`\n"
+        )
+    else:
+        new_files = [file for file in files if file.file_id not in batch.duplicates]
+        if not new_files:
+            message_dispatcher.send_message(
+                batch.chat_id,
+                f"⛔ All {len(files)} files already exist or are being downloaded.",
+                reply_to_message_id=files[0].message_id,
+            )
+            return
+
+        file_list = "\n".join(
+            f"> `{file.file_name}`" for file in new_files[:BATCH_LIST_LIMIT]
+        )
+        if len(new_files) > BATCH_LIST_LIMIT:
+            file_list += f"\n> _and {len(new_files) - BATCH_LIST_LIMIT} more_"
 
-    response_message = (
-        f"Are you sure you want to download the file?\n\n"
-        f"> 📄 *File name:*   `{file_name}`\n"
-        f"> 💾 *File size:*   `{file_size}`\n"
-    )
+        response_message = (
+            f"Are you sure you want to download {len(new_files)} files?\n\n"
+            f"> 💾 *Total size:*   `{DownloadFile.convert_size(sum(f.file_size for f in new_files))}`\n"
+            f"> ♻️ *Duplicates skipped:*   `{len(batch.duplicates)}`\n\n"
+            f"{file_list}"
+        )
+
+    # Forget the confirmations that were never answered
+    for batch_id in [
+        batch_id
+        for batch_id, pending in pending_batches.items()
+        if pending.expired(env.CONFIRMATION_TTL)
+    ]:
+        del pending_batches[batch_id]
+    pending_batches[batch.batch_id] = batch
 
     # Confirmation message
-    await context.bot.send_message(
-        chat_id=update.message.chat_id,
-        text=response_message,
-        reply_to_message_id=update.message.message_id,
+    message_dispatcher.send_message(
+        batch.chat_id,
+        response_message,
+        reply_to_message_id=files[0].message_id,
         parse_mode="MarkdownV2",
         reply_markup=InlineKeyboardMarkup(
             [
                 [
-                    InlineKeyboardButton("Yes", callback_data="yes"),
-                    InlineKeyboardButton("No", callback_data="no"),
+                    InlineKeyboardButton("Yes", callback_data=f"yes:{batch.batch_id}"),
+                    InlineKeyboardButton("No", callback_data=f"no:{batch.batch_id}"),
                 ]
             ]
         ),
     )
 
 
-@callback_query_handler()
+# Collects files sent together before asking for confirmation
+download_batcher = Batcher(
+    confirm_batch, window=env.BATCH_WINDOW, max_wait=env.BATCH_MAX_WAIT
+)
+
+
+@callback_query_handler(pattern="^(yes|no):[0-9a-f]+$")
 @auth_required
 async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle the confirmation button click for downloading the file."""
+    """Handle the confirmation button click for downloading the files."""
     logger.info("Button command received")
     query = update.callback_query
+    answer, batch_id = query.data.split(":")
 
-    await query.answer()
+    # In a group, only the user who sent the files can answer
+    batch = pending_batches.get(batch_id)
+    if batch is not None and update.effective_user.id != batch.files[0].user_id:
+        await query.answer("Only the sender of these files can confirm them.")
+        return
 
-    # Replied to message
-    message = update.effective_message.reply_to_message
-    file_id = message.document.file_id
-    file_name = message.document.file_name
-    file_size = message.document.file_size
+    await query.answer()
 
     # Remove buttons from the message
     await update.effective_message.edit_reply_markup(reply_markup=None)
 
-    if query.data == "yes":
-        logger.info("Downloading file...")
+    pending_batches.pop(batch_id, None)
+    if batch is None or batch.expired(env.CONFIRMATION_TTL):
+        await update.effective_message.reply_text("This request has expired.")
+        return
+
+    # Time each file waited for the user's answer
+    answered_at = time.monotonic()
+    for download_file in batch.files:
+        tracer.record(
+            "confirmation",
+            download_file.trace_id,
+            download_file.received_at,
+            answered_at,
+            answer=answer,
+            batch_size=len(batch.files),
+        )
+
+    if answer != "yes":
+        logger.info("Download cancelled")
+        await update.effective_message.reply_text("Download cancelled.")
+        return
+
+    logger.info(f"Queueing {len(batch.files)} files...")
+
+    # Check again, files may have been added since the confirmation was sent
+    duplicates = await check_files_exist(batch.files)
+    if len(batch.files) == 1 and duplicates:
+        await update.effective_message.reply_text(
+            f"⛔ Error checking if file exists\n```\n{duplicates[batch.files[0].file_id]}```"
+        )
+        return
+
+    queued, over_quota = [], {}
+    for download_file in batch.files:
+        with tracer.span("enqueue", download_file.trace_id) as span:
+            if download_file.file_id in duplicates:
+                span.set(outcome="duplicate")
+                continue
+
+            try:
+                download_scheduler.check_quota(download_file)
+            except QuotaExceeded as e:
+                over_quota[download_file.file_id] = str(e)
+                span.set(outcome="over_quota")
+                continue
+
+            # Add file to downloading_files
+            downloading_files[download_file.file_id] = download_file
+            download_journal.record(download_file, JobState.QUEUED)
+            download_file.queued_at = time.monotonic()
+            queued.append(await download_scheduler.enqueue(download_file))
+            span.set(outcome="queued", queue_position=queued[-1])
 
-        # Check if file already exists or is being downloaded
+    if len(batch.files) == 1 and over_quota:
+        await update.effective_message.reply_text(
+            f"⛔ File not queued\n```\n{over_quota[batch.files[0].file_id]}```"
+        )
+    elif len(batch.files) == 1:
+        await update.effective_message.reply_text(
+            f"🕒 File added to the download queue (position {queued[0]})."
+        )
+    else:
+        await update.effective_message.reply_text(
+            f"🕒 {len(queued)} files added to the download queue"
+            + (f", {len(duplicates)} duplicates skipped" if duplicates else "")
+            + (
+                f", {len(over_quota)} over the queue limit: "
+                f"{next(iter(over_quota.values()))}"
+                if over_quota
+                else "."
+            )
+        )
+
+
+@callback_query_handler()
+@auth_required
+async def expired_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Answer the buttons no other handler matches, e.g. sent by an older version."""
+    await update.callback_query.answer("This request has expired.")
+    await update.effective_message.edit_reply_markup(reply_markup=None)
+
+
+async def process_download(bot: Bot, download_file: DownloadFile) -> None:
+    """Download a queued file and move it to the download directory."""
+
+    async def reply_text(text: str, **kwargs) -> None:
+        message_dispatcher.send_message(
+            download_file.chat_id,
+            text,
+            reply_to_message_id=download_file.message_id,
+            **kwargs,
+        )
+
+    with tracer.span(
+        "download_job",
+        download_file.trace_id,
+        file_name=download_file.file_name,
+        size=download_file.file_size,
+        user_id=download_file.user_id,
+    ) as span:
+        # Resumed jobs were queued before the restart
+        if download_file.queued_at:
+            tracer.record("queue_wait", span.trace_id, download_file.queued_at)
+
+        interrupted = False
         try:
-            check_file_exists(file_id, file_name)
-        except Exception as e:
-            logger.error(f"Error checking file exists: {e}")
-            await message.reply_text(f"⛔ Error checking if file exists\n```\n{e}```")
-            return
+            await _process_download(bot, download_file, reply_text)
+        except asyncio.CancelledError:
+            # Jobs interrupted by a shutdown stay unfinished so they resume on restart
+            if download_file.cancelled:
+                download_journal.record(download_file, JobState.CANCELLED)
+            else:
+                interrupted = True
+            raise
+        finally:
+            # Remove from current downloading files
+            downloading_files.pop(download_file.file_id, None)
+            if interrupted:
+                # Not finished, so kept out of the job metrics and history
+                outcome = "interrupted"
+            else:
+                record_job_metrics(download_file)
+                outcome = job_outcome(download_file)
+            if outcome == "error":
+                span.error = "failed"  # The error is on the span of the phase
+            span.set(
+                outcome=outcome,
+                retries=download_file.download_retries,
+                backoff_seconds=download_file.total_backoff,
+                bot_api_instance=download_file.bot_api_instance,
+                move_strategy=download_file.move_strategy,
+                bytes_overlapped=download_file.bytes_overlapped,
+                destination_dir=download_file.destination_dir,
+            )
+
+
+def job_outcome(download_file: DownloadFile) -> str:
+    if download_file.cancelled:
+        return "cancelled"
+    if download_file.status == "Complete":
+        return "success"
+    return "error"
+
+
+def record_job_metrics(download_file: DownloadFile) -> None:
+    """Record the timings of a finished download job."""
+    outcome = job_outcome(download_file)
+
+    metrics.jobs_total.inc(outcome=outcome)
+    metrics.retries_total.inc(download_file.download_retries, outcome=outcome)
+    download_history.add(download_file, outcome)
+
+    if outcome != "success":
+        return
+
+    size = download_file.file_size
+    metrics.download_seconds.observe(download_file.download_seconds)
+    metrics.move_seconds.observe(download_file.move_seconds)
+    metrics.total_seconds.observe(download_file.total_seconds)
+    for phase, seconds in (
+        ("download", download_file.download_seconds),
+        ("move", download_file.move_seconds),
+    ):
+        if seconds > 0:
+            metrics.phase_bytes_per_second.observe(size / seconds, phase=phase)
+
 
-        # Add file to downloading_files
-        download_file = DownloadFile(
-            file_id,
-            file_name,
-            file_size,
+async def _can_tail_copy(destination_dir: str, move_to_path: str) -> bool:
+    """Whether the file will be copied across filesystems while it is downloaded."""
+    # Remote downloads are written out of order into a preallocated file
+    if not env.PIPELINED_MOVE or not env.LOCAL_MODE:
+        return False
+    try:
+        return await fs.run(_is_other_filesystem, destination_dir, move_to_path)
+    except FilesystemTimeout:
+        return False
+
+
+def _is_other_filesystem(destination_dir: str, move_to_path: str) -> bool:
+    """Whether a new file at `move_to_path` is on no Bot API directory's filesystem."""
+    if os.path.exists(move_to_path):
+        return False
+    try:
+        os.makedirs(destination_dir, exist_ok=True)
+        destination_device = os.stat(destination_dir).st_dev
+        for instance in bot_api_pool.instances:
+            # The Bot API directory may not have been created yet
+            source_dir = os.path.abspath(instance.api_dir)
+            while not os.path.exists(source_dir):
+                source_dir = os.path.dirname(source_dir)
+            if os.stat(source_dir).st_dev == destination_device:
+                return False
+        return True
+    except OSError:
+        return False
+
+
+async def _process_download(bot: Bot, download_file: DownloadFile, reply_text) -> None:
+    download_file.download_started()
+    file_name = download_file.file_name
+
+    # Reuse a completed download of the same content, e.g. left by a failed move
+    cached_path = None
+    if not download_file.file_path:
+        for cache in bot_api_caches.values():
+            if cached_path := await cache.lookup(download_file.file_unique_id):
+                break
+    if cached_path:
+        logger.info(f"Reusing cached download: {cached_path}")
+        download_file.file_path = cached_path
+        await reply_text(
+            "♻️ Reusing the file already downloaded by the Bot API server..."
         )
-        downloading_files[file_id] = download_file
+
+    # Known before the download, so the file can be copied there while it arrives
+    destination_dir = download_file.destination_dir or DOWNLOAD_TO_DIR
+    move_to_path = os.path.join(destination_dir, file_name)
+    tail_copier = None
+
+    try:
+        downloaded = bool(download_file.file_path) and await fs.exists(
+            download_file.file_path
+        )
+    except OSError as e:
+        await _filesystem_failed(download_file, reply_text, e)
+        return
+
+    if downloaded:
+        logger.info("File already downloaded, resuming move...")
+    else:
+        logger.info("Downloading file...")
+        download_journal.record(download_file, JobState.DOWNLOADING)
 
         # Send downloading message
-        await message.reply_text("⬇️ Downloading file...")
+        await reply_text("⬇️ Downloading file...")
+
+        following, new_file = None, None
+        if await _can_tail_copy(destination_dir, move_to_path):
+            tail_copier = TailCopier(
+                download_file,
+                move_to_path,
+                fsync_policy=env.MOVE_FSYNC_POLICY,
+                hasher=new_hasher() if env.CONTENT_HASH else None,
+                throttle=functools.partial(
+                    io_limiter.throttle_blocking, volume=destination_dir
+                ),
+                stop_event=download_file.stop_move,
+            )
+            following = asyncio.create_task(asyncio.to_thread(tail_copier.follow))
 
         try:
-            new_file = await get_file(context.bot, download_file)
+            new_file = await get_file(bot_api_pool, download_file)
         except Exception as e:
             logger.error(f"Error downloading file: {e}")
             traceback.print_exc()
+            download_journal.record(download_file, JobState.FAILED)
 
-            # Remove from current downloading files
-            downloading_files.pop(file_id)
-
-            await message.reply_text(
+            await reply_text(
                 (
                     f"⛔ Error downloading file\n"
                     f"> 📄 *File name:*   `{download_file.file_name}`\n"
@@ -171,59 +648,455 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                 parse_mode="MarkdownV2",
             )
             return
-        else:
-            download_file.download_complete()
+        finally:
+            if following:
+                tail_copier.stop()
+                await asyncio.gather(following, return_exceptions=True)
+                if new_file is None:
+                    tail_copier.abort()
 
-        # Rename the file to the original file name
+        # Read from the directory of the instance the file was fetched from
         file_path = new_file.file_path.split("/")[-1]
-        current_file_path = f"{BOT_API_DIR}{TOKEN_SUB_DIR}/documents/{file_path}"
-        move_to_path = f"{DOWNLOAD_TO_DIR}{file_name}"
+        download_file.file_path = f"{download_file.documents_dir}/{file_path}"
+
+        # Keep the file for a repeat request until it has been moved
+        bot_api_cache = bot_api_caches[download_file.documents_dir]
+        await bot_api_cache.add(download_file.file_unique_id, download_file.file_path)
+        await bot_api_cache.enforce_limit()
+
+    download_file.download_complete()
+    download_journal.record(download_file, JobState.DOWNLOADED)
+
+    # Hold the move while the queue is paused
+    with tracer.span("checkpoint", paused=download_scheduler.paused):
+        await download_scheduler.checkpoint()
+
+    # Rename the file to the original file name
+    current_file_path = download_file.file_path
+    file_path = os.path.basename(current_file_path)
+
+    # Don't overwrite a file added outside the bot since the index was built
+    try:
+        exists = await fs.exists(move_to_path)
+    except OSError as e:
+        if tail_copier:
+            tail_copier.abort()
+        await _filesystem_failed(download_file, reply_text, e)
+        return
+    if exists:
+        if tail_copier:
+            tail_copier.abort()
+        file_index.add(file_name, directory=destination_dir)
+        download_journal.record(download_file, JobState.FAILED)
+        await reply_text(f"⛔ File already exists in downloads folder: {file_name}")
+        return
+
+    # Read the metadata before the file is moved, so /status shows it during the move
+    with tracer.span("media_info"):
+        download_file.media_info = await media_extractor.extract(current_file_path)
 
-        # Move the file to the download directory
+    download_journal.record(download_file, JobState.MOVING)
+
+    # Hash the contents on the way if the file has to be copied
+    hasher = new_hasher() if env.CONTENT_HASH else None
+
+    # Finish the copy made during the download, or move the file now. From here
+    # a cancellation stops the copy between two chunks instead of the task
+    download_file.moving = True
+    try:
+        with tracer.span("move", size=download_file.file_size) as move_span:
+            moved = False
+            if tail_copier:
+                try:
+                    download_file.move_strategy = await asyncio.to_thread(
+                        tail_copier.finish, current_file_path
+                    )
+                    hasher, moved = tail_copier.hasher, True
+                except (TailCopyError, OSError) as e:
+                    logger.warning(
+                        f"Couldn't finish the tail-follow copy, moving again: {e}"
+                    )
+                    download_file.bytes_overlapped = 0
+
+            if not moved:
+                if download_file.stop_move.is_set():
+                    raise MoveCancelled("The move was cancelled")
+                try:
+                    await fs.makedirs(destination_dir)
+                    await fs.rename(current_file_path, move_to_path)
+                    download_file.move_strategy = "rename"
+                except Exception as rename_error:
+                    logger.error(f"Error RENAMING file: {rename_error}")
+
+                    # Move the file instead of renaming
+                    try:
+                        if isinstance(rename_error, FilesystemTimeout):
+                            # The rename may still go through, don't copy the file too
+                            raise
+                        download_file.move_strategy = await asyncio.to_thread(
+                            cross_device_move,
+                            current_file_path,
+                            move_to_path,
+                            download_file,
+                            fsync_policy=env.MOVE_FSYNC_POLICY,
+                            chunk_size=io_limiter.chunk_size(
+                                env.MOVE_CHUNK_SIZE_MB * 1024 * 1024, destination_dir
+                            ),
+                            hasher=hasher,
+                            throttle=functools.partial(
+                                io_limiter.throttle_blocking, volume=destination_dir
+                            ),
+                            stop_event=download_file.stop_move,
+                        )
+                    except MoveCancelled:
+                        raise
+                    except Exception as move_error:
+                        logger.error(f"Error MOVING file: {move_error}")
+                        move_span.error = str(move_error)
+                        download_journal.record(download_file, JobState.FAILED)
+
+                        await reply_text(
+                            (
+                                f"⛔ Error moving file\n"
+                                f"> 📂 *File path:*   `{file_path}`\n"
+                                f"> 📂 *Move to path:*   `{move_to_path}`\n"
+                                f"Rename error:\n```\n{rename_error}```\n"
+                                f"Move error:\n```\n{move_error}```"
+                            ),
+                            parse_mode="MarkdownV2",
+                        )
+                        return
+
+            move_span.set(
+                strategy=download_file.move_strategy,
+                bytes_overlapped=download_file.bytes_overlapped,
+            )
+    except MoveCancelled:
+        logger.info(f"Move cancelled: {file_name}")
+        download_file.cancelled = True
+        download_journal.record(download_file, JobState.CANCELLED)
+        await reply_text(f"🚫 Move cancelled, {file_name} was not kept.")
+        return
+    finally:
+        download_file.moving = False
+
+    download_file.move_complete()
+    for cache in bot_api_caches.values():
+        cache.discard(download_file.file_unique_id)
+
+    digest, duplicate_of = None, None
+    if hasher is not None:
+        with tracer.span("hash") as span:
+            # A rename doesn't read the data, so the file is hashed here instead
+            if download_file.move_strategy == "rename":
+                digest = await asyncio.to_thread(hash_file, move_to_path)
+            else:
+                digest = hasher.hexdigest()
+            duplicate_of = await _deduplicate(download_file, move_to_path, digest)
+            span.set(
+                rehashed=download_file.move_strategy == "rename",
+                duplicate=bool(duplicate_of),
+            )
+
+    if duplicate_of and env.DEDUP_MODE == DedupMode.SKIP:
+        # Journaled, so a repeat still finds the existing file after a restart
+        download_file.duplicate_of = duplicate_of
+    download_journal.record(download_file, JobState.COMPLETE)
+
+    if duplicate_of and env.DEDUP_MODE == DedupMode.SKIP:
+        file_index.add(duplicate_of, download_file.file_unique_id)
+        await reply_text(
+            f"♻️ File not kept, its content is identical to `{duplicate_of}`\\.",
+            parse_mode="MarkdownV2",
+        )
+        return
+
+    file_index.add(file_name, download_file.file_unique_id, destination_dir)
+    if download_file.media_info:
+        download_journal.record_media_info(file_name, download_file.media_info)
+
+    # If linux, give file correct permissions
+    if platform.system() == "Linux":
+        with tracer.span("chmod") as span:
+            try:
+                await fs.chmod(move_to_path, 0o664)
+            except OSError as e:
+                # The file is already in place, only its permissions are off
+                logger.warning(f"Couldn't set the permissions of {move_to_path}: {e}")
+                span.error = str(e)
+
+    response_message = (
+        f"✅ File downloaded successfully\\.\n\n"
+        f"> 📄 *File name:*   `{download_file.file_name}`\n"
+        f"> 📂 *File path:*   `{file_path}`\n"
+        f"> 💾 *File size:*   `{download_file.file_size_mb}`\n"
+        f"> 🔻 *Retries:*   `{download_file.download_retries}`\n"
+        f"> ⏱ *Download Duration:*   `{download_file.download_duration}`\n"
+        f"> ⏱ *Moving Duration:*   `{download_file.move_duration}`\n"
+        f"> 🚚 *Move method:*   `{download_file.move_strategy}`\n"
+    )
+    if download_file.bytes_overlapped:
+        overlapped = DownloadFile.convert_size(download_file.bytes_overlapped)
+        response_message += f"> ⏩ *Moved during download:*   `{overlapped}`\n"
+    if len(volume_router.volumes) > 1:
+        response_message += f"> 💽 *Volume:*   `{destination_dir}`\n"
+    if download_file.media_info:
+        response_message += f"> 🎞 *Media:*   `{download_file.media_info.summary}`\n"
+    if digest:
+        response_message += f"> 🔐 *BLAKE2b:*   `{digest[:16]}`\n"
+    if duplicate_of:
+        response_message += f"> 🔗 *Hard link to:*   `{duplicate_of}`\n"
+    response_message += f"> ⏱ *Total Duration:*   `{download_file.total_duration}`"
+
+    with tracer.span("reply"):
+        await reply_text(response_message, parse_mode="MarkdownV2")
+
+
+async def _filesystem_failed(
+    download_file: DownloadFile, reply_text, error: OSError
+) -> None:
+    """Fail a job on an error or timeout of a filesystem call outside the move."""
+    logger.error(f"Filesystem error: {error}")
+    download_journal.record(download_file, JobState.FAILED)
+    await reply_text(
+        (
+            f"⛔ Error accessing the file system\n"
+            f"> 📄 *File name:*   `{download_file.file_name}`\n"
+            f"```\n{error}```"
+        ),
+        parse_mode="MarkdownV2",
+    )
+
+
+async def _deduplicate(
+    download_file: DownloadFile, path: str, digest: str
+) -> str | None:
+    """
+    Record the content hash of a moved file and handle identical existing files.
+
+    Returns:
+        str | None: The name of the identical existing file, if the new file was
+            replaced with a link to it or removed.
+    """
+    duplicate_of = None
+    if env.DEDUP_MODE != DedupMode.OFF:
+        duplicate_of = await file_index.find_content(
+            digest, exclude=download_file.file_name
+        )
+
+    if duplicate_of and env.DEDUP_MODE == DedupMode.SKIP:
+        await fs.remove(path)
+        return duplicate_of
+
+    if duplicate_of and env.DEDUP_MODE == DedupMode.HARDLINK:
         try:
-            os.makedirs(DOWNLOAD_TO_DIR, exist_ok=True)
-            os.rename(current_file_path, move_to_path)
-        except Exception as rename_error:
-            logger.error(f"Error RENAMING file: {rename_error}")
+            await asyncio.to_thread(link_duplicate, file_index.path(duplicate_of), path)
+        except OSError as e:
+            logger.warning(f"Couldn't link {path} to {duplicate_of}: {e}")
+            duplicate_of = None
+
+    file_index.add_digest(download_file.file_name, digest)
+    download_journal.record_hash(
+        download_file.file_name, download_file.file_size, digest
+    )
+    return duplicate_of
+
+
+async def resume_downloads(bot: Bot) -> None:
+    """Re-queue the jobs left unfinished in the journal by a previous run."""
+    for download_file, state in await asyncio.to_thread(download_journal.unfinished):
+        downloaded = bool(download_file.file_path) and await fs.exists(
+            download_file.file_path
+        )
+        destination_dir = download_file.destination_dir or DOWNLOAD_TO_DIR
+        move_to_path = os.path.join(destination_dir, download_file.file_name)
+
+        # Remove the partial copy left by an interrupted copy. Copies are written
+        # next to the destination and renamed into place once complete.
+        partial_copy_path = os.path.join(
+            destination_dir, f".{download_file.file_name}.part"
+        )
+        if await fs.exists(partial_copy_path):
+            await fs.remove(partial_copy_path)
+
+        # The move finished but the bot stopped before it was journaled
+        if state == JobState.MOVING and await fs.exists(move_to_path):
+            if downloaded:
+                # Copied across devices, but the source wasn't removed yet
+                await fs.remove(download_file.file_path)
+            file_index.add(
+                download_file.file_name, download_file.file_unique_id, destination_dir
+            )
+            download_journal.record(download_file, JobState.COMPLETE)
+            continue
+
+        if not downloaded:
+            download_file.file_path = None
+
+        logger.info(f"Resuming {state} download: {download_file.file_name}")
+        downloading_files[download_file.file_id] = download_file
+        download_journal.record(download_file, JobState.QUEUED)
+        await download_scheduler.enqueue(download_file)
+
+        message_dispatcher.send_message(
+            download_file.chat_id,
+            "🔁 Download resumed after a restart.",
+            reply_to_message_id=download_file.message_id,
+        )
+
+
+def _find_download(query: str) -> DownloadFile | None:
+    """Find a download by its position in /status or by its file name."""
+    files = list(downloading_files.values())
+    if query.isdigit() and 1 <= int(query) <= len(files):
+        return files[int(query) - 1]
+    return next((file for file in files if file.file_name == query), None)
+
+
+@command_handler("cancel")
+@auth_required
+async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Cancel a queued or running download by its number in /status or its file name.
+
+    Users can only cancel their own downloads, the admin can cancel any of them.
+    """
+    if not context.args:
+        await update.message.reply_text(
+            "Usage: `/cancel <number | file name | all>`", parse_mode="markdown"
+        )
+        return
 
-            # Move the file instead of renaming
+    user = update.effective_user
+    user_id = user.id if user else None
+    is_admin = access_control.is_admin(user_id)
+
+    query = " ".join(context.args)
+    if query == "all":
+        files = [
+            file
+            for file in downloading_files.values()
+            if is_admin or file.user_id == user_id
+        ]
+    else:
+        file = _find_download(query)
+        files = [file] if file else []
+
+    if not files:
+        await update.message.reply_text("No matching download found.")
+        return
+    if not is_admin and files[0].user_id != user_id:
+        await update.message.reply_text("You can only cancel your own downloads.")
+        return
+
+    cancelled, stopping = [], []
+    for file in files:
+        if not await download_scheduler.cancel(file):
+            continue
+        if file.moving:
+            # The job removes the partial copy and records the cancellation
+            stopping.append(file.file_name)
+            continue
+        downloading_files.pop(file.file_id, None)
+        download_journal.record(file, JobState.CANCELLED)
+        cancelled.append(file.file_name)
+
+    replies = []
+    if cancelled:
+        replies.append("🚫 Cancelled:\n" + "\n".join(cancelled))
+    if stopping:
+        replies.append("⏹ Stopping the move of:\n" + "\n".join(stopping))
+    await update.message.reply_text("\n\n".join(replies) or "Nothing to cancel.")
+
+
+@command_handler("pause")
+@admin_required
+async def pause(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Pause the download queue."""
+    download_scheduler.pause()
+    await update.message.reply_text(
+        "⏸ Download queue paused. Running downloads will finish but won't be moved "
+        "until the queue is resumed with /resume."
+    )
+
+
+@command_handler("resume")
+@admin_required
+async def resume(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Resume the download queue."""
+    await download_scheduler.resume()
+    await update.message.reply_text("▶️ Download queue resumed.")
+
+
+@command_handler("throttle")
+@admin_required
+async def throttle(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show or change the I/O rate limits of moves and remote downloads."""
+    if context.args:
+        value = context.args[0].lower()
+        volume = " ".join(context.args[1:]) or None
+        volumes = {os.path.normpath(v): v for v in volume_router.volumes}
+        if volume and os.path.normpath(volume) not in volumes:
+            await update.message.reply_text(
+                "Unknown download folder, see /storage for the list."
+            )
+            return
+
+        if value == "reset":
+            io_limiter.clear_override(volume)
+        elif value == "off":
+            io_limiter.set_override(None, volume)
+        else:
             try:
-                await asyncio.to_thread(shutil.move, current_file_path, move_to_path)
-            except Exception as move_error:
-                logger.error(f"Error MOVING file: {move_error}")
-
-                downloading_files.pop(file_id)
-                await message.reply_text(
-                    (
-                        f"⛔ Error moving file\n"
-                        f"> 📂 *File path:*   `{file_path}`\n"
-                        f"> 📂 *Move to path:*   `{move_to_path}`\n"
-                        f"Rename error:\n```\n{rename_error}```\n"
-                        f"Move error:\n```\n{move_error}```"
-                    ),
-                    parse_mode="MarkdownV2",
+                mb_per_second = float(value)
+            except ValueError:
+                mb_per_second = 0
+            if mb_per_second <= 0:
+                await update.message.reply_text(
+                    "Usage: `/throttle [<MB/s> | off | reset] [folder]`",
+                    parse_mode="markdown",
                 )
                 return
+            io_limiter.set_override(mb_per_second * 1024 * 1024, volume)
 
-        download_file.move_complete()
-        downloading_files.pop(file_id)
+    lines = []
+    for volume in [None, *volume_router.volumes]:
+        rate, source = io_limiter.limit(volume)
+        limit = f"{DownloadFile.convert_size(rate)}/s" if rate else "unlimited"
+        lines.append(f"📂 `{volume or 'All transfers'}`:   `{limit}` ({source})")
+    await update.message.reply_text(
+        "🚦 *I/O limits of moves and remote downloads*\n"
+        + "\n".join(lines)
+        + "\n\nChange with `/throttle <MB/s | off | reset> [folder]`.",
+        parse_mode="markdown",
+    )
 
-        # If linux, give file correct permissions
-        if platform.system() == "Linux":
-            os.chmod(move_to_path, 0o664)
 
-        response_message = (
-            f"✅ File downloaded successfully\\.\n\n"
-            f"> 📄 *File name:*   `{download_file.file_name}`\n"
-            f"> 📂 *File path:*   `{file_path}`\n"
-            f"> 💾 *File size:*   `{download_file.file_size_mb}`\n"
-            f"> 🔻 *Retries:*   `{download_file.download_retries}`\n"
-            f"> ⏱ *Download Duration:*   `{download_file.download_duration}`\n"
-            f"> ⏱ *Moving Duration:*   `{download_file.move_duration}`\n"
-            f"> ⏱ *Total Duration:*   `{download_file.total_duration}`"
-        )
+@command_handler("verify")
+@auth_required
+async def verify(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Re-check the content hashes of the downloaded files in the background."""
+    chat_id = update.effective_chat.id
+
+    async def on_finished(report: VerifyReport) -> None:
+        lines = [
+            f"🔐 Verified {report.checked} of {report.total} files",
+            f"Newly hashed: {report.hashed}",
+        ]
+        if report.mismatched:
+            lines.append("⚠️ Changed since download:\n" + "\n".join(report.mismatched))
+        if report.missing:
+            lines.append("❓ Missing:\n" + "\n".join(report.missing))
+        message_dispatcher.send_message(chat_id, trancute_message("\n".join(lines)))
 
-        await message.reply_text(response_message, parse_mode="MarkdownV2")
+    if content_verifier.start(on_finished):
+        await update.message.reply_text(
+            "🔐 Verifying the downloaded files in the background. "
+            "You'll get a report when it's done."
+        )
     else:
-        logger.info("Download cancelled")
-        await message.reply_text("Download cancelled.")
+        report = content_verifier.report
+        await update.message.reply_text(
+            f"🔐 Verification in progress: {report.checked} of {report.total} files "
+            "checked."
+        )
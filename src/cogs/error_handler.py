@@ -5,7 +5,7 @@ import traceback
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from ..utils import env, trancute_message
+from ..utils import env, message_dispatcher, trancute_message
 
 logger = logging.getLogger(__name__)
 
@@ -44,11 +44,11 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     ]
 
     for message in error_messages:
-        await context.bot.send_message(
-            chat_id=env.USER_ID, text=message, parse_mode="HTML"
-        )
+        message_dispatcher.send_message(int(env.USER_ID), message, parse_mode="HTML")
 
     # Send error message in chat
-    await update.message.reply_text(
-        "An error occurred while processing the request. Please check the logs."
+    message_dispatcher.send_message(
+        update.effective_chat.id,
+        "An error occurred while processing the request. Please check the logs.",
+        reply_to_message_id=update.effective_message.message_id,
     )
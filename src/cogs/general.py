@@ -1,24 +1,39 @@
 import logging
-import os
-import shutil
 
 from telegram import Update
 from telegram.ext import ContextTypes
 
+from ..middlewares.auth import admin_required
 from ..middlewares.handlers import command_handler
-from ..utils import env
+from ..models import DownloadFile
+from ..utils import Profiler, ProfilerBusy, env, fs, volume_router
+from ..utils.history import LogHistogram, WindowStats
+from .downloader import disk_space, download_history
 
 logger = logging.getLogger(__name__)
 
 DOWNLOAD_TO_DIR = env.DOWNLOAD_TO_DIR
 
+# Profiles the event loop on demand, for /profile
+profiler = Profiler(max_seconds=env.PROFILE_MAX_SECONDS)
+
+# Window of /profile when none is given, in seconds
+DEFAULT_PROFILE_SECONDS = 30
+
 # List of available commands
 commands = {
     "/start": "Start the bot",
     "/help": "Get help",
     "/info": "Get user and chat info",
     "/storage": "Get available storage information",
+    "/stats": "Get download statistics",
     "/status": "Get downloading files status",
+    "/cancel": "Cancel one of your queued or running downloads",
+    "/pause": "Pause the download queue (admin)",
+    "/resume": "Resume the download queue (admin)",
+    "/verify": "Check the downloaded files against their content hashes",
+    "/throttle": "Show or change the I/O rate limits (admin)",
+    "/profile": "Profile the bot for a few seconds and list the hot functions (admin)",
 }
 
 
@@ -57,15 +72,105 @@ async def info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 @command_handler("storage")
 async def storage(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Send available storage information of the specified folder."""
-    if os.path.exists(DOWNLOAD_TO_DIR):
-        total, used, free = shutil.disk_usage(DOWNLOAD_TO_DIR)
-        await update.message.reply_text(
-            f"📂 *Folder*:   `{DOWNLOAD_TO_DIR}`\n"
+    """Send available storage information of each download folder."""
+    # Read the disk usage off the event loop, for the reserved space
+    await disk_space.refresh()
+    volumes = []
+    for volume in volume_router.volumes:
+        try:
+            if not await fs.exists(volume):
+                volumes.append(f"📂 *Folder*:   `{volume}`\nThe folder does not exist.")
+                continue
+            total, used, free = await fs.disk_usage(volume)
+        except OSError as e:
+            volumes.append(f"📂 *Folder*:   `{volume}`\nCouldn't read the folder: {e}")
+            continue
+
+        volumes.append(
+            f"📂 *Folder*:   `{volume}`\n"
             f"🟣 *Total Space*:   `{total // (2**30)} GB`\n"
             f"🟠 *Used Space*:   `{used // (2**30)} GB`\n"
-            f"🟢 *Free Space*:    `{free // (2**30)} GB`",
-            parse_mode="markdown",
+            f"🟢 *Free Space*:    `{free // (2**30)} GB`\n"
+            f"🔒 *Reserved*:    `{disk_space.in_flight_bytes(volume) // (2**30)} GB`"
+        )
+
+    await update.message.reply_text("\n\n".join(volumes), parse_mode="markdown")
+
+
+def format_window(window: WindowStats) -> str:
+    """Name of a statistics window, e.g. `Last 24h`."""
+    if window.seconds is None:
+        return "Since startup"
+    if window.seconds % 86400 == 0 and window.seconds >= 86400 * 2:
+        return f"Last {window.seconds // 86400:.0f}d"
+    if window.seconds % 3600 == 0:
+        return f"Last {window.seconds // 3600:.0f}h"
+    return f"Last {window.seconds / 60:.0f}m"
+
+
+def format_percentiles(histogram: LogHistogram) -> str:
+    """p50/p95/p99 of a histogram of durations."""
+    return "  ".join(
+        f"p{percent} `{histogram.percentile(percent):.2f}s`" for percent in (50, 95, 99)
+    )
+
+
+@command_handler("stats")
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Send the download statistics of each window."""
+    sections = []
+    for window in download_history.stats():
+        outcomes = window.outcomes
+        section = (
+            f"📊 *{format_window(window)}*\n"
+            f"Jobs: `{window.count}`  ✅ `{outcomes['success']}`  "
+            f"⛔ `{outcomes['error']}`  🚫 `{outcomes['cancelled']}`"
+        )
+        if outcomes["success"]:
+            speed = window.bytes / window.job_seconds if window.job_seconds else 0
+            throughput = window.bytes / download_history.span(window)
+            section += (
+                f"\nDownloaded: `{DownloadFile.convert_size(window.bytes)}`  "
+                f"(`{throughput / 2**20:.2f} MB/s` overall)\n"
+                f"Speed per file: `{speed / 2**20:.2f} MB/s`\n"
+                f"Download: {format_percentiles(window.download)}\n"
+                f"Move: {format_percentiles(window.move)}"
+            )
+        sections.append(section)
+
+    await update.message.reply_text("\n\n".join(sections), parse_mode="markdown")
+
+
+@command_handler("profile")
+@admin_required
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Profile the event loop for a window and send the functions it spent most time in."""
+    args = context.args or []
+    try:
+        seconds = float(args[0]) if args else DEFAULT_PROFILE_SECONDS
+    except ValueError:
+        seconds = 0
+    sort = args[1] if len(args) > 1 else "tottime"
+    if seconds <= 0 or sort not in ("tottime", "cumulative"):
+        await update.message.reply_text(
+            "Usage: `/profile [seconds] [tottime | cumulative]`", parse_mode="markdown"
         )
-    else:
-        await update.message.reply_text("The specified folder does not exist.")
+        return
+
+    seconds = min(seconds, profiler.max_seconds)
+    await update.message.reply_text(f"🔥 Profiling the bot for {seconds:g}s...")
+    try:
+        functions = await profiler.run(seconds, sort=sort)
+    except ProfilerBusy as e:
+        await update.message.reply_text(f"⛔ {e}")
+        return
+
+    rows = "\n".join(
+        f"{f.own_seconds:>8.3f} {f.total_seconds:>8.3f} {f.calls:>8} {f.name[:60]}"
+        for f in functions
+    )
+    await update.message.reply_text(
+        f"🔥 Hot functions of the event loop over {seconds:g}s, by {sort}:\n"
+        f"```\n{'own s':>8} {'total s':>8} {'calls':>8} function\n{rows}```",
+        parse_mode="markdown",
+    )
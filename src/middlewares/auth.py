@@ -3,10 +3,7 @@ from functools import wraps
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from ..utils import env
-
-USER_ID = env.USER_ID
-CHAT_ID = env.CHAT_ID
+from ..utils import access_control
 
 
 def auth_required(func):
@@ -24,13 +21,41 @@ def auth_required(func):
 
     @wraps(func)
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        if (
-            str(update.effective_user.id) != USER_ID
-            or str(update.effective_chat.id) != CHAT_ID
+        user, chat = update.effective_user, update.effective_chat
+        if not access_control.is_authorized(
+            user.id if user else None, chat.id if chat else None
         ):
             await update.effective_message.reply_text(
                 "Unauthorized user or chat.\n"
-                "Please verify the values of `USER_ID` and `CHAT_ID` in environment variables.",
+                "Please verify the values of `USER_ID`, `CHAT_ID`, `USERS` and "
+                "`CHAT_IDS` in environment variables.",
+                parse_mode="markdown",
+            )
+            return
+        return await func(update, context)
+
+    return wrapper
+
+
+def admin_required(func):
+    """
+    Decorator that only runs the decorated function for an admin, in an authorized chat.
+
+    Example:
+        @admin_required
+        async def my_function(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+            # Function implementation
+    """
+
+    @wraps(func)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        user, chat = update.effective_user, update.effective_chat
+        user_id = user.id if user else None
+        if not access_control.is_authorized(
+            user_id, chat.id if chat else None
+        ) or not access_control.is_admin(user_id):
+            await update.effective_message.reply_text(
+                "This command is only available to the admin set in `USER_ID`.",
                 parse_mode="markdown",
             )
             return
@@ -39,10 +39,10 @@ def message_handler(filters: BaseFilter):
     return inner_decorator
 
 
-def callback_query_handler():
+def callback_query_handler(pattern: str | None = None):
     def inner_decorator(
         f: Callable[[Update, ApplicationContext], Coroutine[Any, Any, Any]]
     ) -> CallbackQueryHandler:
-        return CallbackQueryHandler(callback=f)
+        return CallbackQueryHandler(callback=f, pattern=pattern)
 
     return inner_decorator
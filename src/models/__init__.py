@@ -1 +1,3 @@
-from .downloading_file import DownloadFile, downloading_files
+from .download_batch import DownloadBatch, pending_batches
+from .downloading_file import DownloadFile, JobState, downloading_files
+from .media_info import MediaInfo
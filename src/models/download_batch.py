@@ -0,0 +1,29 @@
+import secrets
+import time
+from dataclasses import dataclass, field
+
+from .downloading_file import DownloadFile
+
+
+@dataclass
+class DownloadBatch:
+    chat_id: int
+    files: list[DownloadFile]
+    duplicates: dict[str, str] = field(default_factory=dict)  # file_id -> reason
+    batch_id: str = field(default_factory=lambda: secrets.token_hex(6))
+    created_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def total_size(self) -> int:
+        return sum(file.file_size for file in self.files)
+
+    @property
+    def total_size_mb(self) -> str:
+        return DownloadFile.convert_size(self.total_size)
+
+    def expired(self, ttl: float) -> bool:
+        return time.monotonic() - self.created_at > ttl
+
+
+# Batches waiting for confirmation, by batch_id
+pending_batches: dict[str, DownloadBatch] = {}
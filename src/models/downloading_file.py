@@ -1,5 +1,22 @@
-from dataclasses import InitVar, dataclass
+import secrets
+import threading
+import time
+from collections import deque
+from dataclasses import InitVar, dataclass, field
 from datetime import datetime, timedelta
+from enum import StrEnum
+
+from .media_info import MediaInfo
+
+
+class JobState(StrEnum):
+    QUEUED = "queued"
+    DOWNLOADING = "downloading"
+    DOWNLOADED = "downloaded"
+    MOVING = "moving"
+    COMPLETE = "complete"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
 
 
 @dataclass
@@ -8,6 +25,36 @@ class DownloadFile:
     file_name: str
     file_size: int
     download_retries: int = 0
+    total_backoff: float = 0.0
+    last_error: str = None
+    file_unique_id: str = None
+    file_path: str = None
+    chat_id: int = None
+    user_id: int = None  # The user who sent the file, for their share of the queue
+    message_id: int = None
+    cancelled: bool = False
+    bytes_moved: int = 0
+    bytes_overlapped: int = 0  # Bytes moved while the file was still downloading
+    move_strategy: str = None
+    moving: bool = False  # Set while the file is being copied or renamed into place
+    # Stops a copy in progress at its next chunk, when the job is cancelled
+    stop_move: threading.Event = field(default_factory=threading.Event)
+    bytes_downloaded: int = 0
+    partial_path: str = None
+    reports_progress: bool = False  # Set when the downloader reports its own progress
+    download_started_at: float = 0.0
+    mime_type: str = None
+    destination_dir: str = None  # The volume the file is moved to, set on admission
+    bot_api_instance: str = None  # The Bot API server the file is fetched from
+    documents_dir: str = None  # Where that server writes the file
+    media_info: MediaInfo = None
+    duplicate_of: str = None  # The file with the same content, when this one isn't kept
+    # Groups the tracing spans of the job, from the message to the reply
+    trace_id: str = field(default_factory=lambda: secrets.token_hex(16))
+    received_at: float = field(default_factory=time.monotonic)
+    queued_at: float = 0.0
+    _progress_samples: deque = field(default_factory=lambda: deque(maxlen=10))
+    _download_started: bool = False
     _start_datetime: InitVar[datetime] = None
     _finish_download_datetime: datetime = None
     _finish_move_datetime: datetime = None
@@ -15,12 +62,36 @@ class DownloadFile:
     def __post_init__(self, _start_datetime):
         self._start_datetime = _start_datetime or datetime.now()
 
+    def download_started(self):
+        self._download_started = True
+        self._start_datetime = datetime.now()
+        self.download_started_at = time.monotonic()
+
+    def record_progress(self, bytes_downloaded: int):
+        """Record a sample of the number of bytes downloaded so far."""
+        self.bytes_downloaded = bytes_downloaded
+        self._progress_samples.append((time.monotonic(), bytes_downloaded))
+
     def download_complete(self):
         self._finish_download_datetime = datetime.now()
 
     def move_complete(self):
         self._finish_move_datetime = datetime.now()
 
+    @property
+    def download_seconds(self) -> float:
+        return (self._finish_download_datetime - self._start_datetime).total_seconds()
+
+    @property
+    def move_seconds(self) -> float:
+        return (
+            self._finish_move_datetime - self._finish_download_datetime
+        ).total_seconds()
+
+    @property
+    def total_seconds(self) -> float:
+        return (self._finish_move_datetime - self._start_datetime).total_seconds()
+
     @property
     def current_download_duration(self) -> str:
         duration = datetime.now() - self._start_datetime
@@ -41,6 +112,43 @@ class DownloadFile:
         duration = self._finish_move_datetime - self._start_datetime
         return self.convert_duration(duration)
 
+    @property
+    def current_speed(self) -> float:
+        """Download speed in bytes/s over the recent samples."""
+        if len(self._progress_samples) < 2:
+            return 0.0
+        (t0, b0), (t1, b1) = self._progress_samples[0], self._progress_samples[-1]
+        return (b1 - b0) / (t1 - t0) if t1 > t0 else 0.0
+
+    @property
+    def average_speed(self) -> float:
+        """Download speed in bytes/s since the download started."""
+        elapsed = time.monotonic() - self.download_started_at
+        return self.bytes_downloaded / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def download_progress(self) -> str:
+        """Percent complete, current and average speed, and estimated time left."""
+        percent = self.bytes_downloaded / self.file_size * 100 if self.file_size else 0
+        speed = self.current_speed or self.average_speed
+        remaining = self.file_size - self.bytes_downloaded
+        eta = self.convert_eta(timedelta(seconds=remaining / speed)) if speed else "-"
+        return (
+            f"{percent:.1f}%  {self.convert_size(self.current_speed)}/s  "
+            f"(avg {self.convert_size(self.average_speed)}/s)  ETA {eta}"
+        )
+
+    @property
+    def move_progress(self) -> str:
+        """Bytes moved so far and the average move speed."""
+        percent = self.bytes_moved / self.file_size * 100 if self.file_size else 100
+        duration = (datetime.now() - self._finish_download_datetime).total_seconds()
+        speed = self.bytes_moved / duration if duration > 0 else 0
+        return (
+            f"{self.convert_size(self.bytes_moved)} ({percent:.1f}%)  "
+            f"{self.convert_size(speed)}/s"
+        )
+
     @property
     def start_datetime(self) -> str:
         return self._start_datetime.strftime("%H:%M:%S  %d/%m/%Y")
@@ -55,17 +163,53 @@ class DownloadFile:
             return "Complete"
         if self._finish_download_datetime:
             return "Moving"
-        return "Downloading"
+        if self._download_started:
+            return "Downloading"
+        return "Queued"
 
     @staticmethod
     def convert_duration(time_taken: timedelta) -> str:
         total_minutes = time_taken.total_seconds() / 60
         return f"{time_taken.total_seconds():.2f} secs  ({total_minutes:.2f} mins)"
 
+    @staticmethod
+    def convert_eta(time_left: timedelta) -> str:
+        minutes, seconds = divmod(int(time_left.total_seconds()), 60)
+        return f"{minutes}m {seconds:02d}s"
+
     @staticmethod
     def convert_size(size: int) -> str:
         return f"{size / 1024 / 1024:.2f} MB"
 
 
+class DownloadingFiles(dict[str, DownloadFile]):
+    """Dictionary of the current downloads by file_id, also indexed by name and file_unique_id."""
+
+    def __init__(self):
+        super().__init__()
+        self.names: dict[str, DownloadFile] = {}
+        self.unique_ids: dict[str, DownloadFile] = {}
+
+    def __setitem__(self, file_id: str, file: DownloadFile) -> None:
+        self.pop(file_id, None)
+        super().__setitem__(file_id, file)
+        self.names[file.file_name] = file
+        if file.file_unique_id:
+            self.unique_ids[file.file_unique_id] = file
+
+    def __delitem__(self, file_id: str) -> None:
+        self.pop(file_id)
+
+    def pop(self, file_id: str, *default):
+        if file_id not in self:
+            return super().pop(file_id, *default)
+
+        file = super().pop(file_id)
+        self.names.pop(file.file_name, None)
+        if file.file_unique_id:
+            self.unique_ids.pop(file.file_unique_id, None)
+        return file
+
+
 # Current downloading files
-downloading_files: dict[str, DownloadFile] = {}
+downloading_files = DownloadingFiles()
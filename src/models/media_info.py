@@ -0,0 +1,29 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class MediaInfo:
+    """Metadata read from the container of a video file."""
+
+    duration: float | None = None  # Seconds
+    width: int | None = None
+    height: int | None = None
+    video_codec: str | None = None
+    audio_codec: str | None = None
+    bitrate: int | None = None  # Bits/s over the whole file
+
+    @property
+    def summary(self) -> str:
+        parts = []
+        if self.width and self.height:
+            parts.append(f"{self.width}x{self.height}")
+        codecs = "/".join(c for c in (self.video_codec, self.audio_codec) if c)
+        if codecs:
+            parts.append(codecs)
+        if self.duration:
+            minutes, seconds = divmod(int(self.duration), 60)
+            hours, minutes = divmod(minutes, 60)
+            parts.append(f"{hours}:{minutes:02d}:{seconds:02d}")
+        if self.bitrate:
+            parts.append(f"{self.bitrate / 1e6:.1f} Mbps")
+        return "  ".join(parts) or "-"
@@ -1,3 +1,32 @@
+from .access import AccessControl, UserPolicy, access_control
+from .api_cache import BotApiCache
+from .bandwidth import IoLimiter, io_limiter
+from .batcher import Batcher
+from .bot_api_pool import BotApiInstance, BotApiPool
+from .content_hash import ContentVerifier, DedupMode
+from .dashboard import DashboardManager
+from .disk_space import DiskSpaceManager
 from .env import env
-from .get_file import check_file_exists, get_file
+from .file_index import FileIndex
+from .fs import AsyncFilesystem, FilesystemTimeout, fs
+from .get_file import (
+    bot_api_pool,
+    check_file_exists,
+    check_files_exist,
+    file_index,
+    get_file,
+)
+from .history import DownloadHistory
+from .journal import DownloadJournal
+from .media_info import MediaInfoExtractor
+from .mover import FsyncPolicy, TailCopier, cross_device_move
+from .outbox import message_dispatcher
+from .profiler import Profiler, ProfilerBusy
+from .progress import ProgressSampler
+from .retry import CircuitBreaker, RetryPolicy, retry_call
+from .router import PlacementPolicy, VolumeRouter, volume_router
+from .scheduler import DownloadScheduler, QuotaExceeded
+from .token_bucket import TokenBucket
+from .tracing import Tracer, tracer
 from .trancute_message import trancute_message
+from .webhook import WebhookServer
@@ -0,0 +1,82 @@
+import logging
+from dataclasses import dataclass
+
+from .env import env
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class UserPolicy:
+    """A user's share of the download queue and limits, None meaning no limit."""
+
+    weight: float = 1.0
+    max_concurrent: int | None = None
+    max_queued_bytes: int | None = None
+
+
+class AccessControl:
+    """
+    The users and chats allowed to use the bot, and each user's queue policy.
+
+    Both are kept in sets built once on startup, so checking an update is a lookup.
+    An update is authorized if both its user and its chat are. Admins are authorized
+    users who can also use the diagnostic commands.
+    """
+
+    def __init__(
+        self,
+        users: dict[int, UserPolicy],
+        chats: set[int],
+        default: UserPolicy | None = None,
+        admins: set[int] = frozenset(),
+    ):
+        self.users = users
+        self.chats = frozenset(chats)
+        self.default = default or UserPolicy()
+        self.admins = frozenset(admins)
+
+    def is_authorized(self, user_id: int | None, chat_id: int | None) -> bool:
+        return user_id in self.users and chat_id in self.chats
+
+    def is_admin(self, user_id: int | None) -> bool:
+        return user_id in self.admins
+
+    def policy(self, user_id: int | None) -> UserPolicy:
+        """The policy of a user, or the default one for jobs without a known user."""
+        return self.users.get(user_id, self.default)
+
+
+def _megabytes(value: float | None) -> int | None:
+    return None if value is None else int(value * 1024 * 1024)
+
+
+def build_access_control() -> AccessControl:
+    default = UserPolicy(
+        max_concurrent=env.USER_MAX_CONCURRENT_DOWNLOADS,
+        max_queued_bytes=_megabytes(env.USER_MAX_QUEUED_MB),
+    )
+    users = {int(env.USER_ID): default}
+    chats = {int(env.CHAT_ID), *(int(chat_id) for chat_id in env.CHAT_IDS)}
+    for user in env.USERS:
+        users[int(user.id)] = UserPolicy(
+            weight=user.weight,
+            max_concurrent=(
+                user.max_concurrent_downloads
+                if user.max_concurrent_downloads is not None
+                else default.max_concurrent
+            ),
+            max_queued_bytes=(
+                _megabytes(user.max_queued_mb)
+                if user.max_queued_mb is not None
+                else default.max_queued_bytes
+            ),
+        )
+        chats.add(int(user.chat_id or user.id))
+
+    logger.info(f"Authorized {len(users)} users in {len(chats)} chats")
+    # The owner set in USER_ID is the admin
+    return AccessControl(users, chats, default, admins={int(env.USER_ID)})
+
+
+access_control = build_access_control()
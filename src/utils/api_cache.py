@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import os
+import time
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+
+from ..models import downloading_files
+from .fs import fs
+
+logger = logging.getLogger(__name__)
+
+# Number of directory entries checked per step of the orphan sweep
+SWEEP_BATCH_SIZE = 256
+
+
+@dataclass
+class CachedFile:
+    path: str
+    size: int
+    last_used: float
+
+
+class BotApiCache:
+    """
+    Cache of the files downloaded by a Bot API server instance, one per directory.
+
+    Files stay in the Bot API directory until they are moved to the download
+    directory. If the move fails, the completed download is kept here, indexed by
+    Telegram's `file_unique_id`, so a repeat request reuses it instead of transferring
+    it again. The total size of the kept files is capped, and the least recently
+    used files are removed first.
+
+    A background task sweeps the directory and deletes orphans: files older than
+    `orphan_age` that are neither cached nor used by a running download.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_size: int,
+        sweep_interval: float = 600.0,
+        orphan_age: float = 3600.0,
+    ):
+        self.directory = directory
+        self.max_size = max_size
+        self.sweep_interval = sweep_interval
+        self.orphan_age = orphan_age
+
+        self._files: dict[str, CachedFile] = {}  # file_unique_id -> file
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    @property
+    def size(self) -> int:
+        return sum(file.size for file in self._files.values())
+
+    def build(self, downloaded: Iterable[tuple[str, str, int, float]]) -> None:
+        """
+        Index the downloaded files that are still in the directory.
+
+        Files whose size changed are skipped, their path was reused for another file.
+        Files of other directories are left to their own cache.
+
+        Args:
+            downloaded (Iterable[tuple[str, str, int, float]]): (file_unique_id,
+                file_path, file size, time last used) of files previously downloaded
+                by the bot and not moved.
+        """
+        directory = os.path.normpath(self.directory)
+        files = {}
+        for unique_id, path, file_size, last_used in downloaded:
+            if not unique_id or not path:
+                continue
+            if os.path.dirname(os.path.normpath(path)) != directory:
+                continue
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                continue
+            if size != file_size:
+                continue
+            files[unique_id] = CachedFile(path, size, last_used)
+
+        self._files = files
+        logger.info(f"Indexed {len(files)} cached files in {self.directory}")
+
+    async def add(self, file_unique_id: str | None, path: str) -> None:
+        """Keep a completed download until it is moved or evicted."""
+        if not file_unique_id:
+            return
+        try:
+            size = (await fs.stat(path)).st_size
+        except OSError:
+            return
+        self._files[file_unique_id] = CachedFile(path, size, time.time())
+
+    def discard(self, file_unique_id: str | None) -> None:
+        """Forget a file, e.g. once it has been moved out of the directory."""
+        self._files.pop(file_unique_id, None)
+
+    async def lookup(self, file_unique_id: str | None) -> str | None:
+        """
+        Find a completed download of the same Telegram content.
+
+        Returns:
+            str | None: The path of the cached file, or None if there is none.
+        """
+        file = self._files.get(file_unique_id)
+        if file is None:
+            return None
+
+        # Drop entries for files that were removed since they were cached
+        if not await fs.exists(file.path):
+            self._files.pop(file_unique_id, None)
+            return None
+
+        file.last_used = time.time()
+        return file.path
+
+    async def enforce_limit(self) -> None:
+        """Remove the least recently used files until the cache fits its size cap."""
+        in_use = self._paths_in_use()
+        size = self.size
+
+        for unique_id, file in sorted(
+            self._files.items(), key=lambda item: item[1].last_used
+        ):
+            if size <= self.max_size:
+                break
+            if os.path.normpath(file.path) in in_use:
+                continue
+
+            logger.info(f"Evicting cached file {file.path}")
+            del self._files[unique_id]
+            size -= file.size
+            try:
+                await asyncio.to_thread(os.remove, file.path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Error evicting cached file {file.path}: {e}")
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop(), name="bot-api-cache-sweeper")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                await self.enforce_limit()
+                removed = await self.sweep()
+                if removed:
+                    logger.info(f"Removed {removed} orphaned files from the cache")
+            except OSError as e:
+                logger.warning(f"Error sweeping {self.directory}: {e}")
+            await asyncio.sleep(self.sweep_interval)
+
+    async def sweep(self) -> int:
+        """
+        Delete the orphaned files in the directory.
+
+        The directory is read in small batches in a thread, so a large directory
+        doesn't hold up the event loop or a worker thread for long.
+
+        Returns:
+            int: The number of files removed.
+        """
+        if not await fs.run(os.path.isdir, self.directory):
+            return 0
+
+        removed = 0
+        entries = await asyncio.to_thread(os.scandir, self.directory)
+        try:
+            while batch := await asyncio.to_thread(self._next_batch, entries):
+                # Check against the running downloads as they are now
+                cached = {os.path.normpath(file.path) for file in self._files.values()}
+                in_use = self._paths_in_use()
+                cutoff = time.time() - self.orphan_age
+
+                for path, mtime in batch:
+                    path = os.path.normpath(path)
+                    if path in cached or path in in_use or mtime > cutoff:
+                        continue
+                    try:
+                        await asyncio.to_thread(os.remove, path)
+                        removed += 1
+                    except FileNotFoundError:
+                        pass
+        finally:
+            entries.close()
+
+        return removed
+
+    @staticmethod
+    def _next_batch(entries: Iterator[os.DirEntry]) -> list[tuple[str, float]]:
+        batch = []
+        for entry in entries:
+            try:
+                if entry.is_file(follow_symlinks=False):
+                    batch.append((entry.path, entry.stat().st_mtime))
+            except FileNotFoundError:
+                continue
+            if len(batch) >= SWEEP_BATCH_SIZE:
+                break
+        return batch
+
+    @staticmethod
+    def _paths_in_use() -> set[str]:
+        return {
+            os.path.normpath(path)
+            for file in downloading_files.values()
+            for path in (file.file_path, file.partial_path)
+            if path
+        }
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import datetime
+from datetime import time as time_of_day
+
+from . import metrics
+from .env import env
+from .token_bucket import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# Smallest chunk a limited copy is split into, so throttling stays per megabyte
+MIN_CHUNK_SIZE = MB
+
+
+@dataclass(frozen=True)
+class ScheduledLimit:
+    """A rate limit in bytes per second (None for none) between two times of day."""
+
+    start: time_of_day
+    end: time_of_day
+    rate: float | None
+    volume: str | None = None
+
+    def applies(self, now: time_of_day) -> bool:
+        if self.start <= self.end:
+            return self.start <= now < self.end
+        return now >= self.start or now < self.end  # Over midnight
+
+
+class IoLimiter:
+    """
+    Limits the bytes per second of moves and downloads, overall and per volume.
+
+    Each limit is a token bucket on bytes, shared by all the jobs it applies to.
+    Callers take tokens for a whole chunk (a megabyte or more) after writing it,
+    so throttling costs a lock and, when over the limit, one sleep per chunk.
+
+    The limit of a scope (overall, or a volume) is, in order: the one set at runtime
+    with `set_override`, the first scheduled limit covering the current time of day,
+    or the configured one. None means unlimited.
+    """
+
+    def __init__(
+        self,
+        rate: float | None = None,
+        volume_rates: dict[str, float] | None = None,
+        schedule: list[ScheduledLimit] | None = None,
+        clock: Callable[[], datetime] = datetime.now,
+    ):
+        self.rates: dict[str | None, float | None] = {None: rate}
+        for volume, volume_rate in (volume_rates or {}).items():
+            self.rates[_scope(volume)] = volume_rate
+        self.schedule = schedule or []
+        self.clock = clock
+
+        self._overrides: dict[str | None, float | None] = {}
+        self._buckets: dict[str | None, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def limit(self, volume: str | None = None) -> tuple[float | None, str]:
+        """
+        The current limit of a volume, or the overall one.
+
+        Returns:
+            tuple[float | None, str]: The bytes per second, and where the limit comes
+                from (`runtime`, `schedule` or `config`).
+        """
+        scope = _scope(volume)
+        if scope in self._overrides:
+            return self._overrides[scope], "runtime"
+        now = self.clock().time()
+        for rule in self.schedule:
+            if _scope(rule.volume) == scope and rule.applies(now):
+                return rule.rate, "schedule"
+        return self.rates.get(scope), "config"
+
+    def set_override(self, rate: float | None, volume: str | None = None) -> None:
+        """Replace the scheduled and configured limits until `clear_override`."""
+        self._overrides[_scope(volume)] = rate
+        logger.info(f"I/O limit of {volume or 'all transfers'} set to {rate} bytes/s")
+
+    def clear_override(self, volume: str | None = None) -> None:
+        self._overrides.pop(_scope(volume), None)
+        logger.info(f"I/O limit of {volume or 'all transfers'} reset")
+
+    def chunk_size(self, default: int, volume: str | None = None) -> int:
+        """
+        The size to split a limited transfer into, about a second of data at most.
+
+        Keeps the waits short, so a job paused or cancelled during one isn't held
+        for long, without going under a megabyte per chunk.
+        """
+        rates = [self.limit(None)[0], self.limit(volume)[0] if volume else None]
+        rates = [rate for rate in rates if rate is not None]
+        if not rates:
+            return default
+        return min(default, max(MIN_CHUNK_SIZE, int(min(rates))))
+
+    def reserve(self, size: int, volume: str | None = None) -> float:
+        """
+        Take `size` bytes from the overall bucket and that of the volume.
+
+        Returns:
+            float: The seconds to wait before going on.
+        """
+        scopes = [None, _scope(volume)] if volume else [None]
+        delay = 0.0
+        for scope in scopes:
+            bucket = self._bucket(scope)
+            if bucket is None:
+                continue
+            scope_delay = bucket.reserve(size)
+            if scope_delay:
+                metrics.io_throttled_seconds_total.inc(
+                    scope_delay, limit=scope or "overall"
+                )
+            delay = max(delay, scope_delay)
+        return delay
+
+    def throttle_blocking(self, size: int, volume: str | None = None) -> None:
+        """Block the current thread as long as `size` bytes are over the limits."""
+        delay = self.reserve(size, volume)
+        if delay:
+            time.sleep(delay)
+
+    async def throttle(self, size: int, volume: str | None = None) -> None:
+        """Wait as long as `size` bytes are over the limits."""
+        delay = self.reserve(size, volume)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def _bucket(self, scope: str | None) -> TokenBucket | None:
+        rate, _ = self.limit(scope)
+        if not rate:
+            return None
+        with self._lock:
+            bucket = self._buckets.get(scope)
+            if bucket is None:
+                bucket = self._buckets[scope] = TokenBucket(rate)
+            elif bucket.rate != rate:
+                bucket.set_rate(rate)
+            return bucket
+
+
+def _scope(volume: str | None) -> str | None:
+    return os.path.normpath(volume) if volume else None
+
+
+def _rate(mb_per_second: float | None) -> float | None:
+    return None if mb_per_second is None else mb_per_second * MB
+
+
+def build_io_limiter() -> IoLimiter:
+    return IoLimiter(
+        _rate(env.IO_MAX_MB_PER_SECOND),
+        {
+            volume: _rate(mb_per_second)
+            for volume, mb_per_second in env.IO_VOLUME_MAX_MB_PER_SECOND.items()
+        },
+        [
+            ScheduledLimit(rule.start, rule.end, _rate(rule.mb_per_second), rule.volume)
+            for rule in env.IO_SCHEDULE
+        ],
+    )
+
+
+# Rate limits of moves and remote downloads, changed at runtime with /throttle
+io_limiter = build_io_limiter()
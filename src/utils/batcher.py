@@ -0,0 +1,53 @@
+import asyncio
+import logging
+import time
+from collections.abc import Callable, Coroutine, Hashable
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+BatchHandler = Callable[[list[Any]], Coroutine[Any, Any, None]]
+
+
+class Batcher:
+    """
+    Collects items that arrive close together into batches.
+
+    Items with the same key are grouped until no new item arrived for `window`
+    seconds, or the batch has been open for `max_wait` seconds, then the batch is
+    passed to the handler.
+    """
+
+    def __init__(self, handler: BatchHandler, window: float, max_wait: float):
+        self.handler = handler
+        self.window = window
+        self.max_wait = max_wait
+        self._batches: dict[Hashable, list[Any]] = {}
+        self._deadlines: dict[Hashable, tuple[float, float]] = {}
+        self._tasks: dict[Hashable, asyncio.Task] = {}
+
+    def add(self, key: Hashable, item: Any) -> None:
+        now = time.monotonic()
+        self._batches.setdefault(key, []).append(item)
+
+        opened, _ = self._deadlines.get(key, (now, now))
+        self._deadlines[key] = (opened, min(now + self.window, opened + self.max_wait))
+
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._flush_when_ready(key))
+
+    async def _flush_when_ready(self, key: Hashable) -> None:
+        try:
+            # The deadline moves forward while items keep arriving
+            while (delay := self._deadlines[key][1] - time.monotonic()) > 0:
+                await asyncio.sleep(delay)
+
+            items = self._batches.pop(key)
+            del self._deadlines[key]
+        finally:
+            del self._tasks[key]
+
+        try:
+            await self.handler(items)
+        except Exception as e:
+            logger.error(f"Error handling batch of {len(items)} items: {e}")
@@ -0,0 +1,136 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from collections.abc import AsyncIterator
+
+from telegram import Bot
+
+from .retry import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+
+class BotApiInstance:
+    """A Bot API server that files are fetched from, and the directory it writes to."""
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        api_dir: str,
+        token: str,
+        breaker: CircuitBreaker | None = None,
+    ):
+        self.name = name
+        self.url = url
+        self.api_dir = api_dir
+        # The server keeps the files of each bot in a directory named after its
+        # token, with the colon replaced by a private use character on Windows
+        token_dir = token.replace(":", "") if os.name == "nt" else token
+        self.documents_dir = f"{api_dir}{token_dir}/documents"
+        # Downloads are written here, and moved to the documents directory when done
+        self.temp_dir = f"{api_dir}{token_dir}/temp"
+
+        self.bot: Bot | None = None
+        # Fetches wait on the instance's own breaker while it is down
+        self.breaker = breaker or CircuitBreaker(name=f"Bot API instance {name}")
+        self.in_flight = 0
+        self.healthy = True
+        self.last_error: str | None = None
+        self.last_dispatched_at = 0.0
+
+
+class BotApiPool:
+    """
+    Spreads `getFile` calls over several Bot API server instances.
+
+    Each file is fetched from the healthy instance with the fewest fetches in flight,
+    the least recently used one on a tie. Instances whose circuit breaker is open are
+    only picked when all of them are. An instance is marked unhealthy when a
+    fetch can't reach it, and a `getMe` call checks every `health_interval` seconds
+    whether it is back. The first instance is the one the application's bot talks to;
+    the others need a bot of their own, set before `start`.
+    """
+
+    def __init__(
+        self,
+        instances: list[BotApiInstance],
+        health_interval: float = 15.0,
+        health_timeout: float = 5.0,
+    ):
+        self.instances = instances
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self._task: asyncio.Task | None = None
+
+    @property
+    def primary(self) -> BotApiInstance:
+        return self.instances[0]
+
+    @property
+    def available(self) -> bool:
+        """Whether the circuit breaker of any instance lets fetches through."""
+        return any(i.breaker.state == "closed" for i in self.instances)
+
+    async def start(self, bot: Bot) -> None:
+        self.primary.bot = bot
+        for instance in self.instances[1:]:
+            try:
+                await instance.bot.initialize()
+            except Exception as e:
+                self.mark_unhealthy(instance, e)
+        if len(self.instances) > 1:
+            self._task = asyncio.create_task(self._loop(), name="bot-api-health")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for instance in self.instances[1:]:
+            await instance.bot.shutdown()
+
+    def pick(self) -> BotApiInstance:
+        """The least loaded healthy instance, or the least loaded one if none is."""
+        healthy = [i for i in self.instances if i.healthy] or self.instances
+        candidates = [i for i in healthy if i.breaker.state == "closed"] or healthy
+        return min(candidates, key=lambda i: (i.in_flight, i.last_dispatched_at))
+
+    @contextlib.asynccontextmanager
+    async def acquire(
+        self, instance: BotApiInstance | None = None
+    ) -> AsyncIterator[BotApiInstance]:
+        """Pick an instance, unless given, and count a fetch in flight on it."""
+        instance = instance or self.pick()
+        instance.in_flight += 1
+        instance.last_dispatched_at = time.monotonic()
+        try:
+            yield instance
+        finally:
+            instance.in_flight -= 1
+
+    def mark_unhealthy(self, instance: BotApiInstance, error: Exception) -> None:
+        if instance.healthy:
+            logger.warning(f"Bot API instance {instance.name} is unhealthy: {error}")
+        instance.healthy = False
+        instance.last_error = str(error)
+
+    async def check(self, instance: BotApiInstance) -> bool:
+        """Check that an instance answers, and update its health."""
+        try:
+            await asyncio.wait_for(instance.bot.get_me(), self.health_timeout)
+        except Exception as e:
+            self.mark_unhealthy(instance, e)
+            return False
+        if not instance.healthy:
+            logger.info(f"Bot API instance {instance.name} is healthy again")
+        instance.healthy = True
+        instance.last_error = None
+        return True
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await asyncio.gather(*(self.check(i) for i in self.instances))
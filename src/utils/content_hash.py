@@ -0,0 +1,163 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from enum import StrEnum
+
+from .file_index import FileIndex
+from .fs import fs
+from .journal import DownloadJournal
+from .token_bucket import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class DedupMode(StrEnum):
+    OFF = "off"  # Keep identical files
+    HARDLINK = "hardlink"  # Replace the new file with a hard link to the existing one
+    SKIP = "skip"  # Delete the new file
+
+
+def new_hasher() -> "hashlib.blake2b":
+    """Content hash used for integrity checks and deduplication."""
+    return hashlib.blake2b(digest_size=32)
+
+
+def hash_file(
+    path: str, bucket: TokenBucket | None = None, chunk_size: int = HASH_CHUNK_SIZE
+) -> str:
+    """
+    Hash a file, reading it through a single reused buffer.
+
+    Args:
+        path (str): The file to hash.
+        bucket (TokenBucket | None): Limits the read rate, in bytes per second.
+        chunk_size (int): The number of bytes read at a time.
+
+    Returns:
+        str: The hex digest of the file.
+    """
+    hasher = new_hasher()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as file:
+        while read := file.readinto(buffer):
+            if bucket is not None:
+                bucket.acquire_blocking(read)
+            hasher.update(view[:read])
+    return hasher.hexdigest()
+
+
+def link_duplicate(existing: str, path: str) -> None:
+    """Replace `path` with a hard link to the identical file `existing`."""
+    tmp_path = os.path.join(
+        os.path.dirname(path) or ".", f".{os.path.basename(path)}.link"
+    )
+    os.link(existing, tmp_path)
+    try:
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+@dataclass
+class VerifyReport:
+    total: int = 0
+    checked: int = 0
+    hashed: int = 0  # Files that had no hash yet
+    mismatched: list[str] = field(default_factory=list)
+    missing: list[str] = field(default_factory=list)
+    started_at: float = field(default_factory=time.monotonic)
+
+
+class ContentVerifier:
+    """
+    Background integrity check of the files in the download directory.
+
+    Files are re-hashed one at a time, the least recently checked first, and
+    compared with the hash recorded when they were downloaded. Files without a
+    recorded hash are hashed and added to the index. Reads are limited to
+    `bytes_per_second` so a run doesn't starve the downloads of disk bandwidth,
+    and each result is recorded as it comes, so an interrupted run picks up where
+    it left off.
+    """
+
+    def __init__(
+        self,
+        file_index: FileIndex,
+        journal: DownloadJournal,
+        bytes_per_second: float,
+    ):
+        self.file_index = file_index
+        self.journal = journal
+        self.bucket = TokenBucket(bytes_per_second, capacity=HASH_CHUNK_SIZE)
+        self.report: VerifyReport | None = None
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, on_finished: Callable[[VerifyReport], Awaitable[None]]) -> bool:
+        """
+        Start a verification run, unless one is already running.
+
+        Returns:
+            bool: True if a new run was started.
+        """
+        if self.running:
+            return False
+        self.report = VerifyReport()
+        self._task = asyncio.create_task(self._run(on_finished), name="verify")
+        return True
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self, on_finished: Callable[[VerifyReport], Awaitable[None]]):
+        report = self.report
+        recorded = {
+            name: (size, digest)
+            for name, size, digest, _ in await asyncio.to_thread(self.journal.hashes)
+        }
+        # Files never hashed first, then the least recently checked
+        names = [name for name in self.file_index.names if name not in recorded]
+        names += recorded
+        report.total = len(names)
+
+        for name in names:
+            path = self.file_index.path(name) or ""
+            try:
+                size = (await fs.stat(path)).st_size
+                digest = await asyncio.to_thread(hash_file, path, self.bucket)
+            except FileNotFoundError:
+                if name in recorded:
+                    report.missing.append(name)
+                    self.journal.remove_hash(name)
+                self.file_index.discard(name)
+                continue
+            except OSError as e:
+                logger.warning(f"Error verifying {name}: {e}")
+                continue
+
+            report.checked += 1
+            if name not in recorded:
+                report.hashed += 1
+            elif recorded[name] != (size, digest):
+                # Keep the recorded hash, so the file is reported until it's fixed
+                logger.warning(f"Content of {name} changed since it was downloaded")
+                report.mismatched.append(name)
+                continue
+
+            self.file_index.add_digest(name, digest)
+            self.journal.record_hash(name, size, digest)
+
+        await on_finished(report)
@@ -0,0 +1,148 @@
+import asyncio
+import functools
+import logging
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+
+from .outbox import message_dispatcher
+
+logger = logging.getLogger(__name__)
+
+# Prefix of the callback data of the page buttons
+PAGE_CALLBACK_PREFIX = "status:"
+
+# Renders a page, returns its text and the total number of pages
+PageRenderer = Callable[[int], tuple[str, int]]
+
+
+@dataclass
+class Dashboard:
+    chat_id: int
+    message_id: int
+    page: int = 0
+    rendered: tuple[str, int, int] | None = None  # (text, page, page count)
+
+
+class DashboardManager:
+    """
+    Self-updating status messages, one per chat.
+
+    Each dashboard is a single message that is edited in place on a timer. The page
+    is rendered on every tick, but the message is only edited when the rendered text
+    or the paging changed, so idle dashboards cost no API calls. A dashboard whose
+    message can't be edited anymore, e.g. because it was deleted, is dropped.
+    """
+
+    def __init__(self, render: PageRenderer, interval: float = 5.0):
+        self.render = render
+        self.interval = interval
+        self._dashboards: dict[int, Dashboard] = {}
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop(), name="status-dashboards")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def open(self, chat_id: int) -> None:
+        """Send a new dashboard to the chat, replacing its previous one."""
+        previous = self._dashboards.pop(chat_id, None)
+        if previous is not None:
+            # Leave the old message as it is, without the page buttons
+            text, _, _ = previous.rendered
+            message_dispatcher.edit_message_text(
+                chat_id, previous.message_id, text, parse_mode="MarkdownV2"
+            )
+
+        text, page_count = self.render(0)
+        message = await message_dispatcher.send_message(
+            chat_id,
+            text,
+            parse_mode="MarkdownV2",
+            reply_markup=self._keyboard(0, page_count),
+        )
+
+        self._dashboards[chat_id] = Dashboard(
+            chat_id, message.message_id, rendered=(text, 0, page_count)
+        )
+
+    def show_page(self, chat_id: int, message_id: int, page: int) -> None:
+        """Switch a dashboard to another page and update it straight away."""
+        dashboard = self._dashboards.get(chat_id)
+        if dashboard is None or dashboard.message_id != message_id:
+            return
+
+        dashboard.page = page
+        self._refresh(dashboard)
+
+    def _refresh(self, dashboard: Dashboard) -> None:
+        text, page_count = self.render(dashboard.page)
+        dashboard.page = min(dashboard.page, max(page_count - 1, 0))
+
+        rendered = (text, dashboard.page, page_count)
+        if rendered == dashboard.rendered:
+            return
+
+        dashboard.rendered = rendered
+        edit = message_dispatcher.edit_message_text(
+            dashboard.chat_id,
+            dashboard.message_id,
+            text,
+            parse_mode="MarkdownV2",
+            reply_markup=self._keyboard(dashboard.page, page_count),
+        )
+        edit.add_done_callback(functools.partial(self._edited, dashboard))
+
+    def _edited(self, dashboard: Dashboard, edit: asyncio.Future) -> None:
+        if edit.cancelled():
+            return
+        error = edit.exception()
+        if not isinstance(error, BadRequest) or "not modified" in error.message:
+            return
+        # The message was deleted or can't be edited, stop updating it
+        if self._dashboards.get(dashboard.chat_id) is dashboard:
+            logger.info(
+                f"Dropping the status dashboard of {dashboard.chat_id}: {error}"
+            )
+            del self._dashboards[dashboard.chat_id]
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            for dashboard in list(self._dashboards.values()):
+                try:
+                    self._refresh(dashboard)
+                except Exception as e:
+                    logger.error(f"Error refreshing status dashboard: {e}")
+
+    @staticmethod
+    def _keyboard(page: int, page_count: int) -> InlineKeyboardMarkup | None:
+        if page_count <= 1:
+            return None
+
+        buttons = []
+        if page > 0:
+            buttons.append(
+                InlineKeyboardButton(
+                    "◀️ Previous", callback_data=f"{PAGE_CALLBACK_PREFIX}{page - 1}"
+                )
+            )
+        buttons.append(
+            InlineKeyboardButton(
+                f"{page + 1}/{page_count}",
+                callback_data=f"{PAGE_CALLBACK_PREFIX}{page}",
+            )
+        )
+        if page < page_count - 1:
+            buttons.append(
+                InlineKeyboardButton(
+                    "Next ▶️", callback_data=f"{PAGE_CALLBACK_PREFIX}{page + 1}"
+                )
+            )
+        return InlineKeyboardMarkup([buttons])
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import math
+import os
+import shutil
+import time
+from collections.abc import Iterable
+
+from ..models import DownloadFile
+from .fs import FilesystemTimeout, fs
+from .router import VolumeRouter
+
+logger = logging.getLogger(__name__)
+
+# Free space assumed for a filesystem that can't be read
+UNREADABLE_FREE_BYTES = 2**63
+
+
+class DiskSpaceManager:
+    """
+    Admission control on the free space of the download filesystems.
+
+    Each admitted job reserves its size on the filesystem of the Bot API directory
+    (where it is downloaded to) and of the volume it is moved to, or once if both are
+    on the same filesystem. With several Bot API instances, the instance serving the
+    job is only known once its download starts, so until then its size is reserved
+    on the filesystems of all their directories. The volume is picked by the router
+    when the job is admitted, among those with enough space. A job is only admitted
+    if its size fits in the free space left after the other reservations and a
+    safety margin.
+
+    Reservations shrink as the job writes its file, so the space it already takes up
+    isn't counted twice. Disk usage readings are only taken by `refresh`, in the
+    filesystem thread pool, and are read again once they are `ttl` seconds old. The
+    checks use the last readings, so they never touch the filesystem on the event
+    loop.
+    """
+
+    def __init__(
+        self,
+        download_dirs: list[str],
+        router: VolumeRouter,
+        margin: int = 0,
+        ttl: float = 5.0,
+    ):
+        self.download_dirs = download_dirs
+        self.router = router
+        self.margin = margin
+        self.ttl = ttl
+
+        self._reservations: dict[str, DownloadFile] = {}
+        self._usage: dict[str, tuple[float, int]] = {}  # path -> (read at, free bytes)
+        self._devices: dict[str, tuple[float, int | str]] = {}  # path -> (read at, dev)
+        self._refresh_lock = asyncio.Lock()
+
+    @property
+    def reserved_bytes(self) -> int:
+        devices = {self._device(path) for path in self.download_dirs}
+        devices.update(
+            self._device(file.destination_dir) for file in self._reservations.values()
+        )
+        return sum(
+            self._outstanding(file, device)
+            for file in self._reservations.values()
+            for device in devices
+        )
+
+    def free_bytes(self, path: str) -> int:
+        """Free space of the filesystem of `path`, as last read by `refresh`."""
+        cached = self._usage.get(path)
+        # Counted as unreadable until it is first read
+        return cached[1] if cached else UNREADABLE_FREE_BYTES
+
+    def in_flight_bytes(self, path: str) -> int:
+        """Bytes the admitted jobs have yet to write to the filesystem of `path`."""
+        device = self._device(path)
+        return sum(
+            self._outstanding(file, device) for file in self._reservations.values()
+        )
+
+    def available_bytes(self, path: str) -> int:
+        """Free space of the filesystem of `path` that isn't reserved."""
+        return self.free_bytes(path) - self.in_flight_bytes(path) - self.margin
+
+    async def refresh(self, paths: Iterable[str | None] = ()) -> None:
+        """
+        Read the expired disk usage and filesystem IDs off the event loop.
+
+        Called before jobs are admitted, so `try_reserve` finds them in the cache. A
+        filesystem that doesn't answer in time is counted as unreadable.
+
+        Args:
+            paths (Iterable[str | None]): More paths to read, besides the download
+                directories, the volumes and the destinations of the reservations.
+        """
+        paths = {*paths, *self.download_dirs, *self.router.volumes}
+        paths.update(f.destination_dir for f in self._reservations.values())
+        paths.discard(None)
+
+        async with self._refresh_lock:
+            for path in paths:
+                now = time.monotonic()
+                cached = self._usage.get(path)
+                if cached is None or now - cached[0] >= self.ttl:
+                    try:
+                        free = await fs.run(self._disk_free, path)
+                    except FilesystemTimeout:
+                        free = UNREADABLE_FREE_BYTES
+                    self._usage[path] = (now, free)
+
+                cached = self._devices.get(path)
+                if cached is None or now - cached[0] >= self.ttl:
+                    try:
+                        device = await fs.run(_read_device, path)
+                    except FilesystemTimeout:
+                        device = path
+                    self._devices[path] = (now, device)
+
+    def try_reserve(self, file: DownloadFile) -> bool:
+        """
+        Pick a volume for a job and reserve the space it needs, if there is enough.
+
+        Returns:
+            bool: True if the job was admitted.
+        """
+        if file.file_id in self._reservations:
+            return True
+
+        if file.destination_dir:
+            volumes = [file.destination_dir]
+        else:
+            volumes = self.router.place(
+                file, self.available_bytes, self.in_flight_bytes
+            )
+
+        for volume in volumes:
+            if self._fits(file, volume):
+                file.destination_dir = volume
+                self._reservations[file.file_id] = file
+                return True
+        return False
+
+    def release(self, file: DownloadFile) -> None:
+        """Release the reservation of a finished or failed job."""
+        if self._reservations.pop(file.file_id, None) is not None:
+            # The job's file has been written or removed, read the usage again
+            self._usage = {
+                path: (-math.inf, free) for path, (_, free) in self._usage.items()
+            }
+
+    def _fits(self, file: DownloadFile, volume: str) -> bool:
+        download_paths = {
+            self._device(path): path for path in self._download_dirs_of(file)
+        }
+        volume_device = self._device(volume)
+
+        needed = dict.fromkeys([*download_paths, volume_device], 0)
+        if not file.file_path:
+            for device in download_paths:
+                needed[device] += max(0, file.file_size - file.bytes_downloaded)
+        if volume_device not in download_paths:
+            needed[volume_device] += max(0, file.file_size - file.bytes_moved)
+
+        paths = {volume_device: volume, **download_paths}
+        return all(
+            bytes_needed <= self.available_bytes(paths[device])
+            for device, bytes_needed in needed.items()
+        )
+
+    def _outstanding(self, file: DownloadFile, device: int | str) -> int:
+        """Bytes the job has reserved but not written yet on a filesystem."""
+        download_devices = {self._device(path) for path in self._download_dirs_of(file)}
+        destination_device = self._device(file.destination_dir)
+
+        outstanding = 0
+        if device in download_devices and not file.file_path:
+            outstanding += max(0, file.file_size - file.bytes_downloaded)
+        if device == destination_device and destination_device not in download_devices:
+            # Moves within a filesystem are renames and don't take up more space
+            outstanding += max(0, file.file_size - file.bytes_moved)
+        return outstanding
+
+    def _download_dirs_of(self, file: DownloadFile) -> list[str]:
+        """The directory of the Bot API instance serving the job, or all of them."""
+        return [file.documents_dir] if file.documents_dir else self.download_dirs
+
+    def _device(self, path: str | None) -> int | str:
+        """ID of the filesystem of `path`, as last read by `refresh`."""
+        if path is None:
+            return ""
+
+        cached = self._devices.get(path)
+        # Counted as a filesystem of its own until it is first read
+        return cached[1] if cached else path
+
+    def _disk_free(self, path: str) -> int:
+        try:
+            return shutil.disk_usage(_existing_parent(path)).free
+        except OSError as e:
+            # Don't block every download on a filesystem that can't be read
+            logger.warning(f"Couldn't read disk usage of {path}: {e}")
+            return UNREADABLE_FREE_BYTES
+
+
+def _read_device(path: str) -> int | str:
+    try:
+        return os.stat(_existing_parent(path)).st_dev
+    except OSError:
+        return path  # Count it as a filesystem of its own
+
+
+def _existing_parent(path: str) -> str:
+    """The path itself, or its closest parent if it hasn't been created yet."""
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
@@ -1,7 +1,9 @@
 import logging
+from datetime import time
+from typing import Literal
 
 from dotenv import load_dotenv
-from pydantic import ValidationError
+from pydantic import BaseModel, ValidationError
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 logger = logging.getLogger(__name__)
@@ -9,6 +11,43 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 
+class RoutingRule(BaseModel):
+    """Sends the files matching all of the given conditions to one of `volumes`."""
+
+    volumes: list[str]
+    mime_type: str | None = None  # Shell-style pattern, e.g. "video/*"
+    file_name: str | None = None  # Regular expression searched in the file name
+    min_size_mb: float | None = None
+    max_size_mb: float | None = None
+
+
+class AuthorizedUser(BaseModel):
+    """Another user allowed to use the bot, with their share of the download queue."""
+
+    id: str
+    chat_id: str | None = None  # Defaults to the user's private chat with the bot
+    weight: float = 1.0
+    max_concurrent_downloads: int | None = None
+    max_queued_mb: float | None = None
+
+
+class BotApiServer(BaseModel):
+    """Another Bot API server instance, writing its files to `dir`."""
+
+    url: str
+    dir: str
+    name: str | None = None  # Defaults to the host and port of the URL
+
+
+class IoScheduleRule(BaseModel):
+    """An I/O rate limit for the times of day from `start` to `end` (local time)."""
+
+    start: time
+    end: time  # Before `start` for a window over midnight
+    mb_per_second: float | None = None  # Unlimited when not set
+    volume: str | None = None  # The overall limit when not set
+
+
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(
         env_file=".env", env_file_encoding="utf-8", extra="ignore"
@@ -20,6 +59,141 @@ class Settings(BaseSettings):
     USER_ID: str
     CHAT_ID: str
 
+    # Download scheduler
+    MAX_CONCURRENT_DOWNLOADS: int = 2
+    SHORTEST_JOB_FIRST: bool = False
+
+    # More users and chats allowed to use the bot (JSON lists), besides USER_ID and
+    # CHAT_ID. Downloads are shared fairly between users, in proportion to their
+    # weights, within their limits (the defaults below, if not set for the user)
+    USERS: list[AuthorizedUser] = []
+    CHAT_IDS: list[str] = []
+    USER_MAX_CONCURRENT_DOWNLOADS: int | None = None
+    USER_MAX_QUEUED_MB: float | None = None
+
+    # Set to false when the Bot API server runs on another host: files are then
+    # fetched from its file URL with parallel Range requests
+    LOCAL_MODE: bool = True
+    RANGED_CHUNK_SIZE_MB: int = 8
+    RANGED_CONNECTIONS: int = 4
+
+    # Extra Bot API servers that files are fetched from (JSON list), besides the
+    # one at LOCAL_BOT_API_URL, and how often their health is checked
+    BOT_API_SERVERS: list[BotApiServer] = []
+    BOT_API_HEALTH_INTERVAL: float = 15.0
+
+    # Bot API connection pools. getFile blocks until the file is downloaded, so it
+    # gets its own pool (defaults to one connection per concurrent download)
+    MESSAGE_POOL_SIZE: int = 256
+    MESSAGE_READ_TIMEOUT: float = 5.0
+    FILE_POOL_SIZE: int | None = None
+    FILE_READ_TIMEOUT: float = 1800.0
+
+    # Media metadata read from the downloaded files, in worker processes
+    MEDIA_INFO: bool = True
+    MEDIA_INFO_WORKERS: int = 2
+    MEDIA_INFO_QUEUE_SIZE: int = 16
+
+    # Download history for /stats, with the windows in seconds (JSON list)
+    HISTORY_MAX_RECORDS: int = 10000
+    STATS_WINDOWS: list[float] = [3600, 86400, 604800]
+
+    # Download journal (defaults to a file in BOT_API_DIR), and how long finished
+    # jobs and state transitions are kept in it
+    JOURNAL_PATH: str | None = None
+    JOURNAL_FLUSH_INTERVAL: float = 1.0
+    JOURNAL_RETENTION_DAYS: float = 30.0
+
+    # Extra download directories (JSON lists), the first matching rule picks the
+    # volumes a file can go to, otherwise it can go to any of them
+    VOLUMES: list[str] = []
+    ROUTING_RULES: list[RoutingRule] = []
+    PLACEMENT_POLICY: Literal["most_free", "least_in_flight"] = "most_free"
+
+    # Free space kept on the download filesystems, and how long usage is cached
+    DISK_SPACE_MARGIN_MB: int = 512
+    DISK_USAGE_TTL: float = 5.0
+
+    # Files kept in BOT_API_DIR for reuse, and removal of unknown files
+    BOT_API_CACHE_MAX_MB: int = 10240
+    BOT_API_CACHE_SWEEP_INTERVAL: float = 600.0
+    BOT_API_ORPHAN_AGE: float = 86400.0
+
+    # Content hashing of moved files, deduplication and /verify
+    CONTENT_HASH: bool = False
+    DEDUP_MODE: Literal["off", "hardlink", "skip"] = "hardlink"
+    VERIFY_MAX_MB_PER_SECOND: float = 50.0
+
+    # Moving files across filesystems
+    MOVE_FSYNC_POLICY: Literal["none", "file", "full"] = "file"
+    MOVE_CHUNK_SIZE_MB: int = 64
+    # Start copying a file to another filesystem while it is still downloading
+    PIPELINED_MOVE: bool = False
+
+    # I/O rate limits of moves and remote downloads in MB/s, overall and for each
+    # download directory (JSON object), unlimited when not set. The schedule rules
+    # (JSON list) replace them at some times of day, and /throttle at runtime
+    IO_MAX_MB_PER_SECOND: float | None = None
+    IO_VOLUME_MAX_MB_PER_SECOND: dict[str, float] = {}
+    IO_SCHEDULE: list[IoScheduleRule] = []
+
+    # Filesystem calls made from the event loop run in their own thread pool, and
+    # fail after FS_TIMEOUT seconds instead of hanging on a stalled mount
+    FS_WORKERS: int = 8
+    FS_TIMEOUT: float = 30.0
+
+    # Seconds between download progress samples
+    PROGRESS_INTERVAL: float = 2.0
+
+    # Outbound message rate limits
+    MESSAGES_PER_SECOND_PER_CHAT: float = 1.0
+    MESSAGES_PER_SECOND: float = 25.0
+
+    # Seconds between updates of the /status dashboard
+    STATUS_REFRESH_INTERVAL: float = 5.0
+
+    # Seconds to wait for more files sent together before asking for confirmation
+    BATCH_WINDOW: float = 1.5
+    BATCH_MAX_WAIT: float = 10.0
+    # Seconds a confirmation can be answered before it expires
+    CONFIRMATION_TTL: float = 86400.0
+
+    # Retries of failed downloads
+    RETRY_MAX_ATTEMPTS: int = 5
+    RETRY_BASE_DELAY: float = 5.0
+    RETRY_MAX_DELAY: float = 300.0
+    BREAKER_FAILURE_THRESHOLD: int = 3
+    BREAKER_RESET_TIMEOUT: float = 30.0
+
+    # Webhook mode, used instead of polling when a URL is set. The URL must be
+    # reachable by the Bot API server, e.g. http://bot:8443/webhook in Docker
+    WEBHOOK_URL: str | None = None
+    WEBHOOK_LISTEN: str = "0.0.0.0"
+    WEBHOOK_PORT: int = 8443
+    WEBHOOK_SECRET_TOKEN: str | None = None  # Generated on startup when not set
+    WEBHOOK_MAX_CONNECTIONS: int = 40
+
+    # Log when the event loop is blocked for longer than this many seconds (0 to
+    # disable), and what it was running if LOOP_LAG_STACKS is set
+    LOOP_LAG_THRESHOLD: float = 0.5
+    LOOP_LAG_STACKS: bool = False
+
+    # Prometheus metrics endpoint, disabled unless a port is set
+    METRICS_HOST: str = "0.0.0.0"
+    METRICS_PORT: int | None = None
+
+    # Per-job tracing spans, written to a rotating JSON-lines file (defaults to a
+    # file in BOT_API_DIR) or sent to an OpenTelemetry collector over OTLP/HTTP
+    TRACING: Literal["off", "jsonl", "otlp"] = "off"
+    TRACE_PATH: str | None = None
+    TRACE_MAX_MB: int = 50
+    TRACE_BACKUPS: int = 3
+    TRACE_FLUSH_INTERVAL: float = 5.0
+    OTLP_ENDPOINT: str = "http://localhost:4318/v1/traces"
+
+    # Longest window of the /profile command, in seconds
+    PROFILE_MAX_SECONDS: float = 300.0
+
 
 logger.info("Loading environment variables")
 
@@ -0,0 +1,149 @@
+import logging
+import os
+from collections.abc import Iterable
+
+from .fs import fs
+
+logger = logging.getLogger(__name__)
+
+
+class FileIndex:
+    """
+    In-memory index of the files in the download directories.
+
+    File names are unique across all the directories. Files are indexed by name and,
+    for files downloaded by the bot, by Telegram's `file_unique_id` and by content
+    hash, so duplicate checks are dictionary lookups instead of filesystem calls.
+    Positive hits are confirmed against the filesystem, which keeps the index correct
+    when files are deleted outside the bot. Files added outside the bot are only seen
+    when a lookup is given the directory the file would be written to, which is
+    checked directly. The checks run in the filesystem thread pool, so a hung volume
+    doesn't block the event loop.
+    """
+
+    def __init__(self, directories: list[str]):
+        self.directories = directories
+        self._names: dict[str, str] = {}  # file_name -> directory
+        self._unique_ids: dict[str, str] = {}
+        self._digests: dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    @property
+    def names(self) -> list[str]:
+        return sorted(self._names)
+
+    def build(
+        self,
+        downloaded: Iterable[tuple[str, str]] = (),
+        hashes: Iterable[tuple[str, str]] = (),
+    ) -> None:
+        """
+        Scan the directories and rebuild the index.
+
+        Args:
+            downloaded (Iterable[tuple[str, str]]): (file_unique_id, file_name) pairs
+                of files previously downloaded by the bot.
+            hashes (Iterable[tuple[str, str]]): (file_name, content hash) pairs of
+                files hashed by the bot.
+        """
+        names = {}
+        for directory in self.directories:
+            if not os.path.isdir(directory):
+                continue
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        names.setdefault(entry.name, directory)
+
+        self._names = names
+        self._unique_ids = {
+            unique_id: name
+            for unique_id, name in downloaded
+            if unique_id and name in names
+        }
+        self._digests = {digest: name for name, digest in hashes if name in names}
+        logger.info(
+            f"Indexed {len(self._names)} files in {len(self.directories)} directories"
+        )
+
+    def path(self, file_name: str) -> str | None:
+        """The path of an indexed file."""
+        directory = self._names.get(file_name)
+        return os.path.join(directory, file_name) if directory else None
+
+    def add(
+        self,
+        file_name: str,
+        file_unique_id: str | None = None,
+        directory: str | None = None,
+    ) -> None:
+        self._names[file_name] = (
+            directory or self._names.get(file_name) or self.directories[0]
+        )
+        if file_unique_id:
+            self._unique_ids[file_unique_id] = file_name
+
+    def add_digest(self, file_name: str, digest: str) -> None:
+        self._digests.setdefault(digest, file_name)
+
+    def discard(self, file_name: str) -> None:
+        self._names.pop(file_name, None)
+        for unique_id in [k for k, v in self._unique_ids.items() if v == file_name]:
+            del self._unique_ids[unique_id]
+        for digest in [k for k, v in self._digests.items() if v == file_name]:
+            del self._digests[digest]
+
+    async def find(
+        self,
+        file_name: str,
+        file_unique_id: str | None = None,
+        directory: str | None = None,
+    ) -> str | None:
+        """
+        Find an existing file with the same name or the same Telegram content.
+
+        Args:
+            file_name (str): The name of the file.
+            file_unique_id (str | None): Telegram's unique ID of the file content.
+            directory (str | None): The directory the file would be written to. When
+                the index has no match, the file is looked up there, in case it was
+                added outside the bot.
+
+        Returns:
+            str | None: The name of the existing file, or None if there is none.
+        """
+        if file_name in self._names:
+            match = file_name
+        elif file_unique_id in self._unique_ids:
+            match = self._unique_ids[file_unique_id]
+        elif directory and await fs.exists(os.path.join(directory, file_name)):
+            self.add(file_name, directory=directory)
+            return file_name
+        else:
+            return None
+
+        # Drop entries for files that were removed since the index was built
+        if not await fs.exists(self.path(match)):
+            self.discard(match)
+            return None
+
+        return match
+
+    async def find_content(self, digest: str, exclude: str | None = None) -> str | None:
+        """
+        Find an existing file with the same content hash.
+
+        Returns:
+            str | None: The name of the existing file, or None if there is none.
+        """
+        match = self._digests.get(digest)
+        if match is None or match == exclude:
+            return None
+
+        if not await fs.exists(self.path(match)):
+            self.discard(match)
+            return None
+
+        return match
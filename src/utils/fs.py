@@ -0,0 +1,100 @@
+import asyncio
+import errno
+import functools
+import logging
+import os
+import shutil
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, TypeVar
+
+from . import metrics
+from .env import env
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class FilesystemTimeout(OSError):
+    """A filesystem call didn't return in time, e.g. on a hung network mount."""
+
+
+class AsyncFilesystem:
+    """
+    Runs blocking filesystem calls in a dedicated thread pool, with a timeout.
+
+    Even a metadata call like `os.stat` can block for minutes on a stalled network
+    mount, which would hold up every handler if it ran on the event loop. Here the
+    loop only waits up to `timeout` seconds for the result, then gets a
+    `FilesystemTimeout` (an `OSError`, so existing error handling applies).
+
+    A thread can't be interrupted, so a call that timed out keeps its worker until
+    the OS returns. The pool is bounded and separate from the default executor: a
+    hung mount can take up all `max_workers` threads, after which further calls time
+    out waiting for one, but moves and hashing in the default executor carry on.
+
+    Long copies don't belong here, their duration depends on the file size.
+    """
+
+    def __init__(self, max_workers: int = 8, timeout: float = 30.0):
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="fs")
+
+    async def run(
+        self, func: Callable[..., T], *args: Any, timeout: float | None = None
+    ) -> T:
+        """
+        Call `func(*args)` in the pool.
+
+        Raises:
+            FilesystemTimeout: If the call didn't return within the timeout.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, functools.partial(func, *args))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except TimeoutError:
+            name = getattr(func, "__name__", "call")
+            metrics.fs_timeouts_total.inc(operation=name)
+            path = args[0] if args and isinstance(args[0], str) else None
+            logger.warning(f"Filesystem call {name}({path or ''}) timed out")
+            raise FilesystemTimeout(
+                errno.ETIMEDOUT, f"{name} timed out after {timeout:g}s", path
+            ) from None
+
+    async def exists(self, path: str) -> bool:
+        return await self.run(os.path.exists, path)
+
+    async def stat(self, path: str) -> os.stat_result:
+        return await self.run(os.stat, path)
+
+    async def makedirs(self, path: str) -> None:
+        await self.run(_makedirs, path)
+
+    async def rename(self, src: str, dst: str) -> None:
+        await self.run(os.rename, src, dst)
+
+    async def remove(self, path: str) -> None:
+        await self.run(os.remove, path)
+
+    async def chmod(self, path: str, mode: int) -> None:
+        await self.run(os.chmod, path, mode)
+
+    async def disk_usage(self, path: str) -> tuple[int, int, int]:
+        """Total, used and free bytes of the filesystem of `path`."""
+        return await self.run(shutil.disk_usage, path)
+
+    def shutdown(self) -> None:
+        """Stop the workers once they are idle, without waiting for hung calls."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _makedirs(path: str) -> None:
+    os.makedirs(path, exist_ok=True)
+
+
+# Filesystem calls made from the event loop
+fs = AsyncFilesystem(env.FS_WORKERS, timeout=env.FS_TIMEOUT)
@@ -1,68 +1,210 @@
-import asyncio
 import logging
 import os
+from urllib.parse import urlparse
 
-from telegram import Bot, File
-from telegram.error import NetworkError
+from telegram import File
 
 from src.utils.env import env
 
 from ..models import DownloadFile, downloading_files
+from .bandwidth import io_limiter
+from .bot_api_pool import BotApiInstance, BotApiPool
+from .file_index import FileIndex
+from .fs import fs
+from .ranged_download import RangedDownloader
+from .retry import CircuitBreaker, ErrorKind, RetryPolicy, classify, retry_call
+from .router import volume_router
+from .tracing import tracer
 
 logger = logging.getLogger(__name__)
 
-# Retry constants
-MAX_RETRIES = 5
-INITIAL_RETRY_DELAY = 5
-
-# Environment variables
-DOWNLOAD_TO_DIR = env.DOWNLOAD_TO_DIR
-
-
-async def get_file(bot: Bot, file: DownloadFile) -> File:
+# Retry policy for file downloads
+retry_policy = RetryPolicy(
+    max_attempts=env.RETRY_MAX_ATTEMPTS,
+    base_delay=env.RETRY_BASE_DELAY,
+    max_delay=env.RETRY_MAX_DELAY,
+)
+
+
+def _bot_api_instance(name: str, url: str, api_dir: str) -> BotApiInstance:
+    # Each instance has its own breaker, so downloads only wait on the server they use
+    breaker = CircuitBreaker(
+        failure_threshold=env.BREAKER_FAILURE_THRESHOLD,
+        reset_timeout=env.BREAKER_RESET_TIMEOUT,
+        name=f"Bot API instance {name}",
+    )
+    return BotApiInstance(name, url, api_dir, env.BOT_TOKEN, breaker)
+
+
+# Bot API servers that getFile calls are spread over, the first one also gets updates
+bot_api_pool = BotApiPool(
+    [
+        _bot_api_instance("primary", env.LOCAL_BOT_API_URL, env.BOT_API_DIR),
+        *(
+            _bot_api_instance(
+                server.name or urlparse(server.url).netloc, server.url, server.dir
+            )
+            for server in env.BOT_API_SERVERS
+        ),
+    ],
+    health_interval=env.BOT_API_HEALTH_INTERVAL,
+)
+
+# Fetches files from a remote Bot API server, when not in local mode
+ranged_downloader = RangedDownloader(
+    chunk_size=env.RANGED_CHUNK_SIZE_MB * 1024 * 1024,
+    connections=env.RANGED_CONNECTIONS,
+    throttle=io_limiter.throttle,
+)
+
+# Files in the download directories, built on startup
+file_index = FileIndex(volume_router.volumes)
+
+
+async def get_file(pool: BotApiPool, file: DownloadFile) -> File:
     """
     Download a file from Telegram with retry logic.
+
+    Each attempt is sent to the least loaded healthy Bot API instance of the pool,
+    which is recorded in `file.bot_api_instance` and `file.documents_dir`. The
+    attempt waits on the circuit breaker of that instance. When the
+    server isn't local, the file is fetched to its documents directory, under the
+    name it has on the server.
+
     Args:
-        bot (Bot): The bot instance used to download the file.
+        pool (BotApiPool): The Bot API instances to download the file from.
         file (DownloadFile): The download file object (containing file_id).
     Returns:
         File: The downloaded file object.
     Raises:
-        Exception: If the maximum number of retries is reached/non network error occurs
-        or file already exists.
+        Exception: If the maximum number of retries is reached, a permanent error
+        occurs or the file already exists.
     """
-    for i in range(MAX_RETRIES):
-        # Log attempt
-        logger.info(f"Downloading file, attempt {i + 1}")
-        file.download_retries = i
+
+    picked: BotApiInstance | None = None
+
+    def next_breaker() -> CircuitBreaker:
+        nonlocal picked
+        picked = pool.pick()
+        return picked.breaker
+
+    async def attempt() -> File:
+        logger.info(f"Downloading file, attempt {file.download_retries + 1}")
 
         # Check if file exists in directory already
-        check_file_exists(file.file_id, file.file_name, check_downloading_files=False)
+        await check_file_exists(
+            file.file_id,
+            file.file_name,
+            file.file_unique_id,
+            check_downloading_files=False,
+            directory=file.destination_dir or env.DOWNLOAD_TO_DIR,
+        )
+        async with pool.acquire(picked) as instance:
+            file.bot_api_instance = instance.name
+            file.documents_dir = instance.documents_dir
+            with tracer.span(
+                "get_file.attempt",
+                attempt=file.download_retries + 1,
+                bot_api_instance=instance.name,
+            ):
+                try:
+                    # Uses the read timeout of the instance's file request pool
+                    with tracer.span("getFile"):
+                        new_file = await instance.bot.get_file(file.file_id)
+                    if not env.LOCAL_MODE:
+                        await fs.makedirs(instance.documents_dir)
+                        path = os.path.join(
+                            instance.documents_dir, new_file.file_path.split("/")[-1]
+                        )
+                        with tracer.span(
+                            "ranged_download",
+                            connections=ranged_downloader.connections,
+                            chunk_size=ranged_downloader.chunk_size,
+                        ):
+                            await ranged_downloader.download(
+                                new_file.file_path, path, file
+                            )
+                except Exception as e:
+                    # Send the retry to another instance until this one passes a check
+                    if classify(e) == ErrorKind.UNAVAILABLE and len(pool.instances) > 1:
+                        pool.mark_unhealthy(instance, e)
+                    raise
+        return new_file
+
+    def on_retry(retries: int, delay: float, error: Exception) -> None:
+        file.download_retries = retries
+        file.total_backoff += delay
+        file.last_error = f"{classify(error)}: {error}"
+
+    with tracer.span("get_file", trace_id=file.trace_id, size=file.file_size) as span:
+        try:
+            new_file = await retry_call(attempt, retry_policy, next_breaker, on_retry)
+        except Exception as e:
+            if classify(e) == ErrorKind.PERMANENT:
+                raise
+            raise Exception(f"Max retries reached: {e}") from e
+        finally:
+            span.set(
+                retries=file.download_retries,
+                backoff_seconds=file.total_backoff,
+                bot_api_instance=file.bot_api_instance,
+            )
+
+    logger.info("File downloaded successfully")
+    return new_file
+
 
+async def check_files_exist(files: list[DownloadFile]) -> dict[str, str]:
+    """
+    Check a batch of files for duplicates.
+
+    Files are checked against the download directory, the current downloads and
+    the other files of the batch.
+
+    Args:
+        files (list[DownloadFile]): The files to check.
+
+    Returns:
+        dict[str, str]: The reason each duplicate file was rejected, by file_id.
+    """
+    duplicates = {}
+    seen_names, seen_unique_ids = set(), set()
+
+    for file in files:
         try:
-            new_file = await bot.get_file(file.file_id, read_timeout=1800)
-            logger.info("File downloaded successfully")
-            break
-        except NetworkError as e:
-            logger.error(f"Server disconnect error: {e}")
-            await asyncio.sleep(INITIAL_RETRY_DELAY * i)
+            await check_file_exists(file.file_id, file.file_name, file.file_unique_id)
+            if file.file_name in seen_names or file.file_unique_id in seen_unique_ids:
+                raise Exception("File is sent more than once.")
+        except Exception as e:
+            duplicates[file.file_id] = str(e)
 
-    else:
-        raise Exception("Max retries reached")
+        seen_names.add(file.file_name)
+        if file.file_unique_id:
+            seen_unique_ids.add(file.file_unique_id)
 
-    return new_file
+    return duplicates
 
 
-def check_file_exists(
-    file_id: str, file_name: str, check_downloading_files: bool = True
+async def check_file_exists(
+    file_id: str,
+    file_name: str,
+    file_unique_id: str | None = None,
+    check_downloading_files: bool = True,
+    directory: str | None = None,
 ) -> bool:
     """
     Check if a file exists in the download directory or is currently being downloaded.
 
+    Files are matched by name and by file_unique_id, so the same media forwarded
+    under a different name is also detected.
+
     Args:
         file_id (str): The ID of the file to check.
         file_name (str): The name of the file to check.
+        file_unique_id (str | None): Telegram's unique ID of the file content.
         check_downloading_files (bool): Whether to check the downloading_files dictionary.
+        directory (str | None): The directory the file will be written to, checked
+            directly for a file of the same name that the index doesn't know about.
 
     Returns:
         bool: True if the file exists
@@ -70,15 +212,18 @@ def check_file_exists(
     Raises:
         Exception: If the file already exists in the download directory or is being downloaded.
     """
-    if os.path.exists(DOWNLOAD_TO_DIR + file_name):
+    existing_name = await file_index.find(file_name, file_unique_id, directory)
+    if existing_name == file_name:
         raise Exception("File already exists in downloads folder.")
+    if existing_name:
+        raise Exception(f"File already exists in downloads folder as {existing_name}.")
 
     if check_downloading_files:
-        if file_id in downloading_files:
-            raise Exception("File is already being downloaded.")
-
-        # Check file_name in downloading_files
-        if any(file.file_name == file_name for file in downloading_files.values()):
+        if (
+            file_id in downloading_files
+            or file_name in downloading_files.names
+            or file_unique_id in downloading_files.unique_ids
+        ):
             raise Exception("File is already being downloaded.")
 
     return True
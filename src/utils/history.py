@@ -0,0 +1,155 @@
+import math
+import time
+from collections import deque
+
+from ..models import DownloadFile
+
+# Log-spaced buckets for percentiles within about 5% (ratio 1.1), from 1 ms to a
+# few months, so a window's percentiles cost the same however many jobs it has
+BUCKET_RATIO = 1.1
+MIN_VALUE = 1e-3
+BUCKET_COUNT = 260
+
+OUTCOMES = ("success", "error", "cancelled")
+
+
+class JobRecord:
+    """Compact record of a finished download job."""
+
+    __slots__ = (
+        "download_seconds",
+        "file_size",
+        "finished_at",
+        "move_seconds",
+        "outcome",
+    )
+
+    def __init__(
+        self,
+        finished_at: float,
+        outcome: str,
+        file_size: int,
+        download_seconds: float,
+        move_seconds: float,
+    ):
+        self.finished_at = finished_at  # time.monotonic()
+        self.outcome = outcome
+        self.file_size = file_size
+        self.download_seconds = download_seconds
+        self.move_seconds = move_seconds
+
+
+class LogHistogram:
+    """Counts of values in log-spaced buckets, which can be added and removed."""
+
+    __slots__ = ("counts", "total")
+
+    def __init__(self):
+        self.counts = [0] * BUCKET_COUNT
+        self.total = 0
+
+    def add(self, value: float, count: int = 1) -> None:
+        self.counts[self._bucket(value)] += count
+        self.total += count
+
+    def percentile(self, percent: float) -> float:
+        """Middle of the bucket holding the percentile, 0 if empty."""
+        if not self.total:
+            return 0.0
+        rank = math.ceil(self.total * percent / 100)
+        cumulative = 0
+        for bucket, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return MIN_VALUE * BUCKET_RATIO ** max(0, bucket - 0.5)
+        return MIN_VALUE * BUCKET_RATIO ** (BUCKET_COUNT - 1)
+
+    @staticmethod
+    def _bucket(value: float) -> int:
+        if value <= MIN_VALUE:
+            return 0
+        bucket = math.ceil(math.log(value / MIN_VALUE, BUCKET_RATIO))
+        return min(bucket, BUCKET_COUNT - 1)
+
+
+class WindowStats:
+    """Aggregates of the jobs finished in a sliding time window."""
+
+    def __init__(self, seconds: float | None, max_records: int):
+        self.seconds = seconds  # None for all the jobs since startup
+        self.max_records = max_records
+        self.outcomes = dict.fromkeys(OUTCOMES, 0)
+        self.bytes = 0
+        self.job_seconds = 0.0
+        self.download = LogHistogram()
+        self.move = LogHistogram()
+        self._records: deque[JobRecord] = deque()
+
+    @property
+    def count(self) -> int:
+        return sum(self.outcomes.values())
+
+    def add(self, record: JobRecord) -> None:
+        self._update(record, 1)
+        if self.seconds is not None:
+            self._records.append(record)
+            if len(self._records) > self.max_records:
+                self._update(self._records.popleft(), -1)
+
+    def expire(self, now: float) -> None:
+        """Remove the jobs that finished before the window."""
+        if self.seconds is None:
+            return
+        while self._records and now - self._records[0].finished_at > self.seconds:
+            self._update(self._records.popleft(), -1)
+
+    def _update(self, record: JobRecord, sign: int) -> None:
+        self.outcomes[record.outcome] += sign
+        if record.outcome != "success":
+            return
+        self.bytes += sign * record.file_size
+        self.job_seconds += sign * (record.download_seconds + record.move_seconds)
+        self.download.add(record.download_seconds, sign)
+        self.move.add(record.move_seconds, sign)
+
+
+class DownloadHistory:
+    """
+    Bounded history of finished download jobs, with statistics over time windows.
+
+    The statistics are updated as jobs are added and leave their windows, so reading
+    them doesn't depend on the number of jobs in the history.
+    """
+
+    def __init__(self, max_records: int = 10000, windows: list[float] = ()):
+        self.records: deque[JobRecord] = deque(maxlen=max_records)
+        self.windows = [WindowStats(seconds, max_records) for seconds in windows]
+        self.all_time = WindowStats(None, max_records)
+        self.started_at = time.monotonic()
+
+    def add(self, file: DownloadFile, outcome: str) -> None:
+        """Record a finished job, its durations only count if it succeeded."""
+        success = outcome == "success"
+        record = JobRecord(
+            time.monotonic(),
+            outcome,
+            file.file_size,
+            file.download_seconds if success else 0.0,
+            file.move_seconds if success else 0.0,
+        )
+        self.records.append(record)
+        self.all_time.add(record)
+        for window in self.windows:
+            window.add(record)
+
+    def stats(self) -> list[WindowStats]:
+        """The statistics of each window, then of all the jobs since startup."""
+        now = time.monotonic()
+        for window in self.windows:
+            window.expire(now)
+        return [*self.windows, self.all_time]
+
+    def span(self, window: WindowStats) -> float:
+        """Seconds covered by a window, shorter than it since startup."""
+        uptime = time.monotonic() - self.started_at
+        return uptime if window.seconds is None else min(window.seconds, uptime)
@@ -0,0 +1,371 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Callable, Iterable
+
+from ..models import DownloadFile, JobState, MediaInfo
+
+logger = logging.getLogger(__name__)
+
+# Seconds between prunes of the old jobs and transitions
+PRUNE_INTERVAL = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    file_id TEXT PRIMARY KEY,
+    file_unique_id TEXT,
+    file_name TEXT NOT NULL,
+    file_size INTEGER NOT NULL,
+    chat_id INTEGER,
+    message_id INTEGER,
+    file_path TEXT,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transitions (
+    file_id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+CREATE INDEX IF NOT EXISTS transitions_at ON transitions (at);
+CREATE TABLE IF NOT EXISTS hashes (
+    file_name TEXT PRIMARY KEY,
+    file_size INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    checked_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS media_info (
+    file_name TEXT PRIMARY KEY,
+    duration REAL,
+    width INTEGER,
+    height INTEGER,
+    video_codec TEXT,
+    audio_codec TEXT,
+    bitrate INTEGER,
+    updated_at REAL NOT NULL
+);
+"""
+
+# Columns added to the jobs table after its first release
+JOB_COLUMNS_ADDED = {
+    "mime_type": "TEXT",
+    "destination_dir": "TEXT",
+    "bot_api_instance": "TEXT",
+    "user_id": "INTEGER",
+    "duplicate_of": "TEXT",
+}
+
+
+class DownloadJournal:
+    """
+    On-disk journal of download jobs, stored in SQLite (WAL mode).
+
+    State changes are buffered in memory and written in batches by a background task,
+    so recording a transition never blocks the event loop on disk I/O.
+
+    The content hashes and media metadata of the downloaded files are kept in the
+    same database, and written the same way.
+
+    The connection is shared by the flush task and the readers, which all run in
+    worker threads, so each use of it holds a lock. Transitions older than
+    `retention` seconds are pruned, with the failed and cancelled jobs. Completed
+    jobs are kept while their file is among `kept_files`, since their
+    `file_unique_id` is what catches a repeat of the same content.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        flush_interval: float = 1.0,
+        retention: float = 30 * 86400,
+        kept_files: Callable[[], Iterable[str]] | None = None,
+    ):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self.kept_files = kept_files
+        self._connection: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._pending_jobs: dict[str, tuple] = {}
+        self._pending_transitions: list[tuple] = []
+        self._pending_hashes: dict[str, tuple | None] = {}  # None removes the hash
+        self._pending_media_info: dict[str, tuple] = {}
+        self._flush_task: asyncio.Task | None = None
+
+    def open(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._lock:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(SCHEMA)
+
+            columns = {
+                row[1] for row in self._connection.execute("PRAGMA table_info(jobs)")
+            }
+            for column, column_type in JOB_COLUMNS_ADDED.items():
+                if column not in columns:
+                    self._connection.execute(
+                        f"ALTER TABLE jobs ADD COLUMN {column} {column_type}"
+                    )
+        logger.info(f"Opened download journal at {self.path}")
+
+    async def start(self) -> None:
+        """Open the journal and start the background flush task."""
+        await asyncio.to_thread(self.open)
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        """Stop the flush task, write any pending changes and close the database."""
+        if self._flush_task:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        if self._connection:
+            await self.flush()
+            with self._lock:
+                self._connection.close()
+                self._connection = None
+
+    def record(self, file: DownloadFile, state: JobState) -> None:
+        """Buffer a state transition for the file. Written on the next flush."""
+        now = time.time()
+        self._pending_jobs[file.file_id] = (
+            file.file_id,
+            file.file_unique_id,
+            file.file_name,
+            file.file_size,
+            file.chat_id,
+            file.message_id,
+            file.file_path,
+            state,
+            now,
+            file.mime_type,
+            file.destination_dir,
+            file.bot_api_instance,
+            file.user_id,
+            file.duplicate_of,
+        )
+        self._pending_transitions.append((file.file_id, state, now))
+
+    def record_hash(self, file_name: str, file_size: int, digest: str) -> None:
+        """Buffer the content hash of a file in the download directory."""
+        self._pending_hashes[file_name] = (file_name, file_size, digest, time.time())
+
+    def remove_hash(self, file_name: str) -> None:
+        self._pending_hashes[file_name] = None
+
+    def record_media_info(self, file_name: str, info: MediaInfo) -> None:
+        """Buffer the media metadata of a file in the download directory."""
+        self._pending_media_info[file_name] = (
+            file_name,
+            info.duration,
+            info.width,
+            info.height,
+            info.video_codec,
+            info.audio_codec,
+            info.bitrate,
+            time.time(),
+        )
+
+    def unfinished(self) -> list[tuple[DownloadFile, JobState]]:
+        """Return the jobs that did not reach a final state, oldest first."""
+        rows = self._query(
+            "SELECT file_id, file_unique_id, file_name, file_size, chat_id, message_id,"
+            " file_path, state, mime_type, destination_dir, bot_api_instance, user_id"
+            " FROM jobs"
+            " WHERE state NOT IN (?, ?, ?)"
+            " ORDER BY updated_at",
+            (JobState.COMPLETE, JobState.FAILED, JobState.CANCELLED),
+        )
+
+        return [
+            (
+                DownloadFile(
+                    file_id,
+                    file_name,
+                    file_size,
+                    file_unique_id=file_unique_id,
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    file_path=file_path,
+                    mime_type=mime_type,
+                    destination_dir=destination_dir,
+                    bot_api_instance=bot_api_instance,
+                    user_id=user_id,
+                ),
+                JobState(state),
+            )
+            for (
+                file_id,
+                file_unique_id,
+                file_name,
+                file_size,
+                chat_id,
+                message_id,
+                file_path,
+                state,
+                mime_type,
+                destination_dir,
+                bot_api_instance,
+                user_id,
+            ) in rows
+        ]
+
+    def completed(self) -> list[tuple[str, str]]:
+        """
+        Return (file_unique_id, file_name) pairs of the completed downloads.
+
+        Downloads that weren't kept, as their content was already in the download
+        directory, give the name of that existing file.
+        """
+        return self._query(
+            "SELECT file_unique_id, COALESCE(duplicate_of, file_name) FROM jobs"
+            " WHERE state = ?",
+            (JobState.COMPLETE,),
+        )
+
+    def downloaded(self) -> list[tuple[str, str, int, float]]:
+        """
+        Return (file_unique_id, file_path, file_size, updated_at) of the downloads
+        left in the Bot API directory, by jobs that didn't complete.
+
+        Completed jobs moved their file away, and the Bot API server may have reused
+        the path since, so only the latest job of each path is returned.
+        """
+        return self._query(
+            "SELECT file_unique_id, file_path, file_size, MAX(updated_at) FROM jobs"
+            " WHERE file_path IS NOT NULL GROUP BY file_path"
+            " HAVING state != ? ORDER BY updated_at",
+            (JobState.COMPLETE,),
+        )
+
+    def hashes(self) -> list[tuple[str, int, str, float]]:
+        """Return (file_name, file_size, digest, checked_at), least recently checked first."""
+        return self._query(
+            "SELECT file_name, file_size, digest, checked_at FROM hashes"
+            " ORDER BY checked_at"
+        )
+
+    def prune(self, kept_files: Iterable[str] = ()) -> None:
+        """
+        Delete the transitions and finished jobs last updated before the retention.
+
+        Args:
+            kept_files (Iterable[str]): Names of the files still in the download
+                directories, whose completed jobs are kept.
+        """
+        cutoff = time.time() - self.retention
+        kept_files = set(kept_files)
+        with self._lock, self._connection:
+            completed = self._connection.execute(
+                "SELECT file_id, COALESCE(duplicate_of, file_name) FROM jobs"
+                " WHERE state = ? AND updated_at < ?",
+                (JobState.COMPLETE, cutoff),
+            ).fetchall()
+            jobs = self._connection.execute(
+                "DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?",
+                (JobState.FAILED, JobState.CANCELLED, cutoff),
+            ).rowcount
+            jobs += self._connection.executemany(
+                "DELETE FROM jobs WHERE file_id = ?",
+                [(file_id,) for file_id, name in completed if name not in kept_files],
+            ).rowcount
+            transitions = self._connection.execute(
+                "DELETE FROM transitions WHERE at < ?", (cutoff,)
+            ).rowcount
+        if jobs or transitions:
+            logger.info(
+                f"Pruned {jobs} jobs and {transitions} transitions from the journal"
+            )
+
+    def _query(self, sql: str, parameters: tuple = ()) -> list[tuple]:
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    async def flush(self) -> None:
+        """
+        Write the buffered changes to disk in a single transaction.
+
+        If the write fails, the changes stay buffered and are retried on the next
+        flush.
+        """
+        if (
+            not self._pending_jobs
+            and not self._pending_transitions
+            and not self._pending_hashes
+            and not self._pending_media_info
+        ):
+            return
+
+        # Swap the buffers on the event loop so new records go to fresh ones
+        jobs, self._pending_jobs = self._pending_jobs, {}
+        transitions, self._pending_transitions = self._pending_transitions, []
+        hashes, self._pending_hashes = self._pending_hashes, {}
+        media_info, self._pending_media_info = self._pending_media_info, {}
+        try:
+            await asyncio.to_thread(
+                self._write,
+                list(jobs.values()),
+                transitions,
+                hashes,
+                list(media_info.values()),
+            )
+        except sqlite3.Error:
+            # Put the batch back for the next flush, behind anything recorded since
+            for file_id, row in jobs.items():
+                self._pending_jobs.setdefault(file_id, row)
+            self._pending_transitions[:0] = transitions
+            for file_name, row in hashes.items():
+                self._pending_hashes.setdefault(file_name, row)
+            for file_name, row in media_info.items():
+                self._pending_media_info.setdefault(file_name, row)
+            raise
+
+    def _write(
+        self,
+        jobs: list[tuple],
+        transitions: list[tuple],
+        hashes: dict[str, tuple | None],
+        media_info: list[tuple],
+    ) -> None:
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO jobs (file_id, file_unique_id, file_name,"
+                " file_size, chat_id, message_id, file_path, state, updated_at,"
+                " mime_type, destination_dir, bot_api_instance, user_id, duplicate_of)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                jobs,
+            )
+            self._connection.executemany(
+                "INSERT INTO transitions VALUES (?, ?, ?)", transitions
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?)",
+                [row for row in hashes.values() if row is not None],
+            )
+            self._connection.executemany(
+                "DELETE FROM hashes WHERE file_name = ?",
+                [(name,) for name, row in hashes.items() if row is None],
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO media_info VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                media_info,
+            )
+
+    async def _flush_loop(self) -> None:
+        # Pruned on startup, once the file index has been built
+        last_pruned = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - last_pruned >= PRUNE_INTERVAL:
+                    last_pruned = time.monotonic()
+                    kept_files = list(self.kept_files()) if self.kept_files else []
+                    await asyncio.to_thread(self.prune, kept_files)
+            except sqlite3.Error as e:
+                logger.error(f"Error writing download journal: {e}")
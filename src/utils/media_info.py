@@ -0,0 +1,323 @@
+import asyncio
+import logging
+import mmap
+import multiprocessing
+import os
+import struct
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from ..models.media_info import MediaInfo
+
+logger = logging.getLogger(__name__)
+
+# Sample entry formats of MP4 tracks
+MP4_CODECS = {
+    b"avc1": "h264",
+    b"avc3": "h264",
+    b"hvc1": "hevc",
+    b"hev1": "hevc",
+    b"av01": "av1",
+    b"vp09": "vp9",
+    b"mp4v": "mpeg4",
+    b"mp4a": "aac",
+    b"ac-3": "ac3",
+    b"ec-3": "eac3",
+    b"Opus": "opus",
+    b"fLaC": "flac",
+}
+
+# Codec IDs of Matroska tracks
+MKV_CODECS = {
+    "V_MPEG4/ISO/AVC": "h264",
+    "V_MPEGH/ISO/HEVC": "hevc",
+    "V_AV1": "av1",
+    "V_VP8": "vp8",
+    "V_VP9": "vp9",
+    "A_AAC": "aac",
+    "A_AC3": "ac3",
+    "A_EAC3": "eac3",
+    "A_OPUS": "opus",
+    "A_VORBIS": "vorbis",
+    "A_FLAC": "flac",
+    "A_MPEG/L3": "mp3",
+}
+
+# EBML element IDs, with their length marker
+EBML_HEADER = 0x1A45DFA3
+SEGMENT = 0x18538067
+INFO = 0x1549A966
+TIMESTAMP_SCALE = 0x2AD7B1
+DURATION = 0x4489
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_TYPE = 0x83
+CODEC_ID = 0x86
+VIDEO = 0xE0
+PIXEL_WIDTH = 0xB0
+PIXEL_HEIGHT = 0xBA
+
+
+def probe(path: str) -> MediaInfo | None:
+    """
+    Read the metadata of an MP4 or Matroska (MKV/WebM) file.
+
+    The file is mapped into memory, so only the pages of the headers that are
+    parsed are read from disk, however large the file is.
+
+    Returns:
+        MediaInfo | None: The metadata, or None if the container isn't supported.
+    """
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if size < 16:
+            return None
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[4:8] == b"ftyp":
+                info = _probe_mp4(data)
+            elif struct.unpack_from(">I", data)[0] == EBML_HEADER:
+                info = _probe_mkv(data)
+            else:
+                return None
+
+    if info.duration:
+        info.bitrate = int(size * 8 / info.duration)
+    return info
+
+
+def _mp4_boxes(data: mmap.mmap, start: int, end: int) -> Iterator[tuple]:
+    """Yield (type, data start, data end) of the MP4 boxes in a range."""
+    offset = start
+    while offset + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset  # Extends to the end of the file
+        if size < header:
+            return
+        yield kind, offset + header, min(offset + size, end)
+        offset += size
+
+
+def _child(data: mmap.mmap, start: int, end: int, *path: bytes) -> tuple | None:
+    """Find the first box at a path of box types under a range."""
+    for kind, box_start, box_end in _mp4_boxes(data, start, end):
+        if kind == path[0]:
+            if len(path) == 1:
+                return box_start, box_end
+            return _child(data, box_start, box_end, *path[1:])
+    return None
+
+
+def _probe_mp4(data: mmap.mmap) -> MediaInfo:
+    info = MediaInfo()
+    moov = _child(data, 0, len(data), b"moov")
+    if moov is None:
+        return info
+
+    mvhd = _child(data, *moov, b"mvhd")
+    if mvhd:
+        if data[mvhd[0]] == 1:
+            timescale, duration = struct.unpack_from(">IQ", data, mvhd[0] + 20)
+        else:
+            timescale, duration = struct.unpack_from(">II", data, mvhd[0] + 12)
+        if timescale:
+            info.duration = duration / timescale
+
+    for kind, start, end in _mp4_boxes(data, *moov):
+        if kind != b"trak":
+            continue
+        hdlr = _child(data, start, end, b"mdia", b"hdlr")
+        stsd = _child(data, start, end, b"mdia", b"minf", b"stbl", b"stsd")
+        if not hdlr or not stsd:
+            continue
+
+        handler = data[hdlr[0] + 8 : hdlr[0] + 12]
+        entry = data[stsd[0] + 12 : stsd[0] + 16]
+        codec = MP4_CODECS.get(entry, entry.decode("latin-1").strip())
+        if handler == b"vide" and info.video_codec is None:
+            info.video_codec = codec
+            tkhd = _child(data, start, end, b"tkhd")
+            if tkhd:
+                # 16.16 fixed point, after the version specific fields and the matrix
+                offset = tkhd[0] + (88 if data[tkhd[0]] == 1 else 76)
+                width, height = struct.unpack_from(">II", data, offset)
+                info.width, info.height = width >> 16, height >> 16
+        elif handler == b"soun" and info.audio_codec is None:
+            info.audio_codec = codec
+    return info
+
+
+def _vint(data: mmap.mmap, offset: int, keep_marker: bool) -> tuple[int, int]:
+    """Read an EBML variable length integer, return its value and length."""
+    first = data[offset]
+    length, mask = 1, 0x80
+    while not first & mask:
+        length, mask = length + 1, mask >> 1
+        if length > 8:
+            raise ValueError(f"Invalid EBML integer at {offset}")
+    value = first if keep_marker else first & (mask - 1)
+    for byte in data[offset + 1 : offset + length]:
+        value = value << 8 | byte
+    return value, length
+
+
+def _ebml_elements(data: mmap.mmap, start: int, end: int) -> Iterator[tuple]:
+    """Yield (id, data start, data end) of the EBML elements in a range."""
+    offset = start
+    while offset < end:
+        element_id, id_length = _vint(data, offset, keep_marker=True)
+        size, size_length = _vint(data, offset + id_length, keep_marker=False)
+        data_start = offset + id_length + size_length
+        if size == (1 << 7 * size_length) - 1:
+            data_end = end  # Unknown size, extends to the end of its parent
+        else:
+            data_end = min(data_start + size, end)
+        yield element_id, data_start, data_end
+        offset = data_end
+
+
+def _probe_mkv(data: mmap.mmap) -> MediaInfo:
+    info = MediaInfo()
+    for element_id, start, end in _ebml_elements(data, 0, len(data)):
+        if element_id == SEGMENT:
+            segment = (start, end)
+            break
+    else:
+        return info
+
+    found_info = found_tracks = False
+    for element_id, start, end in _ebml_elements(data, *segment):
+        if element_id == INFO:
+            _parse_mkv_info(data, start, end, info)
+            found_info = True
+        elif element_id == TRACKS:
+            _parse_mkv_tracks(data, start, end, info)
+            found_tracks = True
+        # Stop before jumping over the clusters of the rest of the file
+        if found_info and found_tracks:
+            break
+    return info
+
+
+def _parse_mkv_info(data: mmap.mmap, start: int, end: int, info: MediaInfo) -> None:
+    scale, duration = 1_000_000, None  # Nanoseconds per tick
+    for element_id, value_start, value_end in _ebml_elements(data, start, end):
+        if element_id == TIMESTAMP_SCALE:
+            scale = int.from_bytes(data[value_start:value_end], "big")
+        elif element_id == DURATION:
+            fmt = ">f" if value_end - value_start == 4 else ">d"
+            duration = struct.unpack_from(fmt, data, value_start)[0]
+    if duration:
+        info.duration = duration * scale / 1e9
+
+
+def _parse_mkv_tracks(data: mmap.mmap, start: int, end: int, info: MediaInfo) -> None:
+    for element_id, entry_start, entry_end in _ebml_elements(data, start, end):
+        if element_id != TRACK_ENTRY:
+            continue
+
+        track_type, codec, width, height = None, None, None, None
+        for child_id, value_start, value_end in _ebml_elements(
+            data, entry_start, entry_end
+        ):
+            value = data[value_start:value_end]
+            if child_id == TRACK_TYPE:
+                track_type = int.from_bytes(value, "big")
+            elif child_id == CODEC_ID:
+                codec_id = value.rstrip(b"\0").decode("ascii", "replace")
+                codec = MKV_CODECS.get(codec_id, codec_id.split("_", 1)[-1].lower())
+            elif child_id == VIDEO:
+                for video_id, video_start, video_end in _ebml_elements(
+                    data, value_start, value_end
+                ):
+                    number = int.from_bytes(data[video_start:video_end], "big")
+                    if video_id == PIXEL_WIDTH:
+                        width = number
+                    elif video_id == PIXEL_HEIGHT:
+                        height = number
+
+        if track_type == 1 and info.video_codec is None:
+            info.video_codec, info.width, info.height = codec, width, height
+        elif track_type == 2 and info.audio_codec is None:
+            info.audio_codec = codec
+
+
+class MediaInfoExtractor:
+    """
+    Reads the metadata of downloaded files in a pool of worker processes.
+
+    Parsing never runs on the event loop or its threads. Files wait in a queue of
+    `queue_size` for one of the `workers` processes, and callers wait for room in the
+    queue, so a large batch doesn't start more work than the pool can take.
+    """
+
+    def __init__(self, workers: int = 2, queue_size: int = 16, timeout: float = 60):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._executor: ProcessPoolExecutor | None = None
+        self._queue: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._queue = asyncio.Queue(self.queue_size)
+        self._executor = self._new_executor()
+        # Start the processes now rather than when the first download is moved
+        for _ in range(self.workers):
+            self._executor.submit(os.getpid)
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"media-info-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+        # Release the callers still waiting in the queue
+        while self._queue and not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_result(None)
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def extract(self, path: str) -> MediaInfo | None:
+        """Read the metadata of a file, or None if it couldn't be read."""
+        if not self._tasks:
+            return None
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((path, future))
+        return await future
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        # Forking would copy the locks held by the bot's other threads
+        return ProcessPoolExecutor(
+            self.workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            path, future = await self._queue.get()
+            info = None
+            try:
+                info = await asyncio.wait_for(
+                    loop.run_in_executor(self._executor, probe, path), self.timeout
+                )
+            except BrokenProcessPool as e:
+                logger.error(f"Media info worker died, restarting the pool: {e}")
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor()
+            except Exception as e:
+                logger.warning(f"Couldn't read the media info of {path}: {e}")
+            if not future.done():
+                future.set_result(info)
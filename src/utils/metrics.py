@@ -0,0 +1,396 @@
+import asyncio
+import bisect
+import logging
+import math
+import sys
+import threading
+import time
+import traceback
+from collections.abc import Callable
+
+from telegram.error import TimedOut
+from telegram.request import BaseRequest, HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+SPEED_BUCKETS = (1e5, 5e5, 1e6, 5e6, 1e7, 2.5e7, 5e7, 1e8, 2.5e8, 5e8, 1e9)
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        registry.append(self)
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.samples(),
+        ]
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+            for labels, value in self._values.items()
+        ]
+
+
+class Gauge(Metric):
+    """Gauge whose value is read from a function at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.function = function
+
+    def samples(self) -> list[str]:
+        return [f"{self.name} {_format_value(self.function())}"]
+
+
+class LabeledGauge(Metric):
+    """Gauge with one sample per label value, read from a function at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label: str,
+        function: Callable[[], dict[str, float]],
+    ):
+        super().__init__(name, documentation)
+        self.label = label
+        self.function = function
+
+    def samples(self) -> list[str]:
+        return [
+            f'{self.name}{{{self.label}="{key}"}} {_format_value(value)}'
+            for key, value in self.function().items()
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: tuple[float, ...]):
+        super().__init__(name, documentation)
+        self.buckets = (*buckets, math.inf)
+        self._counts: dict[Labels, list[int]] = {}
+        self._sums: dict[Labels, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        counts = self._counts.setdefault(key, [0] * len(self.buckets))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] = self._sums.get(key, 0) + value
+
+    def samples(self) -> list[str]:
+        lines = []
+        for labels, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(labels, le)} {cumulative}"
+                )
+            lines.append(
+                f"{self.name}_sum{_format_labels(labels)} "
+                f"{_format_value(self._sums[labels])}"
+            )
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+registry: list[Metric] = []
+
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in registry for line in metric.render()) + "\n"
+
+
+# Download metrics
+download_seconds = Histogram(
+    "downloader_download_duration_seconds",
+    "Time taken to download a file from Telegram.",
+    DURATION_BUCKETS,
+)
+move_seconds = Histogram(
+    "downloader_move_duration_seconds",
+    "Time taken to move a file to the download directory.",
+    DURATION_BUCKETS,
+)
+total_seconds = Histogram(
+    "downloader_total_duration_seconds",
+    "Time taken to download and move a file.",
+    DURATION_BUCKETS,
+)
+phase_bytes_per_second = Histogram(
+    "downloader_phase_bytes_per_second",
+    "Throughput of each phase of a download.",
+    SPEED_BUCKETS,
+)
+jobs_total = Counter("downloader_jobs_total", "Download jobs finished, by outcome.")
+retries_total = Counter(
+    "downloader_retries_total", "Download retries, by outcome of the job."
+)
+bot_api_latency_seconds = Histogram(
+    "downloader_bot_api_request_duration_seconds",
+    "Latency of Bot API requests, by method.",
+    LATENCY_BUCKETS,
+)
+pool_wait_seconds = Histogram(
+    "downloader_bot_api_pool_wait_seconds",
+    "Time Bot API requests waited for a free connection, by pool.",
+    LAG_BUCKETS,
+)
+event_loop_lag_seconds = Histogram(
+    "downloader_event_loop_lag_seconds",
+    "Delay of the event loop in running a scheduled callback.",
+    LAG_BUCKETS,
+)
+event_loop_blocked_total = Counter(
+    "downloader_event_loop_blocked_total",
+    "Times the event loop was blocked for longer than the lag threshold.",
+)
+fs_timeouts_total = Counter(
+    "downloader_fs_timeouts_total",
+    "Filesystem calls that timed out, by operation.",
+)
+io_throttled_seconds_total = Counter(
+    "downloader_io_throttled_seconds_total",
+    "Time moves and downloads waited for the I/O rate limits, by limit.",
+)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """
+    HTTPXRequest that records the latency of each Bot API method and the usage of
+    its connection pool.
+
+    Requests wait for a free connection here instead of inside httpx, so the number
+    of busy connections and the time spent waiting for one can be measured.
+    """
+
+    def __init__(self, pool: str = "default", connection_pool_size: int = 1, **kwargs):
+        super().__init__(connection_pool_size=connection_pool_size, **kwargs)
+        self.pool = pool
+        self.size = connection_pool_size
+        self.in_use = 0
+        self.waiting = 0
+        self._connections = asyncio.Semaphore(connection_pool_size)
+        request_pools.append(self)
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        *args,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+        **kwargs,
+    ):
+        if pool_timeout is BaseRequest.DEFAULT_NONE:
+            pool_timeout = self._client.timeout.pool
+
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._connections.acquire(), pool_timeout)
+        except TimeoutError as e:
+            raise TimedOut(
+                f"Pool timeout: all connections of the {self.pool} pool are occupied"
+            ) from e
+        finally:
+            self.waiting -= 1
+            pool_wait_seconds.observe(time.monotonic() - start, pool=self.pool)
+
+        self.in_use += 1
+        start = time.monotonic()
+        try:
+            return await super().do_request(
+                url, method, *args, pool_timeout=pool_timeout, **kwargs
+            )
+        finally:
+            self.in_use -= 1
+            self._connections.release()
+            bot_api_latency_seconds.observe(
+                time.monotonic() - start, method=url.rsplit("/", 1)[-1]
+            )
+
+
+request_pools: list[InstrumentedRequest] = []
+
+LabeledGauge(
+    "downloader_bot_api_pool_connections",
+    "Size of each Bot API connection pool.",
+    "pool",
+    lambda: {request.pool: request.size for request in request_pools},
+)
+LabeledGauge(
+    "downloader_bot_api_pool_in_use",
+    "Connections of each Bot API connection pool in use.",
+    "pool",
+    lambda: {request.pool: request.in_use for request in request_pools},
+)
+LabeledGauge(
+    "downloader_bot_api_pool_waiting",
+    "Bot API requests waiting for a free connection, by pool.",
+    "pool",
+    lambda: {request.pool: request.waiting for request in request_pools},
+)
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up a sleeping task.
+
+    Lags over `threshold` seconds are logged and counted. By the time the loop
+    notices a lag, the call that blocked it has returned, so with `capture_stacks` a
+    watchdog thread also logs the stack of the loop thread while it is still blocked.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.5,
+        threshold: float = 0.0,
+        capture_stacks: bool = False,
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        self.capture_stacks = capture_stacks
+        self.last_lag = 0.0
+        self._task: asyncio.Task | None = None
+        self._slept_at = 0.0
+        self._loop_thread_id: int | None = None
+        self._watchdog: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        self._slept_at = time.monotonic()
+        self._task = asyncio.create_task(self._loop(), name="loop-lag-monitor")
+        if self.threshold > 0 and self.capture_stacks:
+            self._loop_thread_id = threading.get_ident()
+            self._stopped.clear()
+            self._watchdog = threading.Thread(
+                target=self._watch, name="loop-lag-watchdog", daemon=True
+            )
+            self._watchdog.start()
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._watchdog:
+            self._stopped.set()
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    async def _loop(self) -> None:
+        while True:
+            start = self._slept_at = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, time.monotonic() - start - self.interval)
+            event_loop_lag_seconds.observe(self.last_lag)
+            if self.threshold > 0 and self.last_lag > self.threshold:
+                event_loop_blocked_total.inc()
+                logger.warning(f"Event loop was blocked for {self.last_lag:.3f}s")
+
+    def _watch(self) -> None:
+        reported = None
+        while not self._stopped.wait(self.threshold / 2):
+            slept_at = self._slept_at
+            lag = time.monotonic() - slept_at - self.interval
+            # Once per blocked wake-up
+            if lag <= self.threshold or slept_at == reported:
+                continue
+            reported = slept_at
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                stack = "".join(traceback.format_stack(frame))
+                logger.warning(
+                    f"Event loop blocked for {lag:.3f}s so far, in:\n{stack}"
+                )
+
+
+class MetricsServer:
+    """Minimal HTTP server exposing the metrics in the Prometheus text format."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._server: asyncio.Server | None = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            # Skip the headers
+            while (await asyncio.wait_for(reader.readline(), 10)).strip():
+                pass
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1] == "/metrics":
+                status, body = "200 OK", render_metrics().encode()
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (OSError, TimeoutError) as e:
+            logger.debug(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
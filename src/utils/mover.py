@@ -0,0 +1,418 @@
+import errno
+import functools
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from collections.abc import Callable
+from enum import StrEnum
+from typing import Any
+
+from ..models import DownloadFile
+
+logger = logging.getLogger(__name__)
+
+# ioctl request to clone a file's extents (reflink) on btrfs, XFS, bcachefs...
+FICLONE = 0x40049409
+
+# Size of the reads of a copy through userspace, e.g. to hash the data on the way
+HASHED_COPY_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Errors meaning a copy method isn't supported for this pair of files
+UNSUPPORTED_ERRNOS = {
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EBADF,
+    errno.EPERM,
+}
+
+
+class MoveCancelled(Exception):
+    """The move was stopped before it completed, and its partial copy removed."""
+
+
+class FsyncPolicy(StrEnum):
+    NONE = "none"  # Leave flushing to the OS
+    FILE = "file"  # Flush the file data before it is renamed into place
+    FULL = "full"  # Also flush the destination directory after the rename
+
+
+def cross_device_move(
+    src: str,
+    dst: str,
+    file: DownloadFile | None = None,
+    fsync_policy: FsyncPolicy = FsyncPolicy.FILE,
+    chunk_size: int = 64 * 1024 * 1024,
+    hasher: Any = None,
+    throttle: Callable[[int], None] | None = None,
+    stop_event: threading.Event | None = None,
+) -> str:
+    """
+    Move a file to another filesystem without copying through userspace buffers.
+
+    The data is written to a temporary file next to the destination, which is renamed
+    into place once the copy is complete, so a partial file is never visible under the
+    final name. The copy tries, in order: a reflink, `copy_file_range`, `sendfile`,
+    and a plain buffered copy.
+
+    When a hasher is given, the data is copied through userspace instead and hashed
+    on the way, so the file doesn't have to be read again to hash it.
+
+    Args:
+        src (str): The path of the file to move.
+        dst (str): The destination path.
+        file (DownloadFile | None): The download to report the copy progress to.
+        fsync_policy (FsyncPolicy): How much of the result to flush to disk.
+        chunk_size (int): The number of bytes copied per system call.
+        hasher (hashlib hash | None): Updated with the contents of the file.
+        throttle (Callable[[int], None] | None): Called with the size of each chunk
+            copied, blocks while the copy is over its rate limit.
+        stop_event (threading.Event | None): Stops the copy at the next chunk once set.
+
+    Returns:
+        str: The copy strategy that was used.
+
+    Raises:
+        MoveCancelled: If `stop_event` was set before the copy completed. The source
+            is left in place.
+    """
+    tmp_path = os.path.join(
+        os.path.dirname(dst) or ".", f".{os.path.basename(dst)}.part"
+    )
+
+    try:
+        with open(src, "rb") as src_file, open(tmp_path, "wb") as dst_file:
+            src_fd, dst_fd = src_file.fileno(), dst_file.fileno()
+            size = os.fstat(src_fd).st_size
+
+            strategy = _copy(
+                src_fd, dst_fd, size, file, chunk_size, hasher, throttle, stop_event
+            )
+
+            if fsync_policy != FsyncPolicy.NONE:
+                os.fsync(dst_fd)
+
+        shutil.copystat(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    if fsync_policy == FsyncPolicy.FULL:
+        _fsync_dir(os.path.dirname(dst) or ".")
+
+    os.remove(src)
+    logger.info(f"Moved {src} to {dst} using {strategy}")
+    return strategy
+
+
+def _copy(
+    src_fd: int,
+    dst_fd: int,
+    size: int,
+    file: DownloadFile | None,
+    chunk_size: int,
+    hasher: Any = None,
+    throttle: Callable[[int], None] | None = None,
+    stop_event: threading.Event | None = None,
+) -> str:
+    def progress(copied: int) -> None:
+        if file is not None:
+            file.bytes_moved = copied
+
+    _check_stopped(stop_event)
+
+    # Reflink: the destination shares the source's extents, no data is copied
+    if hasher is None:
+        try:
+            import fcntl
+
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+            progress(size)
+            return "reflink"
+        except (ImportError, OSError):
+            pass
+
+    # Reserve the space up front to avoid fragmentation and fail early if it's full
+    if hasattr(os, "posix_fallocate") and size:
+        try:
+            os.posix_fallocate(dst_fd, 0, size)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                raise
+            logger.debug(f"posix_fallocate not supported: {e}")
+
+    copied = 0
+    if hasher is not None:
+        buffer = bytearray(min(chunk_size, HASHED_COPY_BUFFER_SIZE))
+        strategies = [
+            ("hashed copy", functools.partial(_hashed_copy, hasher, buffer)),
+        ]
+    else:
+        strategies = [
+            ("copy_file_range", getattr(os, "copy_file_range", None)),
+            ("sendfile", _sendfile if hasattr(os, "sendfile") else None),
+            ("buffered copy", _buffered_copy),
+        ]
+    for strategy, copy_chunk in strategies:
+        if copy_chunk is None:
+            continue
+        try:
+            while copied < size:
+                _check_stopped(stop_event)
+                written = copy_chunk(src_fd, dst_fd, min(chunk_size, size - copied))
+                if written == 0:
+                    break
+                copied += written
+                progress(copied)
+                if throttle is not None:
+                    throttle(written)
+        except OSError as e:
+            # Only fall back if nothing was copied with this method yet
+            if e.errno not in UNSUPPORTED_ERRNOS or copied:
+                raise
+            logger.debug(f"{strategy} not supported: {e}")
+            continue
+
+        # Drop any space preallocated past the end if the source was shorter
+        os.ftruncate(dst_fd, copied)
+        return strategy
+
+    raise OSError("No copy method available")
+
+
+def _check_stopped(stop_event: threading.Event | None) -> None:
+    if stop_event is not None and stop_event.is_set():
+        raise MoveCancelled("The move was cancelled")
+
+
+def _sendfile(src_fd: int, dst_fd: int, count: int) -> int:
+    return os.sendfile(dst_fd, src_fd, None, count)
+
+
+def _buffered_copy(src_fd: int, dst_fd: int, count: int) -> int:
+    data = os.read(src_fd, min(count, 1024 * 1024))
+    view = memoryview(data)
+    while view:
+        view = view[os.write(dst_fd, view) :]
+    return len(data)
+
+
+def _hashed_copy(
+    hasher: Any, buffer: bytearray, src_fd: int, dst_fd: int, count: int
+) -> int:
+    view = memoryview(buffer)[:count]
+    if hasattr(os, "readv"):
+        read = os.readv(src_fd, [view])
+    else:
+        data = os.read(src_fd, count)
+        read = len(data)
+        view[:read] = data
+
+    view = view[:read]
+    hasher.update(view)
+    while view:
+        view = view[os.write(dst_fd, view) :]
+    return read
+
+
+def _fsync_dir(path: str) -> None:
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return  # Directories can't be opened on Windows
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class TailCopyError(Exception):
+    """The followed file can't be used to finish the move."""
+
+
+class TailCopier:
+    """
+    Copies a download to another filesystem while it is still being written.
+
+    `follow` runs in a thread for the duration of the download: once the partial file
+    has been matched to the download (`file.partial_path`), it copies the data that
+    has arrived to a temporary file next to the destination, staying `lag` bytes
+    behind the end of the written data (or the first hole in it) in case the region
+    at the end is still being written. `finish` then checks that the completed file
+    is the one that was followed, copies the rest of it and renames the temporary
+    file into place, like `cross_device_move`.
+
+    Only data before the first hole is copied while following, so the copy is
+    sequential and can be hashed on the way. Holes aren't reported on every
+    filesystem (NFS, FUSE) and a preallocated file has none, so the data copied
+    while following may have been overwritten since. `finish` reads it again from
+    the completed file and compares its hash before the copy is kept.
+    """
+
+    def __init__(
+        self,
+        file: DownloadFile,
+        dst: str,
+        fsync_policy: FsyncPolicy = FsyncPolicy.FILE,
+        hasher: Any = None,
+        poll_interval: float = 0.5,
+        lag: int = 1024 * 1024,
+        throttle: Callable[[int], None] | None = None,
+        stop_event: threading.Event | None = None,
+    ):
+        self.file = file
+        self.dst = dst
+        self.fsync_policy = fsync_policy
+        self.hasher = hasher
+        self.throttle = throttle
+        self.stop_event = stop_event
+        self.poll_interval = poll_interval
+        self.lag = lag
+        self.tmp_path = os.path.join(
+            os.path.dirname(dst) or ".", f".{os.path.basename(dst)}.part"
+        )
+        self.copied = 0
+        self._copied_hash = hashlib.blake2b(digest_size=16)  # Of the copied data
+        self._done = threading.Event()
+        self._src_fd: int | None = None
+        self._src_id: tuple[int, int] | None = None
+        self._dst_fd: int | None = None
+
+    def follow(self) -> None:
+        """Copy the partial file as it grows, until `stop` is called."""
+        try:
+            while not self._done.wait(self.poll_interval):
+                if self._src_fd is None and not self._open(self.file.partial_path):
+                    continue
+                self._copy_range(self._readable_end())
+        except OSError as e:
+            # The move falls back to a regular copy
+            logger.warning(f"Stopped following {self.file.partial_path}: {e}")
+            self._src_id = None
+        finally:
+            self._close()
+        self.file.bytes_overlapped = self.copied
+
+    def stop(self) -> None:
+        """Stop following, the download is over."""
+        self._done.set()
+
+    def finish(self, src: str) -> str:
+        """
+        Copy the rest of the completed download and rename the copy into place.
+
+        Raises:
+            TailCopyError: If the followed file isn't `src`, was never found, or
+                changed after it was copied.
+            MoveCancelled: If `stop_event` was set before the copy completed.
+        """
+        try:
+            if self._src_id is None:
+                raise TailCopyError("The partial file was never found")
+            stat = os.stat(src)
+            if (stat.st_dev, stat.st_ino) != self._src_id:
+                raise TailCopyError(f"Followed another file than {src}")
+
+            self._src_fd = os.open(src, os.O_RDONLY)
+            self._verify_copied()
+            self._dst_fd = os.open(self.tmp_path, os.O_WRONLY)
+            self._copy_range(stat.st_size)
+            os.ftruncate(self._dst_fd, stat.st_size)
+            if self.fsync_policy != FsyncPolicy.NONE:
+                os.fsync(self._dst_fd)
+            self._close()
+
+            shutil.copystat(src, self.tmp_path)
+            os.replace(self.tmp_path, self.dst)
+        except BaseException:
+            self.abort()
+            raise
+
+        if self.fsync_policy == FsyncPolicy.FULL:
+            _fsync_dir(os.path.dirname(self.dst) or ".")
+
+        os.remove(src)
+        logger.info(
+            f"Moved {src} to {self.dst} using a tail-follow copy, "
+            f"{self.file.bytes_overlapped} bytes copied during the download"
+        )
+        return "tail-follow copy"
+
+    def abort(self) -> None:
+        """Close the files and remove the partial copy."""
+        self._done.set()
+        self._close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def _open(self, path: str | None) -> bool:
+        if path is None:
+            return False
+        try:
+            self._src_fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        stat = os.fstat(self._src_fd)
+        self._src_id = (stat.st_dev, stat.st_ino)
+        self._dst_fd = os.open(
+            self.tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644
+        )
+        logger.debug(f"Following {path} to {self.tmp_path}")
+        return True
+
+    def _readable_end(self) -> int:
+        """Offset up to which the partial file can be copied while it is written."""
+        size = os.fstat(self._src_fd).st_size
+        try:
+            end = min(os.lseek(self._src_fd, self.copied, os.SEEK_HOLE), size)
+        except (AttributeError, OSError):
+            end = size  # No hole detection, or nothing past the copied data
+        return max(self.copied, end - self.lag)
+
+    def _verify_copied(self) -> None:
+        """Check that the data copied while following is still the source's."""
+        source_hash = hashlib.blake2b(digest_size=16)
+        offset = 0
+        while offset < self.copied:
+            _check_stopped(self.stop_event)
+            count = min(HASHED_COPY_BUFFER_SIZE, self.copied - offset)
+            data = os.pread(self._src_fd, count, offset)
+            if not data:
+                break
+            source_hash.update(data)
+            offset += len(data)
+        if source_hash.digest() != self._copied_hash.digest():
+            raise TailCopyError("The data copied during the download has changed")
+
+    def _copy_range(self, end: int) -> None:
+        while self.copied < end:
+            _check_stopped(self.stop_event)
+            count = min(HASHED_COPY_BUFFER_SIZE, end - self.copied)
+            data = os.pread(self._src_fd, count, self.copied)
+            if not data:
+                break
+            if self.hasher is not None:
+                self.hasher.update(data)
+            self._copied_hash.update(data)
+            view = memoryview(data)
+            offset = self.copied
+            while view:
+                written = os.pwrite(self._dst_fd, view, offset)
+                view = view[written:]
+                offset += written
+            self.copied += len(data)
+            self.file.bytes_moved = self.copied
+            if self.throttle is not None:
+                self.throttle(len(data))
+
+    def _close(self) -> None:
+        for fd in (self._src_fd, self._dst_fd):
+            if fd is not None:
+                os.close(fd)
+        self._src_fd = self._dst_fd = None
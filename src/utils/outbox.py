@@ -0,0 +1,197 @@
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any
+
+from telegram import Bot, Message
+from telegram.error import RetryAfter
+
+from .env import env
+from .token_bucket import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Telegram's message length limit
+MESSAGE_LIMIT = 4096
+
+# Consecutive messages shorter than this are merged into one
+MERGE_MAX_LENGTH = 1024
+
+
+@dataclass
+class OutboundMessage:
+    chat_id: int | str
+    text: str
+    kwargs: dict[str, Any] = field(default_factory=dict)
+    message_id: int | None = None  # Set for edits of an existing message
+    futures: list[asyncio.Future] = field(default_factory=list)
+
+    @property
+    def mergeable(self) -> bool:
+        """Plain messages without a keyboard or reply can be merged together."""
+        return (
+            self.message_id is None
+            and len(self.text) < MERGE_MAX_LENGTH
+            and set(self.kwargs) <= {"parse_mode"}
+        )
+
+    def can_merge(self, other: "OutboundMessage") -> bool:
+        return (
+            self.mergeable
+            and other.mergeable
+            and self.kwargs == other.kwargs
+            and len(self.text) + len(other.text) + 2 <= MESSAGE_LIMIT
+        )
+
+
+class MessageDispatcher:
+    """
+    Central queue for outbound Telegram messages.
+
+    Messages are queued per chat and sent by a background task, so handlers don't
+    block on flood limits. Each chat is limited by its own token bucket, on top of a
+    global one. Consecutive small messages to the same chat are merged, and only the
+    latest pending edit of a message is sent.
+    """
+
+    def __init__(self, chat_rate: float, global_rate: float, chat_burst: int = 3):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global_bucket = TokenBucket(global_rate)
+        self._chat_buckets: dict[int | str, TokenBucket] = {}
+        self._queues: dict[int | str, deque[OutboundMessage]] = {}
+        self._edits: dict[tuple[int | str, int], OutboundMessage] = {}
+        self._tasks: dict[int | str, asyncio.Task] = {}
+        self._bot: Bot | None = None
+
+    def start(self, bot: Bot) -> None:
+        self._bot = bot
+
+    async def stop(self) -> None:
+        """Wait for the queued messages to be sent."""
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def send_message(
+        self, chat_id: int | str, text: str, **kwargs
+    ) -> "asyncio.Future[Message]":
+        """Queue a message to be sent. Returns a future for the sent message."""
+        return self._enqueue(OutboundMessage(_chat_key(chat_id), text, kwargs))
+
+    def edit_message_text(
+        self, chat_id: int | str, message_id: int, text: str, **kwargs
+    ) -> "asyncio.Future[Message]":
+        """Queue an edit of a message, replacing any pending edit of the same message."""
+        chat_id = _chat_key(chat_id)
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+
+        pending = self._edits.get((chat_id, message_id))
+        if pending is not None:
+            pending.text = text
+            pending.kwargs = kwargs
+            pending.futures.append(future)
+            return future
+
+        message = OutboundMessage(chat_id, text, kwargs, message_id, [future])
+        self._edits[(chat_id, message_id)] = message
+        self._enqueue(message, future)
+        return future
+
+    def _enqueue(
+        self, message: OutboundMessage, future: asyncio.Future | None = None
+    ) -> asyncio.Future:
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            future.add_done_callback(_consume_exception)
+            message.futures.append(future)
+
+        queue = self._queues.setdefault(message.chat_id, deque())
+        queue.append(message)
+
+        if message.chat_id not in self._tasks:
+            self._tasks[message.chat_id] = asyncio.create_task(
+                self._drain(message.chat_id)
+            )
+        return future
+
+    async def _drain(self, chat_id: int | str) -> None:
+        queue = self._queues[chat_id]
+        bucket = self._chat_buckets.setdefault(
+            chat_id, TokenBucket(self.chat_rate, self.chat_burst)
+        )
+
+        try:
+            while queue:
+                await bucket.acquire()
+                await self._global_bucket.acquire()
+
+                message = queue.popleft()
+                if message.message_id is not None:
+                    self._edits.pop((chat_id, message.message_id), None)
+
+                # Merge the following small messages into this one
+                while queue and message.can_merge(queue[0]):
+                    following = queue.popleft()
+                    message.text += "\n\n" + following.text
+                    message.futures += following.futures
+
+                await self._send(message)
+        finally:
+            del self._tasks[chat_id]
+            if not queue:
+                self._queues.pop(chat_id, None)
+
+    async def _send(self, message: OutboundMessage) -> None:
+        while True:
+            try:
+                if message.message_id is None:
+                    result = await self._bot.send_message(
+                        chat_id=message.chat_id, text=message.text, **message.kwargs
+                    )
+                else:
+                    result = await self._bot.edit_message_text(
+                        chat_id=message.chat_id,
+                        message_id=message.message_id,
+                        text=message.text,
+                        **message.kwargs,
+                    )
+            except RetryAfter as e:
+                logger.warning(f"Flood limit hit, retrying in {e.retry_after}")
+                await asyncio.sleep(
+                    e.retry_after.total_seconds()
+                    if hasattr(e.retry_after, "total_seconds")
+                    else e.retry_after
+                )
+                continue
+            except Exception as e:
+                logger.error(f"Error sending message to {message.chat_id}: {e}")
+                for future in message.futures:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+            for future in message.futures:
+                if not future.done():
+                    future.set_result(result)
+            return
+
+
+def _consume_exception(future: asyncio.Future) -> None:
+    # Errors are logged by the dispatcher, callers don't have to await the future
+    if not future.cancelled():
+        future.exception()
+
+
+def _chat_key(chat_id: int | str) -> int | str:
+    """Numeric chat IDs given as strings, e.g. from the env, queue with the ints."""
+    if isinstance(chat_id, str) and chat_id.lstrip("-").isdigit():
+        return int(chat_id)
+    return chat_id
+
+
+# Shared dispatcher, started in the application's post_init
+message_dispatcher = MessageDispatcher(
+    chat_rate=env.MESSAGES_PER_SECOND_PER_CHAT,
+    global_rate=env.MESSAGES_PER_SECOND,
+)
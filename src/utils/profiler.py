@@ -0,0 +1,91 @@
+import asyncio
+import cProfile
+import os
+import pstats
+from dataclasses import dataclass
+
+
+class ProfilerBusy(Exception):
+    """A profile is already being taken."""
+
+
+@dataclass
+class HotFunction:
+    name: str  # file:line(function)
+    calls: int
+    own_seconds: float  # Time spent in the function itself
+    total_seconds: float  # Including the functions it called
+
+
+class Profiler:
+    """
+    Runs `cProfile` for a fixed window on demand and reports the hot functions.
+
+    The profiler only sees the thread that enabled it, here the event loop: the
+    callbacks, coroutines and handlers run by the loop. Work done in worker threads
+    (moves, hashing) or processes (media metadata) shows up as the time the loop
+    spent waiting on it, if at all. Profiling adds overhead to every call on the
+    loop while it runs, so it is off the rest of the time.
+    """
+
+    def __init__(self, max_seconds: float = 300.0):
+        self.max_seconds = max_seconds
+        self._running = False
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    async def run(
+        self, seconds: float, limit: int = 15, sort: str = "tottime"
+    ) -> list[HotFunction]:
+        """
+        Profile the event loop for `seconds` (capped at `max_seconds`).
+
+        Returns:
+            list[HotFunction]: The `limit` functions with the most time, by `sort`
+                (`tottime` or `cumulative`).
+
+        Raises:
+            ProfilerBusy: If a profile is already being taken.
+        """
+        if self._running:
+            raise ProfilerBusy("A profile is already being taken.")
+        self._running = True
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            try:
+                await asyncio.sleep(min(seconds, self.max_seconds))
+            finally:
+                profile.disable()
+        finally:
+            self._running = False
+
+        # Sorting the stats of a busy window can take a while
+        return await asyncio.to_thread(self._hot_functions, profile, limit, sort)
+
+    @staticmethod
+    def _hot_functions(
+        profile: cProfile.Profile, limit: int, sort: str
+    ) -> list[HotFunction]:
+        stats = pstats.Stats(profile)
+        functions = [
+            HotFunction(
+                # Built-in functions have no file
+                name if file == "~" else f"{os.path.basename(file)}:{line}({name})",
+                calls,
+                own_seconds,
+                total_seconds,
+            )
+            for (file, line, name), (
+                _,
+                calls,
+                own_seconds,
+                total_seconds,
+                _,
+            ) in stats.stats.items()
+        ]
+        key = "total_seconds" if sort == "cumulative" else "own_seconds"
+        functions.sort(key=lambda f: getattr(f, key), reverse=True)
+        return functions[:limit]
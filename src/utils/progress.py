@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+
+from ..models import DownloadFile, downloading_files
+
+logger = logging.getLogger(__name__)
+
+# Partial files modified this long before a download started can't belong to it
+MATCH_SLACK_SECONDS = 5
+
+
+@dataclass
+class PartialFile:
+    path: str
+    size: int
+    mtime: float
+    first_seen: float
+
+
+class ProgressSampler:
+    """
+    Single periodic task that samples the progress of every in-flight download.
+
+    The local Bot API server writes files into its temp directory while they are
+    downloaded, moves them to its documents directory when they are complete, and
+    only then reports the path. The sampler scans the directories of the servers once
+    per interval and assigns each running download to a partial file that appeared
+    after it started, is no larger than its size, and belongs to the server it is
+    fetched from, if known. When several downloads run at once, files are matched in
+    the order they appeared.
+    """
+
+    def __init__(self, directories: list[str], interval: float = 2.0):
+        self.directories = directories
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+        self._first_seen: dict[str, float] = {}
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._loop(), name="progress-sampler")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            downloads = [
+                file
+                for file in downloading_files.values()
+                if file.status == "Downloading" and not file.reports_progress
+            ]
+            if not downloads:
+                self._first_seen.clear()
+                continue
+
+            try:
+                partial_files = await asyncio.to_thread(self._scan)
+            except OSError as e:
+                logger.warning(f"Error scanning {', '.join(self.directories)}: {e}")
+                continue
+
+            self._update(downloads, partial_files)
+
+    def _scan(self) -> dict[str, PartialFile]:
+        now = time.monotonic()
+        partial_files = {}
+        for directory in self.directories:
+            if not os.path.isdir(directory):
+                continue
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    partial_files[entry.path] = PartialFile(
+                        entry.path,
+                        stat.st_size,
+                        stat.st_mtime,
+                        self._first_seen.get(entry.path, now),
+                    )
+
+        self._first_seen = {path: p.first_seen for path, p in partial_files.items()}
+        return partial_files
+
+    def _update(
+        self, downloads: list[DownloadFile], partial_files: dict[str, PartialFile]
+    ) -> None:
+        claimed = {
+            file.partial_path
+            for file in downloads
+            if file.partial_path in partial_files
+        }
+
+        # Oldest downloads first, as their files were created first
+        for file in sorted(downloads, key=lambda f: f.download_started_at):
+            if file.partial_path not in partial_files:
+                started = time.time() - (time.monotonic() - file.download_started_at)
+                candidates = [
+                    partial
+                    for path, partial in partial_files.items()
+                    if path not in claimed
+                    and _same_server(file.documents_dir, path)
+                    and partial.mtime >= started - MATCH_SLACK_SECONDS
+                    and partial.size <= file.file_size
+                ]
+                if not candidates:
+                    continue
+
+                partial = min(candidates, key=lambda p: p.first_seen)
+                file.partial_path = partial.path
+                claimed.add(partial.path)
+
+            file.record_progress(partial_files[file.partial_path].size)
+
+
+def _same_server(documents_dir: str | None, path: str) -> bool:
+    """Whether `path` is in a directory of the server writing to `documents_dir`."""
+    if documents_dir is None:
+        return True
+    # The temp and documents directories are both in the bot's directory
+    return os.path.dirname(os.path.dirname(path)) == os.path.dirname(documents_dir)
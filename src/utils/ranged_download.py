@@ -0,0 +1,280 @@
+import asyncio
+import logging
+import mmap
+import os
+import re
+from collections.abc import Awaitable, Callable
+
+import httpx
+from telegram.error import BadRequest, NetworkError, TimedOut
+
+from ..models import DownloadFile
+from .fs import fs
+
+logger = logging.getLogger(__name__)
+
+# Data received is buffered up to this size before it is written to the file
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class _Chunk:
+    """Byte range of the file still to be received."""
+
+    __slots__ = ("end", "offset")
+
+    def __init__(self, offset: int, end: int):
+        self.offset = offset
+        self.end = end
+
+
+class RangedDownloader:
+    """
+    Downloads a file over HTTP with concurrent Range requests.
+
+    The file is preallocated, and each chunk is written at its offset as it arrives,
+    with `pwrite` (or through a memory map where it isn't available), so chunks can
+    finish in any order. A chunk that fails is retried from where it stopped.
+    Servers that ignore ranges are read as a single stream.
+
+    Data is written to `<path>.part`, which is renamed to `path` once its size has
+    been checked. With `throttle`, each buffer written is paced to its rate limit.
+    Opening, checking and renaming the file go through the filesystem thread pool.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = 8 * 1024 * 1024,
+        connections: int = 4,
+        attempts: int = 3,
+        timeout: float = 60,
+        throttle: Callable[[int], Awaitable[None]] | None = None,
+    ):
+        self.chunk_size = chunk_size
+        self.connections = connections
+        self.attempts = attempts
+        self.timeout = timeout
+        self.throttle = throttle
+
+    async def download(self, url: str, path: str, file: DownloadFile) -> None:
+        """
+        Download `url` to `path`, reporting the progress to `file`.
+
+        Errors are raised as python-telegram-bot ones, so they are retried like the
+        other Bot API calls.
+
+        Raises:
+            TimedOut: If a request timed out.
+            BadRequest: If the server rejected a request.
+            NetworkError: If a chunk still failed after all its attempts, or the
+                assembled file doesn't have the expected size.
+        """
+        partial_path = f"{path}.part"
+        file.partial_path = partial_path
+        file.reports_progress = True
+
+        limits = httpx.Limits(max_connections=self.connections)
+        # Created in a thread, loading the CA certificates takes tens of milliseconds
+        client = await asyncio.to_thread(
+            httpx.AsyncClient, timeout=self.timeout, limits=limits
+        )
+        try:
+            async with client:
+                fd = await fs.run(
+                    os.open, partial_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644
+                )
+                writer = _ChunkWriter(fd)
+                try:
+                    size = await self._download(client, url, writer, file)
+                finally:
+                    writer.close()
+                    await fs.run(os.close, fd)
+        except httpx.TimeoutException as e:
+            raise TimedOut(f"Timed out fetching {url}") from e
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code < 500:
+                raise BadRequest(f"{e.response.status_code} fetching {url}") from e
+            raise NetworkError(f"{e.response.status_code} fetching {url}") from e
+        except httpx.HTTPError as e:
+            raise NetworkError(f"httpx.{e.__class__.__name__}: {e}") from e
+
+        actual_size = (await fs.stat(partial_path)).st_size
+        if actual_size != size or writer.written != size:
+            raise NetworkError(
+                f"Assembled {actual_size} bytes ({writer.written} received) "
+                f"of {size} in {partial_path}"
+            )
+        await fs.run(os.replace, partial_path, path)
+        file.partial_path = None
+
+    async def _download(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        writer: "_ChunkWriter",
+        file: DownloadFile,
+    ) -> int:
+        chunks: asyncio.Queue[_Chunk] = asyncio.Queue()
+        workers: list[asyncio.Task] = []
+        try:
+            return await self._download_chunks(
+                client, url, writer, file, chunks, workers
+            )
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _download_chunks(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        writer: "_ChunkWriter",
+        file: DownloadFile,
+        chunks: asyncio.Queue,
+        workers: list[asyncio.Task],
+    ) -> int:
+        first = _Chunk(0, self.chunk_size)
+
+        # The first chunk also tells if the server supports ranges, and the file size
+        async with client.stream(
+            "GET", url, headers={"Range": f"bytes=0-{self.chunk_size - 1}"}
+        ) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                logger.info("Server doesn't support ranges, downloading as one stream")
+                size = int(response.headers.get("content-length") or file.file_size)
+                await asyncio.to_thread(writer.allocate, size)
+                await self._receive(response, writer, _Chunk(0, size), file)
+                return size
+
+            match = CONTENT_RANGE.fullmatch(response.headers.get("content-range", ""))
+            size = int(match[3]) if match and match[3] != "*" else file.file_size
+            await asyncio.to_thread(writer.allocate, size)
+
+            for offset in range(self.chunk_size, size, self.chunk_size):
+                chunks.put_nowait(_Chunk(offset, min(offset + self.chunk_size, size)))
+            workers += [
+                asyncio.create_task(self._worker(client, url, chunks, writer, file))
+                for _ in range(min(self.connections - 1, chunks.qsize()))
+            ]
+
+            first.end = min(first.end, size)
+            try:
+                await self._receive(response, writer, first, file)
+            except httpx.HTTPError as e:
+                logger.warning(f"First chunk failed ({e}), retrying")
+                chunks.put_nowait(first)
+
+        # The first connection takes chunks from the queue once its own is done
+        workers.append(
+            asyncio.create_task(self._worker(client, url, chunks, writer, file))
+        )
+        await asyncio.gather(*workers)
+        return size
+
+    async def _worker(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        chunks: asyncio.Queue,
+        writer: "_ChunkWriter",
+        file: DownloadFile,
+    ) -> None:
+        while not chunks.empty():
+            chunk = chunks.get_nowait()
+            for attempt in range(1, self.attempts + 1):
+                try:
+                    await self._fetch(client, url, chunk, writer, file)
+                    break
+                except httpx.HTTPError as e:
+                    if attempt == self.attempts:
+                        raise
+                    logger.warning(f"Chunk at {chunk.offset} failed ({e}), retrying")
+                    await asyncio.sleep(attempt)
+
+    async def _fetch(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        chunk: _Chunk,
+        writer: "_ChunkWriter",
+        file: DownloadFile,
+    ) -> None:
+        headers = {"Range": f"bytes={chunk.offset}-{chunk.end - 1}"}
+        async with client.stream("GET", url, headers=headers) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise httpx.HTTPStatusError(
+                    f"Expected a partial response, got {response.status_code}",
+                    request=response.request,
+                    response=response,
+                )
+            await self._receive(response, writer, chunk, file)
+
+    async def _receive(
+        self,
+        response: httpx.Response,
+        writer: "_ChunkWriter",
+        chunk: _Chunk,
+        file: DownloadFile,
+    ) -> None:
+        """Write a response body from the chunk's offset, advancing it as it goes."""
+        buffer = bytearray()
+        async for data in response.aiter_bytes():
+            buffer += data
+            if len(buffer) >= WRITE_BUFFER_SIZE:
+                await self._write(writer, buffer, chunk, file)
+                buffer = bytearray()
+        if buffer:
+            await self._write(writer, buffer, chunk, file)
+
+    async def _write(
+        self,
+        writer: "_ChunkWriter",
+        data: bytearray,
+        chunk: _Chunk,
+        file: DownloadFile,
+    ) -> None:
+        if len(data) > chunk.end - chunk.offset:
+            raise httpx.RemoteProtocolError(
+                "Received more data than the requested range"
+            )
+        await asyncio.to_thread(writer.write, data, chunk.offset)
+        chunk.offset += len(data)
+        writer.written += len(data)
+        file.record_progress(writer.written)
+        if self.throttle is not None:
+            await self.throttle(len(data))
+
+
+class _ChunkWriter:
+    """Writes data at offsets of a preallocated file."""
+
+    def __init__(self, fd: int):
+        self.fd = fd
+        self.written = 0
+        self._map: mmap.mmap | None = None
+
+    def allocate(self, size: int) -> None:
+        if hasattr(os, "posix_fallocate") and size:
+            os.posix_fallocate(self.fd, 0, size)
+        else:
+            os.ftruncate(self.fd, size)
+        if not hasattr(os, "pwrite") and size:
+            self._map = mmap.mmap(self.fd, size)
+
+    def write(self, data: bytearray, offset: int) -> None:
+        if self._map is not None:
+            self._map[offset : offset + len(data)] = data
+            return
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self.fd, view, offset)
+            view = view[written:]
+            offset += written
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
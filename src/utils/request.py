@@ -0,0 +1,51 @@
+from telegram.request import BaseRequest, RequestData
+
+
+class RoutedRequest(BaseRequest):
+    """
+    Sends Bot API methods through different request objects.
+
+    Lets long calls like `getFile`, which block until the local Bot API server has
+    downloaded the whole file, use a connection pool of their own, so they can't
+    take up the connections needed to reply to messages.
+    """
+
+    def __init__(self, default: BaseRequest, routes: dict[str, BaseRequest]):
+        self.default = default
+        self.routes = routes
+
+    @property
+    def read_timeout(self) -> float | None:
+        return self.default.read_timeout
+
+    async def initialize(self) -> None:
+        for request in self._requests():
+            await request.initialize()
+
+    async def shutdown(self) -> None:
+        for request in self._requests():
+            await request.shutdown()
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: RequestData | None = None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ) -> tuple[int, bytes]:
+        request = self.routes.get(url.rsplit("/", 1)[-1], self.default)
+        return await request.do_request(
+            url,
+            method,
+            request_data,
+            read_timeout=read_timeout,
+            write_timeout=write_timeout,
+            connect_timeout=connect_timeout,
+            pool_timeout=pool_timeout,
+        )
+
+    def _requests(self) -> list[BaseRequest]:
+        return list({id(r): r for r in [self.default, *self.routes.values()]}.values())
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import random
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from enum import StrEnum
+from typing import TypeVar
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class ErrorKind(StrEnum):
+    UNAVAILABLE = "unavailable"  # The Bot API server can't be reached
+    TIMED_OUT = "timed out"  # The request took too long, the server is up
+    RATE_LIMITED = "rate limited"  # Telegram asked us to wait
+    PERMANENT = "permanent"  # Retrying won't help
+
+
+def classify(error: Exception) -> ErrorKind:
+    """Classify an error raised by a Bot API call."""
+    if isinstance(error, RetryAfter):
+        return ErrorKind.RATE_LIMITED
+    if isinstance(error, TimedOut):
+        return ErrorKind.TIMED_OUT
+    # BadRequest is a NetworkError in python-telegram-bot, but the request is wrong
+    if isinstance(error, NetworkError) and not isinstance(error, BadRequest):
+        return ErrorKind.UNAVAILABLE
+    return ErrorKind.PERMANENT
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if hasattr(retry_after, "total_seconds"):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+@dataclass
+class RetryPolicy:
+    """Exponential backoff, randomised between half the base delay and the cap."""
+
+    max_attempts: int = 5
+    base_delay: float = 5.0
+    max_delay: float = 300.0
+    multiplier: float = 2.0
+
+    def backoff(self, attempt: int) -> float:
+        """Delay before the retry following the given (0-based) attempt."""
+        cap = min(self.max_delay, self.base_delay * self.multiplier**attempt)
+        return random.uniform(self.base_delay / 2, max(cap, self.base_delay / 2))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker on the health of a Bot API server.
+
+    After `failure_threshold` consecutive failures the circuit opens and callers wait
+    instead of sending requests. Once `reset_timeout` has passed, a single probe
+    request is let through: the circuit closes if it succeeds and opens again if not.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 3,
+        reset_timeout: float = 30.0,
+        name: str = "Bot API server",
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._probing = False
+        self._changed = asyncio.Condition()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if self._probing:
+            return "half-open"
+        return "open"
+
+    async def wait_until_available(self) -> bool:
+        """
+        Wait until a request may be sent.
+
+        Returns:
+            bool: True if the caller is the probe and must report its outcome.
+        """
+        async with self._changed:
+            while self._opened_at is not None:
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining <= 0 and not self._probing:
+                    # Let this caller through as the probe
+                    self._probing = True
+                    return True
+                try:
+                    await asyncio.wait_for(
+                        self._changed.wait(), max(remaining, 0) or None
+                    )
+                except TimeoutError:
+                    pass
+            return False
+
+    async def record_success(self) -> None:
+        async with self._changed:
+            if self._opened_at is not None:
+                logger.info(f"{self.name} is reachable again, closing circuit")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+            self._changed.notify_all()
+
+    async def record_failure(self) -> None:
+        async with self._changed:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(
+                        f"{self.name} unavailable, pausing requests for "
+                        f"{self.reset_timeout}s"
+                    )
+                self._opened_at = time.monotonic()
+                self._probing = False
+            self._changed.notify_all()
+
+    async def release_probe(self) -> None:
+        """Give up the probe slot without a verdict, e.g. after a timeout."""
+        async with self._changed:
+            self._probing = False
+            self._changed.notify_all()
+
+
+async def retry_call(
+    func: Callable[[], Awaitable[T]],
+    policy: RetryPolicy,
+    breaker: CircuitBreaker | Callable[[], CircuitBreaker] | None = None,
+    on_retry: Callable[[int, float, Exception], None] | None = None,
+) -> T:
+    """
+    Call a Bot API function, retrying transient errors.
+
+    Args:
+        func (Callable): The function to call, without arguments.
+        policy (RetryPolicy): The backoff and number of attempts.
+        breaker (CircuitBreaker | Callable | None): Breaker to wait on and report
+            to, or a function returning the breaker of each attempt, when attempts
+            can go to different servers.
+        on_retry (Callable | None): Called with the attempt number, the delay before
+            the next attempt and the error, before waiting.
+
+    Returns:
+        The result of the function.
+
+    Raises:
+        Exception: The last error, if it is permanent or the attempts ran out.
+    """
+    for attempt in range(policy.max_attempts):
+        attempt_breaker = breaker() if callable(breaker) else breaker
+        is_probe = (
+            await attempt_breaker.wait_until_available() if attempt_breaker else False
+        )
+
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            if is_probe:
+                await attempt_breaker.release_probe()
+            raise
+        except Exception as e:
+            kind = classify(e)
+
+            if attempt_breaker:
+                if kind == ErrorKind.UNAVAILABLE:
+                    await attempt_breaker.record_failure()
+                elif is_probe:
+                    await attempt_breaker.release_probe()
+
+            if kind == ErrorKind.PERMANENT or attempt == policy.max_attempts - 1:
+                raise
+
+            if kind == ErrorKind.RATE_LIMITED:
+                delay = retry_after_seconds(e)
+            else:
+                delay = policy.backoff(attempt)
+
+            logger.warning(f"Attempt {attempt + 1} failed ({kind}): {e}")
+            if on_retry:
+                on_retry(attempt + 1, delay, e)
+            await asyncio.sleep(delay)
+        else:
+            if attempt_breaker:
+                await attempt_breaker.record_success()
+            return result
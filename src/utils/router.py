@@ -0,0 +1,92 @@
+import fnmatch
+import logging
+import re
+from collections.abc import Callable
+from enum import StrEnum
+
+from ..models import DownloadFile
+from .env import RoutingRule, env
+
+logger = logging.getLogger(__name__)
+
+
+class PlacementPolicy(StrEnum):
+    MOST_FREE = "most_free"  # The volume with the most unreserved free space
+    LEAST_IN_FLIGHT = (
+        "least_in_flight"  # The volume with the fewest bytes being written
+    )
+
+
+class VolumeRouter:
+    """
+    Picks the download directory (volume) a file is moved to.
+
+    Rules are checked in order, and the first one matching the file's MIME type, size
+    and name gives the volumes it can go to. Files matching no rule can go to any
+    volume. Among those, the placement policy ranks the volumes, so concurrent moves
+    are spread across disks instead of queueing up on one of them.
+    """
+
+    def __init__(
+        self,
+        volumes: list[str],
+        rules: list[RoutingRule] = (),
+        policy: PlacementPolicy = PlacementPolicy.MOST_FREE,
+    ):
+        self.volumes = list(dict.fromkeys(volumes))
+        self.rules = list(rules)
+        self.policy = PlacementPolicy(policy)
+        self._patterns = [
+            re.compile(rule.file_name) if rule.file_name else None
+            for rule in self.rules
+        ]
+
+        for rule in self.rules:
+            self.volumes += [v for v in rule.volumes if v not in self.volumes]
+
+    def candidates(self, file: DownloadFile) -> list[str]:
+        """The volumes the file can be moved to."""
+        for rule, pattern in zip(self.rules, self._patterns):
+            if self._matches(rule, pattern, file):
+                return rule.volumes
+        return self.volumes
+
+    def place(
+        self,
+        file: DownloadFile,
+        available_bytes: Callable[[str], int],
+        in_flight_bytes: Callable[[str], int],
+    ) -> list[str]:
+        """
+        Rank the volumes the file can be moved to, best first.
+
+        Args:
+            file (DownloadFile): The file to place.
+            available_bytes (Callable): Free space of a volume that isn't reserved.
+            in_flight_bytes (Callable): Bytes still to be written to a volume.
+        """
+        volumes = self.candidates(file)
+        if self.policy == PlacementPolicy.LEAST_IN_FLIGHT:
+            return sorted(
+                volumes, key=lambda v: (in_flight_bytes(v), -available_bytes(v))
+            )
+        return sorted(volumes, key=lambda v: -available_bytes(v))
+
+    @staticmethod
+    def _matches(
+        rule: RoutingRule, pattern: re.Pattern | None, file: DownloadFile
+    ) -> bool:
+        size_mb = file.file_size / 1024 / 1024
+        if rule.mime_type and not fnmatch.fnmatch(file.mime_type or "", rule.mime_type):
+            return False
+        if pattern and not pattern.search(file.file_name):
+            return False
+        if rule.min_size_mb is not None and size_mb < rule.min_size_mb:
+            return False
+        return rule.max_size_mb is None or size_mb <= rule.max_size_mb
+
+
+# The download directory comes first, and is where files go if they fit nowhere else
+volume_router = VolumeRouter(
+    [env.DOWNLOAD_TO_DIR, *env.VOLUMES], env.ROUTING_RULES, env.PLACEMENT_POLICY
+)
@@ -0,0 +1,292 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from collections import Counter, deque
+from collections.abc import Iterator
+from typing import Any, Callable, Coroutine
+
+from telegram import Bot
+
+from ..models import DownloadFile
+from .access import AccessControl, UserPolicy
+from .disk_space import DiskSpaceManager
+
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[[Bot, DownloadFile], Coroutine[Any, Any, None]]
+
+
+class QuotaExceeded(Exception):
+    """The user has reached their limit of queued bytes."""
+
+
+class DownloadScheduler:
+    """
+    Bounded worker pool that runs queued download jobs.
+
+    Jobs are kept in a priority queue and picked up by a fixed number of workers.
+    When shortest-job-first is enabled, smaller files are started before larger ones
+    (ties keep arrival order), which lowers the average completion time of a batch.
+
+    With a disk space manager, a job only starts once its size can be reserved on
+    the download filesystems. Jobs that don't fit are held in the queue, and the
+    next job that fits is started instead.
+
+    With several users, the queue is shared with weighted fair queuing: the next job
+    is taken from the user who has started the fewest bytes relative to their
+    weight, so a large batch from one user doesn't hold up everyone else. A user who
+    was idle starts level with the users who are active, instead of catching up on
+    the time they were away. Users at their limit of concurrent downloads are skipped.
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        shortest_job_first: bool = False,
+        disk_space: DiskSpaceManager | None = None,
+        access: AccessControl | None = None,
+    ):
+        self.max_workers = max(1, max_workers)
+        self.shortest_job_first = shortest_job_first
+        self.disk_space = disk_space
+        self.access = access
+        self.held_count = 0  # Queued jobs waiting for disk space
+
+        # Bytes started by each user, divided by their weight
+        self._served: dict[int | None, float] = {}
+        self._running_by_user: Counter[int | None] = Counter()
+
+        self._queue: list[tuple[int, int, DownloadFile]] = []
+        self._counter = itertools.count()
+        self._changed = asyncio.Condition()
+        self._resumed = asyncio.Event()
+        self._resumed.set()
+
+        self._running: dict[str, asyncio.Task] = {}
+        self._workers: list[asyncio.Task] = []
+        self._bot: Bot | None = None
+        self._handler: JobHandler | None = None
+
+    @property
+    def paused(self) -> bool:
+        return not self._resumed.is_set()
+
+    @property
+    def queued_files(self) -> list[DownloadFile]:
+        """Queued jobs in the order they will be started, if none is held."""
+        return list(self._fair_order())
+
+    def _fair_order(self) -> Iterator[DownloadFile]:
+        # A user's next job is always their smallest entry, so only the next job of
+        # each user is compared, in a heap keyed by the bytes they were served
+        by_user: dict[int | None, deque] = {}
+        for entry in sorted(self._queue):
+            by_user.setdefault(entry[2].user_id, deque()).append(entry)
+        heads = [
+            (self._served.get(user, 0.0), entries.popleft())
+            for user, entries in by_user.items()
+        ]
+        heapq.heapify(heads)
+        while heads:
+            served, (_, _, file) = heapq.heappop(heads)
+            yield file
+            if entries := by_user[file.user_id]:
+                heapq.heappush(heads, (served + self._cost(file), entries.popleft()))
+
+    def queued_bytes(self, user_id: int | None) -> int:
+        return sum(
+            file.file_size for _, _, file in self._queue if file.user_id == user_id
+        )
+
+    def check_quota(self, file: DownloadFile) -> None:
+        """
+        Check that a file fits in the queued bytes limit of its user.
+
+        Raises:
+            QuotaExceeded: If queueing the file would exceed the limit.
+        """
+        limit = self._policy(file).max_queued_bytes
+        if limit is None:
+            return
+        queued = self.queued_bytes(file.user_id)
+        if queued + file.file_size > limit:
+            raise QuotaExceeded(
+                f"Queue limit of {DownloadFile.convert_size(limit)} reached, "
+                f"{DownloadFile.convert_size(queued)} already queued."
+            )
+
+    @property
+    def queued_count(self) -> int:
+        return len(self._queue)
+
+    @property
+    def running_count(self) -> int:
+        return len(self._running)
+
+    def start(self, bot: Bot, handler: JobHandler) -> None:
+        """Start the worker tasks. Must be called from within the running event loop."""
+        self._bot = bot
+        self._handler = handler
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"download-worker-{i}")
+            for i in range(self.max_workers)
+        ]
+        logger.info(f"Started {self.max_workers} download workers")
+
+    async def stop(self) -> None:
+        """Cancel the workers and any running jobs."""
+        for task in [*self._running.values(), *self._workers]:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+    async def enqueue(self, file: DownloadFile) -> int:
+        """
+        Add a file to the download queue.
+
+        Returns:
+            int: The position of the file in the queue (1-based).
+        """
+        priority = file.file_size if self.shortest_job_first else 0
+        async with self._changed:
+            active_users = self._active_users()
+            if file.user_id not in active_users:
+                # Start level with the active users: no credit for the time away,
+                # and no debt for what was downloaded before
+                self._served[file.user_id] = min(
+                    (self._served.get(user, 0.0) for user in active_users), default=0.0
+                )
+            heapq.heappush(self._queue, (priority, next(self._counter), file))
+            self._changed.notify()
+        return next(
+            position
+            for position, queued in enumerate(self._fair_order(), 1)
+            if queued is file
+        )
+
+    async def cancel(self, file: DownloadFile) -> bool:
+        """
+        Cancel a queued or running job.
+
+        A job moving its file isn't cancelled right away: cancelling its task would
+        leave the copy running in its thread. Its copy is stopped at the next chunk
+        instead, and the job records the cancellation once the partial copy is
+        removed. A move that completes first isn't undone.
+
+        Returns:
+            bool: True if the job was found and cancelled, or its move stopped.
+        """
+        async with self._changed:
+            for entry in self._queue:
+                if entry[2] is file:
+                    file.cancelled = True
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                    return True
+
+        task = self._running.get(file.file_id)
+        if task is None:
+            return False
+
+        if file.moving:
+            file.stop_move.set()
+        else:
+            file.cancelled = True
+            task.cancel()
+        return True
+
+    def pause(self) -> None:
+        """Stop starting queued jobs and hold running jobs at their next checkpoint."""
+        self._resumed.clear()
+
+    async def resume(self) -> None:
+        self._resumed.set()
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def checkpoint(self) -> None:
+        """Wait here while the scheduler is paused. Called by jobs between phases."""
+        await self._resumed.wait()
+
+    def _pop_admitted(self) -> DownloadFile | None:
+        """Take the first queued job that can be started, if any."""
+        self.held_count = 0
+        if self.paused:
+            return None
+
+        # Users who have been served the least first, each in their own queue order
+        for entry in sorted(
+            self._queue, key=lambda e: (self._served.get(e[2].user_id, 0.0), e)
+        ):
+            file = entry[2]
+            max_concurrent = self._policy(file).max_concurrent
+            if (
+                max_concurrent is not None
+                and self._running_by_user[file.user_id] >= max_concurrent
+            ):
+                continue
+            if self.disk_space is None or self.disk_space.try_reserve(file):
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                user = file.user_id
+                self._served[user] = self._served.get(user, 0.0) + self._cost(file)
+                self._running_by_user[user] += 1
+                return file
+            self.held_count += 1
+        return None
+
+    def _policy(self, file: DownloadFile) -> UserPolicy:
+        return self.access.policy(file.user_id) if self.access else UserPolicy()
+
+    def _cost(self, file: DownloadFile) -> float:
+        # At least a byte, so empty files still take turns
+        return max(file.file_size, 1) / self._policy(file).weight
+
+    def _active_users(self) -> set[int | None]:
+        return {file.user_id for _, _, file in self._queue} | {
+            user for user, count in self._running_by_user.items() if count
+        }
+
+    async def _worker(self) -> None:
+        while True:
+            # Read the disk usage outside the lock, enqueueing doesn't wait for it
+            if self.disk_space is not None:
+                await self.disk_space.refresh(
+                    file.destination_dir for _, _, file in self._queue
+                )
+
+            async with self._changed:
+                file = self._pop_admitted()
+                if file is None:
+                    if not self.held_count:
+                        await self._changed.wait()
+                        continue
+                    # Check again once the cached disk usage has expired
+                    try:
+                        await asyncio.wait_for(
+                            self._changed.wait(), self.disk_space.ttl
+                        )
+                    except TimeoutError:
+                        pass
+                    continue
+
+            task = asyncio.create_task(self._handler(self._bot, file))
+            self._running[file.file_id] = task
+            try:
+                await task
+            except asyncio.CancelledError:
+                # Only swallow the cancellation if it was the job that got cancelled
+                if asyncio.current_task().cancelling():
+                    raise
+                logger.info(f"Download job cancelled: {file.file_name}")
+            except Exception as e:
+                logger.error(f"Unhandled error in download job {file.file_name}: {e}")
+            finally:
+                self._running.pop(file.file_id, None)
+                self._running_by_user[file.user_id] -= 1
+                if self.disk_space is not None:
+                    self.disk_space.release(file)
+                # Held jobs and jobs of users at their limit may be startable now
+                async with self._changed:
+                    self._changed.notify_all()
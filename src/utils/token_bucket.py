@@ -0,0 +1,60 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+
+    Tokens are refilled at `rate` per second up to `capacity`. Taking more tokens than
+    are available puts the bucket in debt, and the caller is told how long to wait,
+    so large requests are paced without being split up.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate: float, capacity: float | None = None) -> None:
+        """Change the refill rate, keeping the tokens earned at the old one."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self.rate = rate
+            self.capacity = capacity if capacity is not None else rate
+            self._tokens = min(self._tokens, self.capacity)
+
+    def reserve(self, tokens: float = 1) -> float:
+        """
+        Take tokens from the bucket.
+
+        Returns:
+            float: The number of seconds to wait before using the tokens.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= tokens
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    async def acquire(self, tokens: float = 1) -> None:
+        """Wait until the tokens are available."""
+        delay = self.reserve(tokens)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def acquire_blocking(self, tokens: float = 1) -> None:
+        """Block the current thread until the tokens are available."""
+        delay = self.reserve(tokens)
+        if delay:
+            time.sleep(delay)
@@ -0,0 +1,331 @@
+import asyncio
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import secrets
+import time
+from collections.abc import Iterator
+from typing import Any
+
+import httpx
+
+from .env import env
+
+logger = logging.getLogger(__name__)
+
+# Spans are timed with the monotonic clock and only converted to wall-clock time on
+# export, so a clock adjustment never gives a span a negative or skewed duration
+_EPOCH_OFFSET = time.time() - time.monotonic()
+
+_current_span: contextvars.ContextVar["Span | None"] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+def new_trace_id() -> str:
+    return secrets.token_hex(16)
+
+
+class Span:
+    """A timed phase of a download job, with attributes describing it."""
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: str | None = None,
+        start: float | None = None,
+        attributes: dict[str, Any] | None = None,
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start = time.monotonic() if start is None else start
+        self.end: float | None = None
+        self.attributes = attributes or {}
+        self.error: str | None = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.monotonic()) - self.start
+
+    @property
+    def start_time(self) -> float:
+        """Start as a Unix timestamp."""
+        return _EPOCH_OFFSET + self.start
+
+    @property
+    def end_time(self) -> float:
+        return self.start_time + self.duration
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.start_time, 6),
+            "duration": round(self.duration, 6),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class JsonlSpanExporter:
+    """
+    Appends spans to a JSON-lines file, one span per line.
+
+    When the file reaches `max_bytes` it is renamed to `<path>.1` (and older files
+    shifted up to `<path>.<backups>`), like `logging.handlers.RotatingFileHandler`.
+    """
+
+    def __init__(self, path: str, max_bytes: int, backups: int = 3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+    async def export(self, spans: list[Span]) -> None:
+        lines = "".join(
+            json.dumps(span.to_dict(), default=str) + "\n" for span in spans
+        )
+        await asyncio.to_thread(self._write, lines)
+
+    async def close(self) -> None:
+        pass
+
+    def _write(self, lines: str) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        try:
+            if os.path.getsize(self.path) >= self.max_bytes:
+                self._rotate()
+        except FileNotFoundError:
+            pass
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    def _rotate(self) -> None:
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+class OtlpSpanExporter:
+    """Sends spans to an OpenTelemetry collector, in the OTLP/HTTP JSON encoding."""
+
+    def __init__(
+        self,
+        endpoint: str,
+        service_name: str = "telegram-downloader",
+        timeout: float = 10.0,
+    ):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self._client = httpx.AsyncClient(timeout=timeout)
+
+    async def export(self, spans: list[Span]) -> None:
+        payload = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            _otlp_attribute("service.name", self.service_name)
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": __name__},
+                            "spans": [self._span(span) for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+        response = await self._client.post(self.endpoint, json=payload)
+        response.raise_for_status()
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+    @staticmethod
+    def _span(span: Span) -> dict[str, Any]:
+        otlp_span = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(int(span.start_time * 1e9)),
+            "endTimeUnixNano": str(int(span.end_time * 1e9)),
+            "attributes": [
+                _otlp_attribute(key, value)
+                for key, value in span.attributes.items()
+                if value is not None
+            ],
+            # STATUS_CODE_ERROR or STATUS_CODE_OK
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        return otlp_span
+
+
+def _otlp_attribute(key: str, value: Any) -> dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+SpanExporter = JsonlSpanExporter | OtlpSpanExporter
+
+
+class Tracer:
+    """
+    Records the spans of download jobs and exports them in batches.
+
+    Each job has its own trace ID, kept on the `DownloadFile`, so the phases of a job
+    handled by different tasks (the message, the confirmation, the worker) end up in
+    the same trace. Spans opened with `span` within another one become its children.
+
+    Finished spans are buffered in memory and exported by a background task every
+    `flush_interval` seconds. Without an exporter, spans are timed but not kept.
+    """
+
+    def __init__(
+        self,
+        exporter: SpanExporter | None,
+        flush_interval: float = 5.0,
+        max_pending: int = 10000,
+    ):
+        self.exporter = exporter
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._pending: list[Span] = []
+        self._task: asyncio.Task | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    @contextlib.contextmanager
+    def span(
+        self, name: str, trace_id: str | None = None, **attributes: Any
+    ) -> Iterator[Span]:
+        """
+        Time the block as a span, the child of the current span of the same trace.
+
+        An exception leaving the block is recorded as the span's error.
+        """
+        parent = _current_span.get()
+        if parent is not None and trace_id in (None, parent.trace_id):
+            span = Span(name, parent.trace_id, parent.span_id, attributes=attributes)
+        else:
+            span = Span(name, trace_id or new_trace_id(), attributes=attributes)
+
+        token = _current_span.set(span)
+        try:
+            yield span
+        except asyncio.CancelledError:
+            span.error = "cancelled"
+            raise
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            self.finish(span)
+
+    def record(
+        self,
+        name: str,
+        trace_id: str,
+        start: float,
+        end: float | None = None,
+        parent: Span | None = None,
+        **attributes: Any,
+    ) -> Span:
+        """Record a span that started earlier, e.g. the wait for a confirmation."""
+        span = Span(
+            name,
+            trace_id,
+            parent.span_id if parent else None,
+            start=start,
+            attributes=attributes,
+        )
+        span.end = end
+        self.finish(span)
+        return span
+
+    def finish(self, span: Span) -> None:
+        if span.end is None:
+            span.end = time.monotonic()
+        if not self.enabled:
+            return
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append(span)
+
+    def start(self) -> None:
+        if self.enabled:
+            self._task = asyncio.create_task(self._loop(), name="tracing-flush")
+
+    async def stop(self) -> None:
+        """Stop the flush task and export the remaining spans."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.enabled:
+            await self.flush()
+            await self.exporter.close()
+
+    async def flush(self) -> None:
+        spans, self._pending = self._pending, []
+        if not spans:
+            return
+        try:
+            await self.exporter.export(spans)
+        except Exception as e:
+            # Tracing must never get in the way of downloads, the spans are lost
+            logger.warning(f"Couldn't export {len(spans)} spans: {e}")
+            self.dropped += len(spans)
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+def build_tracer() -> Tracer:
+    if env.TRACING == "jsonl":
+        exporter = JsonlSpanExporter(
+            env.TRACE_PATH or f"{env.BOT_API_DIR}downloader-traces.jsonl",
+            max_bytes=env.TRACE_MAX_MB * 1024 * 1024,
+            backups=env.TRACE_BACKUPS,
+        )
+    elif env.TRACING == "otlp":
+        exporter = OtlpSpanExporter(env.OTLP_ENDPOINT)
+    else:
+        exporter = None
+    return Tracer(exporter, flush_interval=env.TRACE_FLUSH_INTERVAL)
+
+
+# Spans of the download jobs, started in the application's post_init
+tracer = build_tracer()
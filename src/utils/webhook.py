@@ -0,0 +1,165 @@
+import asyncio
+import hmac
+import json
+import logging
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = "x-telegram-bot-api-secret-token"
+
+# Largest update accepted, the Bot API server sends much smaller ones
+MAX_BODY_SIZE = 1024 * 1024
+
+# Longest request or header line, and most headers, accepted in a request
+MAX_LINE_LENGTH = 8 * 1024
+MAX_HEADERS = 100
+
+# Seconds an idle keep-alive connection is kept open
+IDLE_TIMEOUT = 60
+
+
+class WebhookServer:
+    """
+    Minimal HTTP server receiving updates pushed by the Bot API server.
+
+    Updates are put on the application's update queue, so they are handled by the
+    same handlers as in polling mode. Requests must be POSTed to `path` with the
+    secret token set in the webhook. At most `max_connections` connections are
+    served at once; the others wait to be accepted.
+    """
+
+    def __init__(
+        self,
+        application: Application,
+        listen: str,
+        port: int,
+        path: str,
+        secret_token: str,
+        max_connections: int = 40,
+    ):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.max_connections = max_connections
+        self._connections = asyncio.Semaphore(max_connections)
+        self._server: asyncio.Server | None = None
+        self._handlers: set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(
+            self._handle, self.listen, self.port, limit=MAX_LINE_LENGTH
+        )
+        if not self.port:
+            self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Listening for webhook updates on {self.listen}:{self.port}")
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            # Keep-alive connections are still waiting for their next request
+            for task in self._handlers:
+                task.cancel()
+            await asyncio.gather(*self._handlers, return_exceptions=True)
+            await self._server.wait_closed()
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        task = asyncio.current_task()
+        self._handlers.add(task)
+        try:
+            async with self._connections:
+                while await self._handle_request(reader, writer):
+                    pass
+        except (OSError, TimeoutError, asyncio.IncompleteReadError) as e:
+            logger.debug(f"Webhook connection closed: {e}")
+        except asyncio.CancelledError:
+            pass  # Cancelled by stop()
+        finally:
+            self._handlers.discard(task)
+            writer.close()
+
+    async def _handle_request(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> bool:
+        """
+        Handle one request on a keep-alive connection.
+
+        Returns:
+            bool: Whether the connection can be used for another request.
+        """
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+            if not request_line:
+                return False
+
+            headers = {}
+            header_count = 0
+            while (line := await asyncio.wait_for(reader.readline(), 10)).strip():
+                header_count += 1
+                if header_count > MAX_HEADERS:
+                    raise ValueError(f"More than {MAX_HEADERS} headers")
+                key, _, value = line.decode("latin-1").partition(":")
+                headers[key.strip().lower()] = value.strip()
+        except (ValueError, asyncio.LimitOverrunError) as e:
+            # Raised for lines over the limit, the request can't be read past them
+            logger.debug(f"Invalid webhook request: {e}")
+            await self._respond(writer, "400 Bad Request", close=True)
+            return False
+
+        parts = request_line.decode("latin-1").split()
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            length = -1
+        # The body can't be skipped without a valid length, so the connection is closed
+        if length < 0:
+            await self._respond(writer, "400 Bad Request", close=True)
+            return False
+        if length > MAX_BODY_SIZE:
+            await self._respond(writer, "413 Payload Too Large", close=True)
+            return False
+        body = await asyncio.wait_for(reader.readexactly(length), 10)
+
+        if len(parts) < 2 or parts[1].split("?")[0] != self.path:
+            status = "404 Not Found"
+        elif parts[0] != "POST":
+            status = "405 Method Not Allowed"
+        elif not hmac.compare_digest(
+            headers.get(SECRET_TOKEN_HEADER, "").encode("latin-1"),
+            self.secret_token.encode(),
+        ):
+            logger.warning("Webhook request with an invalid secret token")
+            status = "403 Forbidden"
+        else:
+            status = await self._process(body)
+
+        keep_alive = headers.get("connection", "").lower() != "close"
+        await self._respond(writer, status, close=not keep_alive)
+        return keep_alive
+
+    async def _process(self, body: bytes) -> str:
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Invalid webhook update: {e}")
+            return "400 Bad Request"
+
+        await self.application.update_queue.put(update)
+        return "200 OK"
+
+    @staticmethod
+    async def _respond(
+        writer: asyncio.StreamWriter, status: str, close: bool = False
+    ) -> None:
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Length: 0\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n".encode()
+        )
+        await writer.drain()